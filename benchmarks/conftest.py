@@ -0,0 +1,60 @@
+# -*- coding: UTF-8 -*-
+# The benchmarks run AutoVehicleRig against the recording maya stand-in in benchmarks/mayastub, so they
+# need nothing but Python and pytest. Results are printed at the end of the run, and written as JSON to
+# the file named by AVR_BENCH_REPORT when it is set.
+import json
+import os
+import sys
+import time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'scripts'))
+sys.path.insert(0, os.path.join(HERE, 'mayastub'))
+
+from maya._scene import SCENE  # noqa: E402
+
+
+RESULTS = []
+
+
+@pytest.fixture
+def scene():
+    SCENE.reset()
+    yield SCENE
+    # No step may leave an undo chunk open or the viewport suspended
+    assert SCENE.open_chunks == 0
+    assert not SCENE.refresh_suspended
+
+
+@pytest.fixture
+def measure(request):
+    # measure(step, func, *args) runs one rig step and returns (result, number of maya.cmds calls)
+    def run(step, func, *args, **kwargs):
+        SCENE.calls.clear()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        calls = sum(SCENE.calls.values())
+        RESULTS.append({'test': request.node.name, 'step': step, 'calls': calls, 'seconds': elapsed,
+                        'commands': dict(SCENE.calls)})
+        return result, calls
+    return run
+
+
+def pytest_terminal_summary(terminalreporter):
+    path = os.environ.get('AVR_BENCH_REPORT')
+    if path:
+        with open(path, 'w') as f:
+            json.dump(RESULTS, f, indent=2)
+
+    # The table is skipped with -q
+    if not RESULTS or terminalreporter.verbosity < 0:
+        return
+
+    terminalreporter.section('AVR benchmarks')
+    terminalreporter.write_line('{:<48} {:<22} {:>8} {:>10}'.format('test', 'step', 'calls', 'seconds'))
+    for row in RESULTS:
+        terminalreporter.write_line('{:<48} {:<22} {:>8} {:>10.4f}'.format(
+            row['test'][:48], row['step'], row['calls'], row['seconds']))
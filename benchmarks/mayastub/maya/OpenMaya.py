@@ -0,0 +1,459 @@
+# -*- coding: UTF-8 -*-
+# Stand-in for the parts of maya.OpenMaya (API 1.0) that AVR uses: matrices, rotations, times, selection
+# lists, plugs and DG/DAG modifiers working on the in-memory scene of maya._scene, plus the attributes and
+# data blocks of plug-in nodes. Curves are evaluated as degree 1 polylines through their 'cvs' attribute,
+# with one parameter unit per span, and meshes hand out the float buffer in their 'points' attribute.
+import math
+
+from maya._scene import SCENE, ANGLE_ATTRS, IDENTITY, euler_from_matrix, euler_matrix, inverse, mult, transform_point
+
+
+class MSpace(object):
+    kInvalid = 0
+    kTransform = 1
+    kPreTransform = 2
+    kPostTransform = 3
+    kWorld = 4
+    kObject = kPreTransform
+
+
+class MGlobal(object):
+
+    @staticmethod
+    def displayInfo(text):
+        SCENE.messages.append(('info', text))
+
+    @staticmethod
+    def displayWarning(text):
+        SCENE.messages.append(('warning', text))
+
+    @staticmethod
+    def displayError(text):
+        SCENE.messages.append(('error', text))
+
+
+class MVector(object):
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = float(x), float(y), float(z)
+
+
+class MPoint(object):
+
+    def __init__(self, x=0.0, y=0.0, z=0.0, w=1.0):
+        self.x, self.y, self.z, self.w = float(x), float(y), float(z), float(w)
+
+
+class MPointArray(list):
+
+    def length(self):
+        return len(self)
+
+
+class MDoubleArray(list):
+
+    def length(self):
+        return len(self)
+
+
+kUnknownParameter = 'kUnknownParameter'
+
+
+class MTime(object):
+    kInvalid = 0
+    kHours = 1
+    kMinutes = 2
+    kSeconds = 3
+    kMilliseconds = 4
+    kGames = 5
+    kFilm = 6
+    kPALFrame = 7
+    kNTSCFrame = 8
+    # unit -> units per second
+    RATES = {kHours: 1 / 3600.0, kMinutes: 1 / 60.0, kSeconds: 1.0, kMilliseconds: 1000.0,
+             kGames: 15.0, kFilm: 24.0, kPALFrame: 25.0, kNTSCFrame: 30.0}
+
+    def __init__(self, value=0.0, unit=kInvalid):
+        self._value = float(value)
+        self._unit = unit or SCENE.time_unit
+
+    @staticmethod
+    def uiUnit():
+        return SCENE.time_unit
+
+    def value(self):
+        return self._value
+
+    def unit(self):
+        return self._unit
+
+    def asUnits(self, unit):
+        return self._value * self.RATES[unit] / self.RATES[self._unit]
+
+
+class MMatrix(object):
+
+    def __init__(self, values=IDENTITY):
+        self._values = tuple(values)
+
+    def __call__(self, row, col):
+        return self._values[row * 4 + col]
+
+    def __mul__(self, other):
+        return MMatrix(mult(self._values, other._values))
+
+    def inverse(self):
+        return MMatrix(inverse(self._values))
+
+
+class MScriptUtil(object):
+
+    @staticmethod
+    def createMatrixFromList(values, matrix):
+        matrix._values = tuple(float(value) for value in values)
+
+
+class MEulerRotation(object):
+
+    kXYZ = 0
+
+    def __init__(self, x=0.0, y=0.0, z=0.0, order=kXYZ):
+        self.x, self.y, self.z, self.order = float(x), float(y), float(z), order
+
+    def asMatrix(self):
+        return MMatrix(euler_matrix(self.x, self.y, self.z))
+
+
+class MTransformationMatrix(object):
+
+    def __init__(self, matrix=None):
+        self._values = matrix._values if matrix is not None else IDENTITY
+
+    def asMatrix(self):
+        return MMatrix(self._values)
+
+    def getTranslation(self, space):
+        return MVector(*self._values[12:15])
+
+    def setTranslation(self, vector, space):
+        self._values = self._values[:12] + (vector.x, vector.y, vector.z, 1.0)
+
+    def eulerRotation(self):
+        return MEulerRotation(*euler_from_matrix(self._values))
+
+
+class MTypeId(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+class MObject(object):
+    # Points at a scene node, at an attribute of a plug-in node, or at nothing yet for nodes a modifier has
+    # not created
+
+    def __init__(self, node=None, attr=None):
+        self._node = node
+        self._attr = attr
+
+    def isNull(self):
+        return self._node is None
+
+
+class MSelectionList(object):
+
+    def __init__(self):
+        self._nodes = []
+
+    def add(self, name):
+        node = SCENE.find(name)
+        if node is None:
+            raise RuntimeError('(kInvalidParameter): Object does not exist')
+        self._nodes.append(node)
+
+    def length(self):
+        return len(self._nodes)
+
+    def getDependNode(self, index, obj):
+        obj._node = self._nodes[index]
+
+    def getDagPath(self, index, path):
+        path._node = self._nodes[index]
+
+
+class MDagPath(object):
+
+    def __init__(self):
+        self._node = None
+
+    def inclusiveMatrix(self):
+        node = self._node if self._node.is_transform else self._node.parent
+        return MMatrix(SCENE.world_matrix(node))
+
+
+class MPlug(object):
+
+    def __init__(self, obj, attr):
+        self._obj = obj
+        self.attr = attr
+
+    def name(self):
+        return '{}.{}'.format(self._obj._node.name, self.attr)
+
+    def __eq__(self, other):
+        # Against an attribute, like in Maya: true for the attribute's plug and its array elements
+        if isinstance(other, MObject):
+            return self.attr.split('[', 1)[0] == other._attr
+        return isinstance(other, MPlug) and self.name() == other.name()
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class MFnDependencyNode(object):
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def name(self):
+        return self._obj._node.name
+
+    def findPlug(self, attr, want_networked=False):
+        return MPlug(self._obj, attr)
+
+
+class MDGModifier(object):
+    # Operations are queued and run by doIt, undoIt reverts everything done so far in reverse order
+
+    def __init__(self):
+        self._queue = []
+        self._done = []
+
+    def createNode(self, node_type, parent=None):
+        obj = MObject()
+        self._queue.append(('create', obj, node_type, parent))
+        return obj
+
+    def renameNode(self, obj, name):
+        self._queue.append(('rename', obj, name))
+
+    def newPlugValueDouble(self, plug, value):
+        self._queue.append(('set', plug, value))
+
+    def connect(self, source, destination):
+        self._queue.append(('connect', destination, source))
+
+    def doIt(self):
+        while self._queue:
+            operation = self._queue.pop(0)
+            self._done.append(self._run(operation))
+
+    def undoIt(self):
+        while self._done:
+            self._done.pop()()
+
+    def _run(self, operation):
+        kind, target = operation[0], operation[1]
+        if kind == 'create':
+            parent = operation[3]._node if operation[3] is not None else None
+            target._node = SCENE.create(operation[2], operation[2] + '1', parent)
+            return lambda: SCENE.remove(target._node)
+
+        if kind == 'rename':
+            old = target._node.name
+            SCENE.rename(target._node, operation[2])
+            return lambda: SCENE.rename(target._node, old)
+
+        if kind == 'connect':
+            destination, source = target.name(), operation[2].name()
+            SCENE.connections[destination] = source
+            return lambda: SCENE.connections.pop(destination, None)
+
+        # Doubles are in internal units, angles are radians there and degrees on the node
+        node, attr = target._obj._node, target.attr
+        value = operation[2]
+        if attr[:-1] in ANGLE_ATTRS:
+            value = math.degrees(value)
+        index = 'XYZ'.index(attr[-1])
+        old = node.attrs[attr[:-1]][index]
+        node.attrs[attr[:-1]][index] = value
+        return lambda: node.attrs[attr[:-1]].__setitem__(index, old)
+
+
+class MDagModifier(MDGModifier):
+    pass
+
+
+class MFnNurbsCurve(object):
+    kOpen = 1
+    kClosed = 2
+    kPeriodic = 3
+
+    def __init__(self, path):
+        self._node = path._node
+
+    def _points(self, space):
+        points = self._node.attrs['cvs']
+        if space == MSpace.kWorld:
+            world = SCENE.world_matrix(self._node.parent)
+            points = [transform_point(point, world) for point in points]
+        return points
+
+    def degree(self):
+        return self._node.attrs.get('degree', 1)
+
+    def form(self):
+        return self.kPeriodic if self._node.attrs.get('periodic') else self.kOpen
+
+    def numSpans(self):
+        return len(self._node.attrs['cvs']) - self.degree()
+
+    def getKnots(self, knots):
+        knots[:] = self._node.attrs.get('knots') or [float(index) for index in range(len(self._node.attrs['cvs']))]
+
+    def getCVs(self, points, space=MSpace.kObject):
+        points[:] = [MPoint(*point) for point in self._points(space)]
+
+    def getPointAtParam(self, param, point, space=MSpace.kObject):
+        points = self._points(space)
+        degree = self.degree()
+        if degree == 1:
+            index = min(max(int(param), 0), len(points) - 2)
+            blend = param - index
+            point.x, point.y, point.z = [low + (high - low) * blend
+                                         for low, high in zip(points[index], points[index + 1])]
+            return
+
+        # de Boor, on Maya's knots with the unused first and last knot added back
+        knots = MDoubleArray()
+        self.getKnots(knots)
+        knots = [knots[0]] + list(knots) + [knots[-1]]
+        span = max(index for index in range(degree, len(points)) if knots[index] <= param or index == degree)
+        values = [list(points[span - degree + index]) for index in range(degree + 1)]
+        for level in range(1, degree + 1):
+            for index in range(degree, level - 1, -1):
+                low, high = knots[index + span - degree], knots[index + 1 + span - level]
+                blend = (param - low) / (high - low)
+                values[index] = [a + (b - a) * blend for a, b in zip(values[index - 1], values[index])]
+        point.x, point.y, point.z = values[degree]
+
+
+class MFnMesh(object):
+    # Vertices are the 'points' attribute of the mesh shape, a flat array.array('f') of x, y, z
+
+    def __init__(self, path):
+        # A path to the transform works on its mesh shape, like in Maya
+        node = path._node
+        self._node = node if not node.is_transform else [child for child in node.children if child.type == 'mesh'][0]
+
+    def numVertices(self):
+        return len(self._node.attrs.get('points', ())) // 3
+
+    def getRawPoints(self):
+        # Like the SWIG float pointer Maya returns, int() gives the buffer address
+        return _Pointer(self._node.attrs['points'].buffer_info()[0])
+
+
+class _Pointer(object):
+
+    def __init__(self, address):
+        self._address = address
+
+    def __int__(self):
+        return self._address
+
+
+# Plug-in node attributes and the data block their compute() gets. Attributes are MObjects holding their
+# long name. Maya hands compute() its data block, the benchmarks make one from {attribute name: value}.
+
+class MFnData(object):
+    kString = 4
+
+
+class MFnAttribute(object):
+
+    def create(self, long_name, short_name, *args):
+        return MObject(attr=long_name)
+
+    def setArray(self, value):
+        pass
+
+    def setUsesArrayDataBuilder(self, value):
+        pass
+
+    def setWritable(self, value):
+        pass
+
+    def setStorable(self, value):
+        pass
+
+
+class MFnTypedAttribute(MFnAttribute):
+    pass
+
+
+class MFnUnitAttribute(MFnAttribute):
+    kTime = 3
+
+
+class MFnMatrixAttribute(MFnAttribute):
+    pass
+
+
+class MDataBlock(object):
+
+    def __init__(self, inputs):
+        self._inputs = inputs
+        self.outputs = {}  # array attribute name -> {index: value}
+        self.clean = []
+
+    def inputValue(self, attr):
+        return MDataHandle(self._inputs[attr._attr])
+
+    def outputArrayValue(self, attr):
+        return MArrayDataHandle(self.outputs.setdefault(attr._attr, {}))
+
+    def setClean(self, plug):
+        self.clean.append(plug.attr)
+
+
+class MDataHandle(object):
+
+    def __init__(self, value=None, elements=None, index=None):
+        self._value = value
+        self._elements = elements
+        self._index = index
+
+    def asString(self):
+        return self._value
+
+    def asTime(self):
+        return self._value
+
+    def setMMatrix(self, matrix):
+        self._elements[self._index] = matrix
+
+
+class MArrayDataBuilder(object):
+
+    def __init__(self):
+        self.elements = {}
+
+    def addElement(self, index):
+        return MDataHandle(elements=self.elements, index=index)
+
+
+class MArrayDataHandle(object):
+
+    def __init__(self, elements):
+        self._elements = elements
+
+    def builder(self):
+        return MArrayDataBuilder()
+
+    def set(self, builder):
+        self._elements.clear()
+        self._elements.update(builder.elements)
+
+    def setAllClean(self):
+        pass
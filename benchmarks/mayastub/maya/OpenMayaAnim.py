@@ -0,0 +1,35 @@
+# -*- coding: UTF-8 -*-
+# Stand-in for maya.OpenMayaAnim: unitless keys on anim curves, recorded in an MAnimCurveChange so that
+# undoIt removes them again.
+
+
+class MAnimCurveChange(object):
+
+    def __init__(self):
+        self._keys = []
+
+    def undoIt(self):
+        for node, key in reversed(self._keys):
+            node.attrs['keys'] = [item for item in node.attrs['keys'] if item != key]
+
+    def redoIt(self):
+        for node, key in self._keys:
+            node.attrs['keys'] = sorted(node.attrs.get('keys', []) + [key])
+
+
+class MFnAnimCurve(object):
+    kTangentGlobal = 0
+    kTangentFixed = 1
+    kTangentLinear = 2
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def addKey(self, unitless_input, value, tangent_in=kTangentGlobal, tangent_out=kTangentGlobal, change=None):
+        node = self._obj._node
+        key = (float(unitless_input), float(value))
+        keys = [item for item in node.attrs.get('keys', []) if item[0] != key[0]]
+        node.attrs['keys'] = sorted(keys + [key])
+        if change is not None:
+            change._keys.append((node, key))
+        return node.attrs['keys'].index(key)
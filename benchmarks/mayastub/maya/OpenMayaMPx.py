@@ -0,0 +1,44 @@
+# -*- coding: UTF-8 -*-
+# Stand-in for maya.OpenMayaMPx: enough for scripted plug-ins to register commands and nodes.
+from maya._scene import SCENE
+
+
+class MPxCommand(object):
+
+    def isUndoable(self):
+        return False
+
+
+class MPxNode(object):
+
+    @staticmethod
+    def addAttribute(attr):
+        pass
+
+    @staticmethod
+    def attributeAffects(source, destination):
+        pass
+
+
+def asMPxPtr(obj):
+    return obj
+
+
+class MFnPlugin(object):
+
+    def __init__(self, mobject, vendor='', version='', api_version='Any'):
+        self.vendor = vendor
+
+    def registerCommand(self, name, creator):
+        SCENE.commands[name] = creator
+
+    def deregisterCommand(self, name):
+        SCENE.commands.pop(name, None)
+
+    def registerNode(self, name, type_id, creator, initializer):
+        # Like Maya, the attributes are created right away
+        initializer()
+        SCENE.node_types[name] = (creator, initializer)
+
+    def deregisterNode(self, type_id):
+        pass
@@ -0,0 +1,2 @@
+# -*- coding: UTF-8 -*-
+# Stand-in for the maya package, used by the benchmarks to run AutoVehicleRig without Maya.
@@ -0,0 +1,418 @@
+# -*- coding: UTF-8 -*-
+# In-memory scene graph behind the maya stand-in, plus the bit of 4x4 matrix math it needs.
+# It models what the AVR steps touch: the DAG hierarchy, transform channels and matrices, mesh bounding
+# boxes, plain attributes, connections, selection, undo chunks and plug-in commands. It does not evaluate
+# the DG: connected plugs keep whatever value was set on them, except that at_time(frame) plays the
+# anim curves driving transform channels.
+#
+# Short names are unique in this scene (a clashing name gets a number, like createNode does), so long names
+# and '|' paths resolve through their last component. Node names include their namespace ('Car01:Body');
+# new nodes go into the current namespace, and with relative names on, lookups and results are relative to it.
+import collections
+import contextlib
+import math
+
+
+IDENTITY = (1.0, 0.0, 0.0, 0.0,
+            0.0, 1.0, 0.0, 0.0,
+            0.0, 0.0, 1.0, 0.0,
+            0.0, 0.0, 0.0, 1.0)
+
+
+def mult(a, b):
+    # Row-major 4x4 product, row vectors like Maya: world = local * parent
+    if a == IDENTITY:
+        return tuple(b)
+    if b == IDENTITY:
+        return tuple(a)
+    result = []
+    for row in range(0, 16, 4):
+        a0, a1, a2, a3 = a[row], a[row + 1], a[row + 2], a[row + 3]
+        for col in range(4):
+            result.append(a0 * b[col] + a1 * b[4 + col] + a2 * b[8 + col] + a3 * b[12 + col])
+    return tuple(result)
+
+
+def inverse(m):
+    # Gauss-Jordan with partial pivoting
+    rows = [list(m[i * 4:i * 4 + 4]) + [1.0 if i == j else 0.0 for j in range(4)] for i in range(4)]
+    for col in range(4):
+        pivot = max(range(col, 4), key=lambda row: abs(rows[row][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            raise ValueError('Singular matrix')
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = rows[col][col]
+        rows[col] = [value / scale for value in rows[col]]
+        for row in range(4):
+            if row != col and rows[row][col]:
+                factor = rows[row][col]
+                rows[row] = [a - factor * b for a, b in zip(rows[row], rows[col])]
+    return tuple(value for row in rows for value in row[4:])
+
+
+def transform_point(point, m):
+    x, y, z = point
+    return tuple(x * m[col] + y * m[4 + col] + z * m[8 + col] + m[12 + col] for col in range(3))
+
+
+def translation_matrix(t):
+    return IDENTITY[:12] + (float(t[0]), float(t[1]), float(t[2]), 1.0)
+
+
+def scale_matrix(s):
+    return (s[0], 0.0, 0.0, 0.0, 0.0, s[1], 0.0, 0.0, 0.0, 0.0, s[2], 0.0, 0.0, 0.0, 0.0, 1.0)
+
+
+def euler_matrix(x, y, z):
+    # Radians, rotate order xyz: Rx * Ry * Rz
+    cx, sx, cy, sy, cz, sz = math.cos(x), math.sin(x), math.cos(y), math.sin(y), math.cos(z), math.sin(z)
+    rx = (1, 0, 0, 0, 0, cx, sx, 0, 0, -sx, cx, 0, 0, 0, 0, 1)
+    ry = (cy, 0, -sy, 0, 0, 1, 0, 0, sy, 0, cy, 0, 0, 0, 0, 1)
+    rz = (cz, sz, 0, 0, -sz, cz, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1)
+    return mult(mult(rx, ry), rz)
+
+
+def euler_from_matrix(m):
+    # Radians, rotate order xyz, from the (normalized) rotation part
+    rows = []
+    for row in range(3):
+        vector = m[row * 4:row * 4 + 3]
+        length = math.sqrt(sum(value * value for value in vector)) or 1.0
+        rows.append([value / length for value in vector])
+    x = math.atan2(rows[1][2], rows[2][2])
+    y = math.asin(max(-1.0, min(1.0, -rows[0][2])))
+    z = math.atan2(rows[0][1], rows[0][0])
+    return x, y, z
+
+
+def curve_value(keys, frame):
+    # Linear interpolation through [(frame, value)], held before the first and after the last key
+    if frame <= keys[0][0]:
+        return keys[0][1]
+    for (low, low_value), (high, high_value) in zip(keys, keys[1:]):
+        if frame <= high:
+            return low_value + (high_value - low_value) * (frame - low) / (high - low)
+    return keys[-1][1]
+
+
+# Node types and what they inherit from, as far as 'ls -type' needs it
+INHERITS = {'joint': ('transform', 'dagNode'),
+            'transform': ('dagNode',),
+            'mesh': ('shape', 'dagNode'),
+            'nurbsCurve': ('shape', 'dagNode')}
+TRANSFORMS = ('transform', 'joint')
+DAG_TYPES = ('transform', 'joint', 'mesh', 'nurbsCurve', 'pointConstraint', 'orientConstraint')
+
+VECTOR_ATTRS = ('translate', 'rotate', 'scale', 'jointOrient', 'rotatePivot', 'scalePivot')
+ANGLE_ATTRS = ('rotate', 'jointOrient')
+MATRIX_ATTRS = ('matrix', 'worldMatrix', 'worldInverseMatrix', 'parentMatrix', 'parentInverseMatrix')
+
+
+class Node(object):
+
+    __slots__ = ('name', 'type', 'parent', 'children', 'attrs', 'uuid')
+
+    def __init__(self, name, node_type, parent, uuid):
+        self.name = name
+        self.type = node_type
+        self.parent = parent
+        self.children = []
+        self.uuid = uuid
+        self.attrs = {}
+        if node_type in TRANSFORMS:
+            self.attrs.update(translate=[0.0, 0.0, 0.0], rotate=[0.0, 0.0, 0.0], scale=[1.0, 1.0, 1.0],
+                              rotatePivot=[0.0, 0.0, 0.0], scalePivot=[0.0, 0.0, 0.0],
+                              offsetParentMatrix=IDENTITY, visibility=True, overrideEnabled=False,
+                              overrideColor=0)
+        if node_type == 'joint':
+            self.attrs['jointOrient'] = [0.0, 0.0, 0.0]
+
+    def is_a(self, node_type):
+        return self.type == node_type or node_type in INHERITS.get(self.type, ())
+
+    @property
+    def is_transform(self):
+        return self.type in TRANSFORMS
+
+
+class Scene(object):
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.nodes = collections.OrderedDict()  # short name -> Node, in creation order
+        self.uuids = {}
+        self.selection = []
+        self.connections = {}  # destination plug -> source plug
+        self.calls = collections.Counter()  # maya.cmds command -> number of calls
+        self.messages = []  # (level, text) from MGlobal.display*
+        self.plugins = {}  # plug-in path -> module
+        self.commands = {}  # plug-in command name -> creator
+        self.node_types = {}  # plug-in node name -> (creator, initializer)
+        self.undo_queue = []
+        self.undo_state = True
+        self.open_chunks = 0
+        self.chunk_names = []
+        self.refresh_suspended = False
+        self.batch = False
+        self.imports = {}  # file name -> [(node name, node type)] created by 'file -i'
+        self.namespaces = set()
+        self.file_name = ''
+        self.saved = []  # (file name, file type) of every 'file -save'
+        self.namespace = ''  # Current namespace, '' is the root
+        self.relative = False
+        self.evaluation_mode = 'parallel'
+        self.time = 1.0
+        self.time_unit = 6  # MTime.kFilm, 24 frames per second
+        self.playback = (1.0, 120.0)
+        self._next_uuid = 0
+        self._next_index = {}  # name without trailing digits -> next number to try
+
+    # Namespaces
+
+    def qualify(self, name):
+        # Absolute ':ns:name' drops the leading colon, plain names go into the current namespace
+        if name.startswith(':'):
+            return name[1:]
+        if self.namespace and ':' not in name:
+            return self.namespace + ':' + name
+        return name
+
+    def display(self, name):
+        # Names as commands return them, relative to the current namespace when relative names are on
+        if self.relative and self.namespace and name.startswith(self.namespace + ':'):
+            return name[len(self.namespace) + 1:]
+        return name
+
+    # Nodes
+
+    def unique_name(self, name):
+        if name not in self.nodes:
+            return name
+        base = name.rstrip('0123456789')
+        index = self._next_index.get(base, 1)
+        while '{}{}'.format(base, index) in self.nodes:
+            index += 1
+        self._next_index[base] = index + 1
+        return '{}{}'.format(base, index)
+
+    def create(self, node_type, name=None, parent=None):
+        self._next_uuid += 1
+        uuid = '00000000-0000-0000-0000-{:012d}'.format(self._next_uuid)
+        node = Node(self.unique_name(self.qualify(name or node_type + '1')), node_type, parent, uuid)
+        self.nodes[node.name] = node
+        self.uuids[uuid] = node
+        if parent is not None:
+            parent.children.append(node)
+        return node
+
+    def find(self, name):
+        # Short names, long names, plugs and UUIDs all resolve to their node. A path must still be the
+        # node's path, like in Maya after the node was reparented.
+        path = name.split('.', 1)[0]
+        key = path.rsplit('|', 1)[-1]
+        if key.startswith(':'):
+            node = self.nodes.get(key[1:])
+        elif self.relative and self.namespace and self.namespace + ':' + key in self.nodes:
+            node = self.nodes[self.namespace + ':' + key]
+        else:
+            node = self.nodes.get(key) or self.uuids.get(key)
+        if node is not None and '|' in path and not self.long_name(node).endswith('|' + path.lstrip('|')):
+            return None
+        return node
+
+    def get(self, name):
+        node = self.find(name)
+        if node is None:
+            raise ValueError('No object matches name: {}'.format(name))
+        return node
+
+    def long_name(self, node):
+        names = []
+        while node is not None:
+            names.append(node.name)
+            node = node.parent
+        return '|' + '|'.join(reversed(names))
+
+    def descendants(self, node):
+        stack = list(reversed(node.children))
+        while stack:
+            child = stack.pop()
+            yield child
+            stack.extend(reversed(child.children))
+
+    def remove(self, node):
+        if node.name not in self.nodes:
+            return
+        removed = [node] + list(self.descendants(node))
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        names = set()
+        for item in removed:
+            names.add(item.name)
+            del self.nodes[item.name]
+            del self.uuids[item.uuid]
+        self.selection = [item for item in self.selection if item.name not in names]
+        for destination, source in list(self.connections.items()):
+            if destination.split('.', 1)[0] in names or source.split('.', 1)[0] in names:
+                del self.connections[destination]
+
+    def rename(self, node, name):
+        del self.nodes[node.name]
+        node.name = self.unique_name(self.qualify(name))
+        self.nodes[node.name] = node
+        return node.name
+
+    def reparent(self, node, parent):
+        # Keeps the world matrix, like 'parent' does
+        world = self.world_matrix(node) if node.is_transform else None
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        node.parent = parent
+        if parent is not None:
+            parent.children.append(node)
+        if world is not None:
+            self.set_world_matrix(node, world)
+
+    # Transforms
+
+    def local_matrix(self, node):
+        if not node.is_transform:
+            return IDENTITY
+        attrs = node.attrs
+        if attrs['rotate'] == attrs['rotatePivot'] == [0.0, 0.0, 0.0] and attrs['scale'] == [1.0, 1.0, 1.0] and \
+                attrs.get('jointOrient', [0.0, 0.0, 0.0]) == [0.0, 0.0, 0.0]:
+            return translation_matrix(attrs['translate'])
+        rotation = euler_matrix(*[math.radians(value) for value in attrs['rotate']])
+        if 'jointOrient' in attrs:
+            rotation = mult(rotation, euler_matrix(*[math.radians(value) for value in attrs['jointOrient']]))
+        pivot = attrs['rotatePivot']
+        matrix = mult(translation_matrix([-value for value in pivot]), scale_matrix(attrs['scale']))
+        matrix = mult(mult(matrix, rotation), translation_matrix(pivot))
+        return mult(matrix, translation_matrix(attrs['translate']))
+
+    def parent_matrix(self, node):
+        return self.world_matrix(node.parent) if node.parent is not None else IDENTITY
+
+    def matrix_value(self, node, attr):
+        # The matrix attributes every transform has, by name
+        if attr == 'matrix':
+            return self.local_matrix(node)
+        if attr == 'worldMatrix':
+            return self.world_matrix(node)
+        if attr == 'worldInverseMatrix':
+            return inverse(self.world_matrix(node))
+        parent = mult(node.attrs['offsetParentMatrix'], self.parent_matrix(node))
+        return parent if attr == 'parentMatrix' else inverse(parent)
+
+    def world_matrix(self, node):
+        matrix = self.local_matrix(node)
+        if node.is_transform:
+            matrix = mult(matrix, node.attrs['offsetParentMatrix'])
+        return mult(matrix, self.parent_matrix(node))
+
+    def set_world_matrix(self, node, world):
+        # Rotation and translation only, which is all the AVR steps ever change
+        parent = mult(node.attrs['offsetParentMatrix'], self.parent_matrix(node))
+        local = mult(world, inverse(parent))
+        node.attrs['translate'] = list(local[12:15])
+        node.attrs['rotate'] = [math.degrees(value) for value in euler_from_matrix(local)]
+        node.attrs['rotatePivot'] = [0.0, 0.0, 0.0]
+        if 'jointOrient' in node.attrs:
+            node.attrs['jointOrient'] = [0.0, 0.0, 0.0]
+
+    def world_pivot(self, node):
+        return transform_point(node.attrs['rotatePivot'], self.world_matrix(node))
+
+    def set_world_pivot(self, node, point):
+        # The pivot moves, the object does not (rotatePivotTranslate is not modelled)
+        attrs = node.attrs
+        without_pivot = mult(mult(mult(scale_matrix(attrs['scale']),
+                                       euler_matrix(*[math.radians(value) for value in attrs['rotate']])),
+                                  translation_matrix(attrs['translate'])),
+                             mult(attrs['offsetParentMatrix'], self.parent_matrix(node)))
+        local = list(transform_point(point, inverse(without_pivot)))
+        attrs['rotatePivot'] = local
+        attrs['scalePivot'] = list(local)
+
+    def set_world_position(self, node, point):
+        parent = mult(node.attrs['offsetParentMatrix'], self.parent_matrix(node))
+        node.attrs['translate'] = list(transform_point(point, inverse(parent)))
+
+    def freeze(self, node):
+        # makeIdentity -apply: push every transform below the node into its meshes and reset the channels
+        parent_inverse = inverse(self.parent_matrix(node))
+        pivot = self.world_pivot(node) if node.is_transform else None
+        worlds = {}
+        for item in [node] + list(self.descendants(node)):
+            if item.type == 'mesh' and item.parent is not None:
+                if item.parent.name not in worlds:
+                    worlds[item.parent.name] = mult(self.world_matrix(item.parent), parent_inverse)
+                item.attrs['bbox'] = _transform_box(item.attrs['bbox'], worlds[item.parent.name])
+        for item in [node] + list(self.descendants(node)):
+            if item.is_transform:
+                item.attrs.update(translate=[0.0, 0.0, 0.0], rotate=[0.0, 0.0, 0.0], scale=[1.0, 1.0, 1.0])
+        if pivot is not None:
+            self.set_world_pivot(node, pivot)
+
+    @contextlib.contextmanager
+    def at_time(self, frame):
+        # Transform channels driven by anim curves take their value at frame, and get it back afterwards.
+        # Angular curves hold radians, like the API writes them.
+        changed = []
+        for destination, source in self.connections.items():
+            curve = self.nodes[source.split('.', 1)[0]]
+            name, attr = destination.split('.', 1)
+            if not curve.type.startswith('animCurveT') or not curve.attrs.get('keys'):
+                continue
+            value = curve_value(curve.attrs['keys'], frame)
+            if curve.type == 'animCurveTA':
+                value = math.degrees(value)
+            node = self.nodes[name]
+            if attr[:-1] in VECTOR_ATTRS and attr[-1] in 'XYZ':
+                channel, index = node.attrs[attr[:-1]], 'XYZ'.index(attr[-1])
+                changed.append((channel, index, channel[index]))
+                channel[index] = value
+            else:
+                changed.append((node.attrs, attr, node.attrs.get(attr)))
+                node.attrs[attr] = value
+        try:
+            yield
+        finally:
+            for container, key, value in reversed(changed):
+                container[key] = value
+
+    def bounding_box(self, node):
+        # World space bounding box of every mesh at or below the node
+        boxes = []
+        worlds = {}
+        for item in [node] + list(self.descendants(node)):
+            if item.type == 'mesh':
+                if item.parent.name not in worlds:
+                    worlds[item.parent.name] = self.world_matrix(item.parent)
+                boxes.append(_transform_box(self.geometry(item), worlds[item.parent.name]))
+        if not boxes:
+            return (0.0, 0.0, 0.0), (0.0, 0.0, 0.0)
+        return (tuple(min(box[0][axis] for box in boxes) for axis in range(3)),
+                tuple(max(box[1][axis] for box in boxes) for axis in range(3)))
+
+    def geometry(self, mesh):
+        # Object space bounds of a mesh, or of the mesh feeding its inMesh
+        # Instances share the attributes of the mesh they were made from, but not its connections
+        while 'bbox' not in mesh.attrs:
+            plug = mesh.attrs.get('instanceOf', mesh.name) + '.inMesh'
+            if plug not in self.connections:
+                break
+            mesh = self.get(self.connections[plug].split('.', 1)[0])
+        return mesh.attrs['bbox']
+
+
+def _transform_box(box, matrix):
+    corners = [transform_point((x, y, z), matrix)
+               for x in (box[0][0], box[1][0]) for y in (box[0][1], box[1][1]) for z in (box[0][2], box[1][2])]
+    return (tuple(min(corner[axis] for corner in corners) for axis in range(3)),
+            tuple(max(corner[axis] for corner in corners) for axis in range(3)))
+
+
+SCENE = Scene()
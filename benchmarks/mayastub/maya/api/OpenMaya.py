@@ -0,0 +1,250 @@
+# -*- coding: UTF-8 -*-
+# Stand-in for the parts of maya.api.OpenMaya (API 2.0) that the terrain and cache steps use: selection
+# lists, plugs read in a time context, matrices, times and a DG modifier on the in-memory scene. Meshes
+# intersect rays with the triangles in their 'points' and 'triangles' attributes.
+import re
+
+from maya._scene import SCENE, IDENTITY, transform_point
+
+
+class MSpace(object):
+    kInvalid = 0
+    kTransform = 1
+    kPreTransform = 2
+    kPostTransform = 3
+    kWorld = 4
+    kObject = kPreTransform
+
+
+class MMatrix(tuple):
+    # 16 values, row-major with row vectors like Maya
+
+    def __new__(cls, values=IDENTITY):
+        return tuple.__new__(cls, (float(value) for value in values))
+
+
+class MFloatPoint(object):
+
+    def __init__(self, x=0.0, y=0.0, z=0.0, w=1.0):
+        self.x, self.y, self.z, self.w = float(x), float(y), float(z), float(w)
+
+
+class MFloatVector(object):
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = float(x), float(y), float(z)
+
+
+class MDoubleArray(list):
+    pass
+
+
+class MTimeArray(list):
+    pass
+
+
+class MTime(object):
+    kInvalid = 0
+    kHours = 1
+    kMinutes = 2
+    kSeconds = 3
+    kMilliseconds = 4
+    kGames = 5
+    kFilm = 6
+    kPALFrame = 7
+    kNTSCFrame = 8
+    # unit -> units per second
+    RATES = {kHours: 1 / 3600.0, kMinutes: 1 / 60.0, kSeconds: 1.0, kMilliseconds: 1000.0,
+             kGames: 15.0, kFilm: 24.0, kPALFrame: 25.0, kNTSCFrame: 30.0}
+
+    def __init__(self, value=0.0, unit=kInvalid):
+        self.value = float(value)
+        self.unit = unit or SCENE.time_unit
+
+    @staticmethod
+    def uiUnit():
+        return SCENE.time_unit
+
+    @staticmethod
+    def setUIUnit(unit):
+        SCENE.time_unit = unit
+
+    def asUnits(self, unit):
+        return self.value * self.RATES[unit] / self.RATES[self.unit]
+
+
+class MDGContext(object):
+
+    def __init__(self, time=None):
+        self.time = time
+
+
+class MObject(object):
+    # A scene node, or a value such as matrix data
+
+    def __init__(self, node=None, value=None):
+        self._node = node
+        self._value = value
+
+    def isNull(self):
+        return self._node is None and self._value is None
+
+
+class MFnMatrixData(object):
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def matrix(self):
+        return MMatrix(self._obj._value)
+
+
+_PLUG = re.compile(r'^([^.]+)\.(\w+)(?:\[(\d+)\])?$')
+
+
+class MPlug(object):
+
+    def __init__(self, node, attr):
+        self._node = node
+        self.attr = attr
+
+    def name(self):
+        return '{}.{}'.format(self._node.name, self.attr)
+
+    def node(self):
+        return MObject(self._node)
+
+    def asMObject(self, context=None):
+        # Matrix attributes of transforms, at the context's time when there is one
+        attr = self.attr.split('[', 1)[0]
+        if context is None or context.time is None:
+            return MObject(value=SCENE.matrix_value(self._node, attr))
+        with SCENE.at_time(context.time.asUnits(SCENE.time_unit)):
+            return MObject(value=SCENE.matrix_value(self._node, attr))
+
+
+class MDagPath(object):
+
+    def __init__(self, node=None):
+        self._node = node
+
+    def extendToShape(self):
+        if self._node.is_transform:
+            self._node = [child for child in self._node.children if child.is_a('shape')][0]
+        return self
+
+    def inclusiveMatrix(self):
+        return MMatrix(SCENE.world_matrix(self._node if self._node.is_transform else self._node.parent))
+
+
+class MSelectionList(object):
+
+    def __init__(self):
+        self._items = []
+
+    def add(self, name):
+        node = SCENE.find(name)
+        if node is None:
+            raise RuntimeError('(kInvalidParameter): Object does not exist')
+        self._items.append((node, name.split('.', 1)[1] if '.' in name else None))
+        return self
+
+    def length(self):
+        return len(self._items)
+
+    def getDependNode(self, index):
+        return MObject(self._items[index][0])
+
+    def getDagPath(self, index):
+        return MDagPath(self._items[index][0])
+
+    def getPlug(self, index):
+        node, attr = self._items[index]
+        if attr is None:
+            raise TypeError('(kInvalidParameter): Item is not a plug')
+        return MPlug(node, attr)
+
+
+class MMeshIsectAccelParams(object):
+    pass
+
+
+class MFnMesh(object):
+    # Vertices are the flat x, y, z array.array('f') in 'points', faces the vertex index triples in
+    # 'triangles'
+
+    def __init__(self, path):
+        self._node = MDagPath(path._node).extendToShape()._node
+
+    def autoUniformGridParams(self):
+        return MMeshIsectAccelParams()
+
+    def _triangles(self):
+        points = self._node.attrs['points']
+        world = SCENE.world_matrix(self._node.parent)
+        points = [transform_point(points[index:index + 3], world) for index in range(0, len(points), 3)]
+        return [[points[index] for index in triangle] for triangle in self._node.attrs['triangles']]
+
+    def closestIntersection(self, source, direction, space, max_param, test_both, accelParams=None):
+        # Möller-Trumbore against every triangle, the hit face is -1 without a hit
+        origin, ray = (source.x, source.y, source.z), (direction.x, direction.y, direction.z)
+        best = None
+        for face, (a, b, c) in enumerate(self._triangles()):
+            edge1, edge2 = _sub(b, a), _sub(c, a)
+            normal = _cross(ray, edge2)
+            det = _dot(edge1, normal)
+            if abs(det) < 1e-12:
+                continue
+            offset = _sub(origin, a)
+            u = _dot(offset, normal) / det
+            cross = _cross(offset, edge1)
+            v = _dot(ray, cross) / det
+            param = _dot(edge2, cross) / det
+            if u < 0 or v < 0 or u + v > 1 or param > max_param or (param < 0 and not test_both):
+                continue
+            if best is None or abs(param) < abs(best[1]):
+                best = (face, param, u, v)
+        if best is None:
+            return MFloatPoint(), 0.0, -1, -1, 0.0, 0.0
+        face, param, u, v = best
+        point = MFloatPoint(*[o + d * param for o, d in zip(origin, ray)])
+        return point, param, face, face, u, v
+
+
+def _sub(a, b):
+    return a[0] - b[0], a[1] - b[1], a[2] - b[2]
+
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _cross(a, b):
+    return a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]
+
+
+class MDGModifier(object):
+    # Operations are (do, undo) pairs queued until doIt, undoIt reverts everything done so far
+
+    def __init__(self):
+        self._queue = []
+        self._done = []
+
+    def _add(self, do, undo):
+        self._queue.append((do, undo))
+
+    def connect(self, source, destination):
+        def do():
+            SCENE.connections[destination.name()] = source.name()
+
+        self._add(do, lambda: SCENE.connections.pop(destination.name(), None))
+
+    def doIt(self):
+        while self._queue:
+            do, undo = self._queue.pop(0)
+            do()
+            self._done.append(undo)
+
+    def undoIt(self):
+        while self._done:
+            self._done.pop()()
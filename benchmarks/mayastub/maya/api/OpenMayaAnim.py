@@ -0,0 +1,30 @@
+# -*- coding: UTF-8 -*-
+# Stand-in for maya.api.OpenMayaAnim: time-input anim curves created onto a plug through a DG modifier.
+# Keys are [(frame in the UI time unit, value)] in the curve's 'keys' attribute, angles in radians.
+from maya._scene import SCENE, ANGLE_ATTRS
+
+from maya.api.OpenMaya import MObject, MPlug
+
+
+class MFnAnimCurve(object):
+    kTangentGlobal = 0
+    kTangentFixed = 1
+    kTangentLinear = 2
+
+    def __init__(self, obj=None):
+        self._node = obj._node if obj is not None else None
+
+    def create(self, plug, animCurveType=None, modifier=None):
+        # The curve exists right away, its connection to the plug waits for the modifier
+        kind = 'TA' if plug.attr[:-1] in ANGLE_ATTRS else 'TL' if plug.attr[:-1] == 'translate' else 'TU'
+        self._node = SCENE.create('animCurve' + kind, '{}_{}'.format(plug._node.name, plug.attr))
+        node = self._node
+        modifier.connect(MPlug(node, 'output'), plug)
+        modifier._add(lambda: None, lambda: SCENE.remove(node))
+        return MObject(node)
+
+    def addKeys(self, times, values, tangentInType=kTangentGlobal, tangentOutType=kTangentGlobal,
+                keepExistingKeys=False, change=None):
+        keys = dict(self._node.attrs.get('keys', []) if keepExistingKeys else [])
+        keys.update((time.asUnits(SCENE.time_unit), float(value)) for time, value in zip(times, values))
+        self._node.attrs['keys'] = sorted(keys.items())
@@ -0,0 +1,2 @@
+# -*- coding: UTF-8 -*-
+# Stand-in for maya.api, the Python API 2.0.
@@ -0,0 +1,809 @@
+# -*- coding: UTF-8 -*-
+# Recording stand-in for maya.cmds. Every command counts its calls in SCENE.calls and works on the
+# in-memory scene of maya._scene, with the flags the AVR steps use. Commands registered by plug-ins
+# (e.g. avrUndo) become attributes of this module just like in Maya.
+import functools
+import importlib.util
+import os
+import re
+
+from maya._scene import SCENE, MATRIX_ATTRS, VECTOR_ATTRS, inverse
+
+
+# node.attr[index], optionally followed by child plugs such as .objectGroups[1].objectGrpCompList
+_PLUG = re.compile(r'^([^.]+)\.(\w+)(?:\[(\d+)\])?(?:\.[\w.\[\]]+)?$')
+_AXES = {'X': 0, 'Y': 1, 'Z': 2}
+# Attributes every node has
+_NODE_DEFAULTS = {'frozen': False, 'nodeState': 0}
+
+
+def _command(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        SCENE.calls[func.__name__] += 1
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def _flatten(args):
+    names = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            names.extend(_flatten(arg))
+        elif arg is not None:
+            names.append(arg)
+    return names
+
+
+def _nodes(args, strict=True):
+    nodes = []
+    for name in _flatten(args):
+        node = SCENE.find(name)
+        if node is None:
+            if strict:
+                raise ValueError('No object matches name: {}'.format(name))
+            continue
+        nodes.append(node)
+    return nodes
+
+
+def _plug(plug):
+    match = _PLUG.match(plug.rsplit('|', 1)[-1])
+    if not match:
+        raise ValueError('Invalid plug: {}'.format(plug))
+    return SCENE.get(match.group(1)), match.group(2), match.group(3)
+
+
+def _names(nodes, long=False):
+    return [SCENE.long_name(node) if long else SCENE.display(node.name) for node in nodes]
+
+
+def _query_flag(kwargs, *names):
+    return any(kwargs.get(name) for name in names)
+
+
+# Scene queries
+
+@_command
+def ls(*args, **kwargs):
+    if _query_flag(kwargs, 'sl', 'selection'):
+        nodes = list(SCENE.selection)
+    elif args:
+        # 'ls' with an empty list lists everything, just like Maya
+        names = _flatten(args)
+        nodes = _nodes(names, strict=False) if names else list(SCENE.nodes.values())
+    else:
+        nodes = list(SCENE.nodes.values())
+
+    if _query_flag(kwargs, 'dag', 'dagObjects'):
+        expanded = []
+        for node in nodes:
+            expanded.append(node)
+            expanded.extend(SCENE.descendants(node))
+        nodes = expanded
+
+    # Intermediate objects, e.g. the undeformed input of a skinCluster
+    if _query_flag(kwargs, 'io', 'intermediateObjects'):
+        nodes = [node for node in nodes if node.attrs.get('intermediateObject')]
+    elif _query_flag(kwargs, 'ni', 'noIntermediate'):
+        nodes = [node for node in nodes if not node.attrs.get('intermediateObject')]
+
+    exact = kwargs.get('et') or kwargs.get('exactType')
+    if exact:
+        nodes = [node for node in nodes if node.type == exact]
+    node_type = kwargs.get('type')
+    if node_type:
+        types = node_type if isinstance(node_type, (list, tuple)) else [node_type]
+        nodes = [node for node in nodes if any(node.is_a(item) for item in types)]
+
+    # Unique, in order
+    seen = set()
+    nodes = [node for node in nodes if not (node.name in seen or seen.add(node.name))]
+
+    if kwargs.get('uuid'):
+        return [node.uuid for node in nodes]
+    return _names(nodes, _query_flag(kwargs, 'long', 'l'))
+
+
+@_command
+def listRelatives(*args, **kwargs):
+    nodes = _nodes(args)
+    result = []
+    if _query_flag(kwargs, 'p', 'parent'):
+        result = [node.parent for node in nodes if node.parent is not None]
+    elif _query_flag(kwargs, 'ad', 'allDescendents'):
+        for node in nodes:
+            result.extend(SCENE.descendants(node))
+    else:
+        for node in nodes:
+            result.extend(node.children)
+
+    if _query_flag(kwargs, 's', 'shapes'):
+        result = [node for node in result if node.is_a('shape')]
+    node_type = kwargs.get('type')
+    if node_type:
+        types = node_type if isinstance(node_type, (list, tuple)) else [node_type]
+        result = [node for node in result if any(node.is_a(item) for item in types)]
+    return _names(result, _query_flag(kwargs, 'f', 'fullPath')) or None
+
+
+@_command
+def objExists(name):
+    node = SCENE.find(name)
+    if node is None:
+        return False
+    if '.' not in name:
+        return True
+    return _has_attr(*_plug(name)[:2])
+
+
+@_command
+def nodeType(name):
+    return SCENE.get(name).type
+
+
+@_command
+def about(**kwargs):
+    if kwargs.get('batch'):
+        return SCENE.batch
+    return ''
+
+
+# Selection, undo and refresh
+
+@_command
+def select(*args, **kwargs):
+    if kwargs.get('clear') or kwargs.get('cl'):
+        SCENE.selection = []
+        return
+    nodes = _nodes(args)
+    if kwargs.get('add'):
+        SCENE.selection.extend(node for node in nodes if node not in SCENE.selection)
+    else:
+        SCENE.selection = nodes
+
+
+@_command
+def undoInfo(**kwargs):
+    if kwargs.get('q') or kwargs.get('query'):
+        return SCENE.undo_state
+    if kwargs.get('openChunk'):
+        SCENE.open_chunks += 1
+        SCENE.chunk_names.append(kwargs.get('chunkName', ''))
+    if kwargs.get('closeChunk'):
+        SCENE.open_chunks -= 1
+    if 'stateWithoutFlush' in kwargs:
+        SCENE.undo_state = bool(kwargs['stateWithoutFlush'])
+    if 'state' in kwargs:
+        SCENE.undo_state = bool(kwargs['state'])
+        if not SCENE.undo_state:
+            del SCENE.undo_queue[:]
+
+
+@_command
+def undo():
+    # Nothing is rolled back, the tests only check that it was asked for
+    pass
+
+
+@_command
+def refresh(**kwargs):
+    if 'suspend' in kwargs:
+        SCENE.refresh_suspended = bool(kwargs['suspend'])
+
+
+# Plug-ins
+
+@_command
+def pluginInfo(path, **kwargs):
+    return path in SCENE.plugins
+
+
+@_command
+def loadPlugin(path, **kwargs):
+    # Scripted plug-ins are real Python files, load them and call their initializePlugin
+    if path in SCENE.plugins:
+        return [os.path.splitext(os.path.basename(path))[0]]
+    if not os.path.exists(path):
+        raise RuntimeError('Plug-in not found: {}'.format(path))
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location('_plugin_' + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    from maya import OpenMaya
+    module.initializePlugin(OpenMaya.MObject())
+    SCENE.plugins[path] = module
+    return [name]
+
+
+def __getattr__(name):
+    # Plug-in commands, e.g. cmds.avrUndo()
+    if name in SCENE.commands:
+        def run(*args, **kwargs):
+            SCENE.calls[name] += 1
+            command = SCENE.commands[name]()
+            command.doIt(args)
+            if SCENE.undo_state and command.isUndoable():
+                SCENE.undo_queue.append(command)
+        return run
+    raise AttributeError("module 'maya.cmds' has no attribute '{}'".format(name))
+
+
+# Node creation and editing
+
+@_command
+def createNode(node_type, **kwargs):
+    parent = kwargs.get('p') or kwargs.get('parent')
+    return SCENE.display(SCENE.create(node_type, kwargs.get('n') or kwargs.get('name'),
+                                      SCENE.get(parent) if parent else None).name)
+
+
+@_command
+def group(*args, **kwargs):
+    nodes = _nodes(args)
+    parents = set(node.parent for node in nodes)
+    parent = parents.pop() if len(parents) == 1 else None
+    grp = SCENE.create('transform', kwargs.get('n') or kwargs.get('name') or 'group1', parent)
+    for node in nodes:
+        SCENE.reparent(node, grp)
+    SCENE.selection = [grp]
+    return SCENE.display(grp.name)
+
+
+@_command
+def parent(*args, **kwargs):
+    names = _flatten(args)
+    if kwargs.get('w') or kwargs.get('world'):
+        target, children = None, _nodes(names)
+    else:
+        target, children = SCENE.get(names[-1]), _nodes(names[:-1])
+
+    if kwargs.get('add') or kwargs.get('addObject'):
+        # Instancing: the new node shares the attributes (the geometry) of the original
+        instances = []
+        for node in children:
+            node.attrs.setdefault('instanceOf', node.name)
+            instance = SCENE.create(node.type, node.name.rsplit(':', 1)[-1], target)
+            instance.attrs = node.attrs
+            instances.append(instance)
+        return _names(instances)
+
+    for node in children:
+        if kwargs.get('r') or kwargs.get('relative'):
+            # Keep the local transform instead of the world placement
+            if node.parent is not None:
+                node.parent.children.remove(node)
+            node.parent = target
+            target.children.append(node)
+            continue
+        SCENE.reparent(node, target)
+    return _names(children)
+
+
+@_command
+def rename(old, new):
+    return SCENE.display(SCENE.rename(SCENE.get(old), new))
+
+
+@_command
+def duplicate(*args, **kwargs):
+    # Copies go into the current namespace, the first one takes the 'n' name if given
+    name = kwargs.get('n') or kwargs.get('name')
+    result = []
+    for node in _nodes(args):
+        copy = _copy(node, node.parent)
+        if name and not result:
+            SCENE.rename(copy, name)
+        result.append(SCENE.display(copy.name))
+    return result
+
+
+def _copy(node, parent):
+    copy = SCENE.create(node.type, node.name.rsplit(':', 1)[-1], parent)
+    copy.attrs = {key: list(value) if isinstance(value, list) else value for key, value in node.attrs.items()}
+    for child in node.children:
+        _copy(child, copy)
+    return copy
+
+
+_FACES = re.compile(r'^(.+)\.f\[(\d+):(\d+)\]$')
+
+
+@_command
+def delete(*args, **kwargs):
+    # Face ranges only shrink the face count of their mesh
+    names = []
+    for name in _flatten(args):
+        match = _FACES.match(name)
+        if match:
+            shape = _mesh(SCENE.get(match.group(1)))
+            shape.attrs['faces'] = _faces(shape) - (int(match.group(3)) - int(match.group(2)) + 1)
+        else:
+            names.append(name)
+    nodes = _nodes(names)
+    if _query_flag(kwargs, 'ch', 'constructionHistory'):
+        return
+    for node in nodes:
+        SCENE.remove(node)
+
+
+@_command
+def makeIdentity(*args, **kwargs):
+    nodes = _nodes(args)
+    if not _query_flag(kwargs, 'a', 'apply'):
+        return
+    for node in nodes:
+        if node.name in SCENE.nodes:
+            SCENE.freeze(node)
+
+
+@_command
+def move(*args, **kwargs):
+    x, y, z = args[:3]
+    for name in _flatten(args[3:]) or _names(SCENE.selection):
+        if '.' in name:
+            node, attr, _ = _plug(name)
+            if attr in ('rotatePivot', 'scalePivot'):
+                SCENE.set_world_pivot(node, (x, y, z))
+            continue
+        SCENE.set_world_position(SCENE.get(name), (x, y, z))
+
+
+@_command
+def xform(*args, **kwargs):
+    node = SCENE.get(_flatten(args)[0])
+    query = kwargs.get('q') or kwargs.get('query')
+    pivot = kwargs.get('piv', kwargs.get('pivots'))
+    rotate_pivot = kwargs.get('rp', kwargs.get('rotatePivot'))
+    translation = kwargs.get('t', kwargs.get('translation'))
+    matrix = kwargs.get('m', kwargs.get('matrix'))
+
+    if query:
+        if matrix:
+            return list(SCENE.world_matrix(node) if kwargs.get('ws') else SCENE.local_matrix(node))
+        if pivot or rotate_pivot:
+            point = list(SCENE.world_pivot(node))
+            return point + point if pivot else point
+        if translation:
+            return list(SCENE.world_matrix(node)[12:15])
+        raise NotImplementedError('xform query flags: {}'.format(sorted(kwargs)))
+
+    if pivot is not None:
+        SCENE.set_world_pivot(node, pivot[:3])
+    if translation is not None:
+        SCENE.set_world_position(node, translation)
+
+
+# Attributes
+
+def _has_attr(node, attr):
+    if attr in node.attrs:
+        return True
+    if node.is_transform:
+        if attr in MATRIX_ATTRS or attr.startswith('boundingBox'):
+            return True
+        if attr[:-1] in VECTOR_ATTRS and attr[-1] in _AXES and attr[:-1] in node.attrs:
+            return True
+    return False
+
+
+@_command
+def attributeQuery(attr, **kwargs):
+    node = SCENE.get(kwargs.get('node') or kwargs.get('n'))
+    return _has_attr(node, attr)
+
+
+@_command
+def deleteAttr(*args, **kwargs):
+    node = SCENE.get(_flatten(args)[0])
+    del node.attrs[kwargs.get('at') or kwargs.get('attribute')]
+
+
+@_command
+def addAttr(*args, **kwargs):
+    node = SCENE.get(_flatten(args)[0]) if args else SCENE.selection[-1]
+    attr = kwargs.get('ln') or kwargs.get('longName')
+    if attr in node.attrs:
+        raise RuntimeError("Found an attribute with the same name '{}' on '{}'".format(attr, node.name))
+    data_type = kwargs.get('dt') or kwargs.get('dataType')
+    node.attrs[attr] = None if data_type else kwargs.get('dv', kwargs.get('defaultValue', 0.0))
+
+
+@_command
+def getAttr(plug, **kwargs):
+    node, attr, _ = _plug(plug)
+    if node.is_transform:
+        if attr in MATRIX_ATTRS:
+            return list(SCENE.matrix_value(node, attr))
+        if attr.startswith('boundingBox'):
+            box = SCENE.bounding_box(node)
+            return box[0 if 'Min' in attr else 1][_AXES[attr[-1]]]
+        if attr in VECTOR_ATTRS and attr in node.attrs:
+            return [tuple(node.attrs[attr])]
+        if attr[:-1] in VECTOR_ATTRS and attr[-1] in _AXES and attr[:-1] in node.attrs:
+            return node.attrs[attr[:-1]][_AXES[attr[-1]]]
+
+    key = plug.split('.', 1)[1]
+    if key in node.attrs:
+        value = node.attrs[key]
+    elif attr in node.attrs:
+        value = node.attrs[attr]
+    elif attr in _NODE_DEFAULTS:
+        value = _NODE_DEFAULTS[attr]
+    else:
+        raise ValueError("No attribute '{}'".format(plug))
+    return list(value) if isinstance(value, tuple) else value
+
+
+@_command
+def setAttr(plug, *values, **kwargs):
+    node, attr, _ = _plug(plug)
+    if not values:
+        return  # Only channel box, keyable or lock flags
+
+    data_type = kwargs.get('type')
+    if data_type == 'matrix':
+        node.attrs[attr] = tuple(float(value) for value in _flatten(values))
+    elif data_type == 'string':
+        node.attrs[attr] = values[0]
+    elif node.is_transform and attr in VECTOR_ATTRS and attr in node.attrs:
+        node.attrs[attr] = [float(value) for value in _flatten(values)]
+    elif node.is_transform and attr[:-1] in VECTOR_ATTRS and attr[-1] in _AXES and attr[:-1] in node.attrs:
+        node.attrs[attr[:-1]][_AXES[attr[-1]]] = float(values[0])
+    else:
+        node.attrs[plug.split('.', 1)[1]] = values[0] if len(values) == 1 else list(values)
+
+
+def _full_plug(plug):
+    # Connections are kept with full node names, whatever namespace they were made from
+    return _plug(plug)[0].name + '.' + plug.split('.', 1)[1]
+
+
+@_command
+def connectAttr(source, destination, **kwargs):
+    source, destination = _full_plug(source), _full_plug(destination)
+    if destination in SCENE.connections and not (kwargs.get('f') or kwargs.get('force')):
+        raise RuntimeError("'{}' is already connected to '{}'".format(SCENE.connections[destination], destination))
+    SCENE.connections[destination] = source
+
+
+@_command
+def disconnectAttr(source, destination):
+    source, destination = _full_plug(source), _full_plug(destination)
+    if SCENE.connections.get(destination) != source:
+        raise RuntimeError("'{}' is not connected to '{}'".format(source, destination))
+    del SCENE.connections[destination]
+
+
+@_command
+def listConnections(*args, **kwargs):
+    source = kwargs.get('s', kwargs.get('source', True))
+    destination = kwargs.get('d', kwargs.get('destination', True))
+    node_type = kwargs.get('type')
+    result = []
+    for plug in _flatten(args):
+        # A node name stands for all of its plugs
+        node, attr, _ = _plug(plug) if '.' in plug else (SCENE.get(plug), None, None)
+        for dst, src in SCENE.connections.items():
+            if source and _plug(dst)[0] is node and attr in (None, _plug(dst)[1]):
+                result.append((dst, src))
+            if destination and _plug(src)[0] is node and attr in (None, _plug(src)[1]):
+                result.append((src, dst))
+
+    if node_type:
+        result = [(this, other) for this, other in result if SCENE.get(other).is_a(node_type)]
+    if not kwargs.get('p'):
+        result = [(this, other.split('.', 1)[0]) for this, other in result]
+    result = [(SCENE.display(this), SCENE.display(other)) for this, other in result]
+    if kwargs.get('c'):
+        return [item for pair in result for item in pair] or None
+    return [other for _, other in result] or None
+
+
+@_command
+def exactWorldBoundingBox(*args, **kwargs):
+    boxes = [SCENE.bounding_box(node) for node in _nodes(args)]
+    return ([min(box[0][axis] for box in boxes) for axis in range(3)] +
+            [max(box[1][axis] for box in boxes) for axis in range(3)])
+
+
+# Keys, on animCurve nodes only: node.attrs['keys'] is [(input, value)] sorted by input
+
+@_command
+def setKeyframe(*args, **kwargs):
+    for node in _nodes(args):
+        keys = dict(node.attrs.get('keys', []))
+        keys[float(kwargs['float'])] = float(kwargs['value'])
+        node.attrs['keys'] = sorted(keys.items())
+
+
+@_command
+def cutKey(*args, **kwargs):
+    for node in _nodes(args):
+        node.attrs['keys'] = []
+
+
+# Polygons
+
+def _mesh(node):
+    return node if node.type == 'mesh' else [child for child in node.children if child.type == 'mesh'][0]
+
+
+def _faces(shape):
+    # Meshes are cubes unless they were combined or had faces deleted
+    return shape.attrs.get('faces', 6)
+
+
+@_command
+def polyEvaluate(*args, **kwargs):
+    if _query_flag(kwargs, 'f', 'face'):
+        return _faces(_mesh(_nodes(args)[0]))
+    if _query_flag(kwargs, 'v', 'vertex'):
+        shape = _mesh(_nodes(args)[0])
+        return len(shape.attrs['points']) // 3 if 'points' in shape.attrs else 8
+    if not _query_flag(kwargs, 'b', 'boundingBox'):
+        raise NotImplementedError('polyEvaluate flags: {}'.format(sorted(kwargs)))
+    node = _mesh(_nodes(args)[0])
+    box = SCENE.geometry(node)
+    return tuple((box[0][axis], box[1][axis]) for axis in range(3))
+
+
+@_command
+def polyCube(**kwargs):
+    # A cube around the origin, without construction history
+    size = [kwargs.get(flag, 1.0) for flag in ('w', 'h', 'd')]
+    transform = SCENE.create('transform', kwargs.get('n') or kwargs.get('name') or 'pCube1')
+    shape = SCENE.create('mesh', transform.name.rsplit(':', 1)[-1] + 'Shape', transform)
+    shape.attrs['bbox'] = (tuple(-value / 2.0 for value in size), tuple(value / 2.0 for value in size))
+    return [SCENE.display(transform.name)]
+
+
+@_command
+def polyUnite(*args, **kwargs):
+    # One mesh in world space around all the inputs, which go away without construction history
+    nodes = _nodes(args)
+    boxes = [SCENE.bounding_box(node) for node in nodes]
+    transform = SCENE.create('transform', kwargs.get('n') or kwargs.get('name') or 'polySurface1')
+    shape = SCENE.create('mesh', transform.name.rsplit(':', 1)[-1] + 'Shape', transform)
+    shape.attrs['bbox'] = (tuple(min(box[0][axis] for box in boxes) for axis in range(3)),
+                           tuple(max(box[1][axis] for box in boxes) for axis in range(3)))
+    shape.attrs['faces'] = sum(_faces(_mesh(node)) for node in nodes)
+    # The face assignments carry over, here whole meshes to the shading group of the first input
+    engines = listConnections.__wrapped__(_mesh(nodes[0]).name + '.instObjGroups', s=0, d=1, type='shadingEngine')
+    if engines:
+        sets.__wrapped__(shape.name, fe=engines[0])
+    if not kwargs.get('ch', kwargs.get('constructionHistory', True)):
+        for node in nodes:
+            if node.name in SCENE.nodes:
+                SCENE.remove(node)
+    return [SCENE.display(transform.name)]
+
+
+@_command
+def curve(**kwargs):
+    # The CVs, degree, knots and form of the curve go on its shape, for MFnNurbsCurve
+    transform = SCENE.create('transform', kwargs.get('n') or kwargs.get('name') or 'curve1')
+    shape = SCENE.create('nurbsCurve', transform.name.rsplit(':', 1)[-1] + 'Shape', transform)
+    shape.attrs['cvs'] = [tuple(float(value) for value in point) for point in kwargs.get('p') or kwargs['point']]
+    shape.attrs['degree'] = kwargs.get('d', kwargs.get('degree', 3))
+    shape.attrs['knots'] = [float(knot) for knot in kwargs.get('k') or kwargs.get('knot') or []]
+    shape.attrs['periodic'] = bool(kwargs.get('per', kwargs.get('periodic', False)))
+    return SCENE.display(transform.name)
+
+
+@_command
+def polyReduce(*args, **kwargs):
+    # Fewer faces, same bounds
+    return _names(_nodes(args))
+
+
+# Evaluation and time
+
+@_command
+def evaluationManager(**kwargs):
+    if _query_flag(kwargs, 'q', 'query'):
+        return [SCENE.evaluation_mode]
+    SCENE.evaluation_mode = kwargs['mode']
+
+
+@_command
+def bakePartialHistory(*args, **kwargs):
+    # Construction history goes, deformers stay
+    for node in _nodes(args):
+        source = SCENE.connections.get(node.name + '.inMesh')
+        if source and SCENE.get(source.split('.', 1)[0]).type != 'skinCluster':
+            del SCENE.connections[node.name + '.inMesh']
+
+
+@_command
+def currentTime(*args, **kwargs):
+    if _query_flag(kwargs, 'q', 'query'):
+        return SCENE.time
+    SCENE.time = float(args[0])
+    return SCENE.time
+
+
+@_command
+def playbackOptions(**kwargs):
+    if _query_flag(kwargs, 'q', 'query'):
+        return SCENE.playback[0 if kwargs.get('min') else 1]
+    SCENE.playback = (kwargs.get('min', SCENE.playback[0]), kwargs.get('max', SCENE.playback[1]))
+
+
+# Namespaces
+
+@_command
+def namespace(*args, **kwargs):
+    if kwargs.get('exists') or kwargs.get('ex'):
+        name = kwargs.get('exists') or kwargs.get('ex')
+        return name in (':', '') or SCENE.qualify(name) in SCENE.namespaces
+    if kwargs.get('q') or kwargs.get('query'):
+        if kwargs.get('rel') or kwargs.get('relativeNames'):
+            return SCENE.relative
+        raise NotImplementedError('namespace query flags: {}'.format(sorted(kwargs)))
+    if 'add' in kwargs:
+        parent = kwargs.get('p', kwargs.get('parent', ':'))
+        name = kwargs['add'] if parent in (':', '') else parent.strip(':') + ':' + kwargs['add']
+        SCENE.namespaces.add(SCENE.qualify(name) if parent not in (':', '') else name.lstrip(':'))
+        return ':' + name.lstrip(':')
+    if 'set' in kwargs:
+        name = kwargs['set']
+        SCENE.namespace = '' if name in (':', '') else SCENE.qualify(name)
+        return
+    if 'rel' in kwargs or 'relativeNames' in kwargs:
+        SCENE.relative = bool(kwargs.get('rel', kwargs.get('relativeNames')))
+        return
+    if 'rm' in kwargs or 'removeNamespace' in kwargs:
+        name = SCENE.qualify(kwargs.get('rm') or kwargs.get('removeNamespace'))
+        for node in [node for node in SCENE.nodes.values() if node.name.startswith(name + ':')]:
+            SCENE.remove(node)
+        SCENE.namespaces.discard(name)
+        return
+    raise NotImplementedError('namespace flags: {}'.format(sorted(kwargs)))
+
+
+@_command
+def namespaceInfo(*args, **kwargs):
+    if kwargs.get('cur') or kwargs.get('currentNamespace'):
+        absolute = kwargs.get('an') or kwargs.get('absoluteName')
+        return (':' if absolute else '') + SCENE.namespace if SCENE.namespace else ':'
+    raise NotImplementedError('namespaceInfo flags: {}'.format(sorted(kwargs)))
+
+
+# Rigging
+
+@_command
+def skinCluster(*args, **kwargs):
+    names = _flatten(args)
+    if _query_flag(kwargs, 'q', 'query'):
+        if not _query_flag(kwargs, 'inf', 'influence'):
+            raise NotImplementedError('skinCluster query flags: {}'.format(sorted(kwargs)))
+        return list(SCENE.get(names[0]).attrs['influences'])
+    if _query_flag(kwargs, 'e', 'edit'):
+        if not _query_flag(kwargs, 'ub', 'unbind'):
+            raise NotImplementedError('skinCluster edit flags: {}'.format(sorted(kwargs)))
+        # The mesh keeps its undeformed geometry, the skinCluster and the input shape go away
+        skin = SCENE.get(names[0])
+        for node in list(SCENE.nodes.values()):
+            if node.attrs.get('skinCluster') == skin.name:
+                del node.attrs['skinCluster']
+        orig = SCENE.connections.get(skin.name + '.input[0]')
+        SCENE.remove(skin)
+        if orig:
+            SCENE.remove(SCENE.get(orig.split('.', 1)[0]))
+        return
+
+    influences, geometry = _nodes(names[:-1]), SCENE.get(names[-1])
+    if 'skinCluster' in geometry.attrs:
+        raise RuntimeError("'{}' is already connected to a skinCluster".format(geometry.name))
+    skin = SCENE.create('skinCluster', 'skinCluster1')
+    skin.attrs['influences'] = _names(influences)
+    geometry.attrs['skinCluster'] = skin.name
+
+    # The undeformed input shape Maya keeps next to a deformed mesh
+    shape = geometry if geometry.type == 'mesh' else [child for child in geometry.children if child.type == 'mesh'][0]
+    orig = SCENE.create('mesh', shape.name.rsplit(':', 1)[-1] + 'Orig', shape.parent)
+    orig.attrs.update(bbox=shape.attrs.get('bbox'), intermediateObject=True)
+    SCENE.connections[skin.name + '.input[0]'] = orig.name + '.outMesh'
+    for index, influence in enumerate(influences):
+        SCENE.connections['{}.matrix[{}]'.format(skin.name, index)] = influence.name + '.worldMatrix[0]'
+    # Bound at the current pose. Like setAttr -type matrix here, the array keeps one value, the first one.
+    skin.attrs['bindPreMatrix'] = tuple(inverse(SCENE.world_matrix(influences[0])))
+    SCENE.connections[geometry.name + '.inMesh'] = skin.name + '.outputGeometry[0]'
+    return [SCENE.display(skin.name)]
+
+
+def _constraint(constraint_type, args, kwargs):
+    names = _flatten(args)
+    if kwargs.get('q') or kwargs.get('query'):
+        node = SCENE.get(names[0])
+        return list(node.attrs['targets']) if kwargs.get('targetList') or kwargs.get('tl') else None
+
+    targets, driven = _nodes(names[:-1]), SCENE.get(names[-1])
+    constraint = SCENE.create(constraint_type, '{}_{}1'.format(driven.name, constraint_type), driven)
+    constraint.attrs['targets'] = _names(targets)
+    return [SCENE.display(constraint.name)]
+
+
+@_command
+def pointConstraint(*args, **kwargs):
+    return _constraint('pointConstraint', args, kwargs)
+
+
+@_command
+def orientConstraint(*args, **kwargs):
+    return _constraint('orientConstraint', args, kwargs)
+
+
+# Shading
+
+@_command
+def shadingNode(node_type, **kwargs):
+    return SCENE.display(SCENE.create(node_type, kwargs.get('n') or kwargs.get('name')).name)
+
+
+@_command
+def sets(*args, **kwargs):
+    element = kwargs.get('fe') or kwargs.get('forceElement')
+    if element:
+        # Assigning a transform assigns its shapes, each one through its own instObjGroups plug. Assigning
+        # faces ('body_geo.f[0:3]') adds an objectGroups plug below it, listing the faces in objectGrpCompList.
+        engine = SCENE.get(element)
+        for member in _flatten(args):
+            name, _, faces = member.partition('.')
+            node = SCENE.get(name)
+            for shape in [child for child in ([node] if node.type == 'mesh' else node.children) if child.type == 'mesh']:
+                plug = shape.name + '.instObjGroups[0]'
+                for dst, src in list(SCENE.connections.items()):
+                    if src == plug or (not faces and src.startswith(plug + '.')):
+                        del SCENE.connections[dst]
+                if faces:
+                    group = 0
+                    while 'instObjGroups[0].objectGroups[{}].objectGrpCompList'.format(group) in shape.attrs:
+                        group += 1
+                    plug = '{}.objectGroups[{}]'.format(plug, group)
+                    shape.attrs[plug.split('.', 1)[1] + '.objectGrpCompList'] = [faces]
+                index = 0
+                while '{}.dagSetMembers[{}]'.format(engine.name, index) in SCENE.connections:
+                    index += 1
+                SCENE.connections['{}.dagSetMembers[{}]'.format(engine.name, index)] = plug
+        return
+    node = SCENE.create('shadingEngine' if kwargs.get('renderable') else 'objectSet', kwargs.get('n') or kwargs.get('name'))
+    return SCENE.display(node.name)
+
+
+# Files
+
+@_command
+def file(*args, **kwargs):
+    if kwargs.get('new') or kwargs.get('newFile'):
+        SCENE.reset()
+        return
+    if kwargs.get('i') or kwargs.get('import'):
+        # Imports create what was registered for the file name in SCENE.imports
+        content = SCENE.imports.get(os.path.basename(args[0]))
+        if content is None:
+            raise RuntimeError('File not found: {}'.format(args[0]))
+        namespace = kwargs.get('ns') or kwargs.get('namespace')
+        if namespace:
+            SCENE.namespaces.add(namespace.lstrip(':'))
+        created = []
+        for name, node_type in content:
+            node = SCENE.create('transform', ':{}:{}'.format(namespace.lstrip(':'), name) if namespace else name)
+            SCENE.create(node_type, name + 'Shape', node)
+            created.append(SCENE.display(node.name))
+        return created
+    if kwargs.get('o') or kwargs.get('open'):
+        # Benchmarks build the scene beforehand, opening only records the file name
+        SCENE.file_name = args[0]
+        return args[0]
+    if kwargs.get('rn') or kwargs.get('rename'):
+        SCENE.file_name = kwargs.get('rn') or kwargs.get('rename')
+        return SCENE.file_name
+    if kwargs.get('s') or kwargs.get('save'):
+        SCENE.saved.append((SCENE.file_name, kwargs.get('typ') or kwargs.get('type')))
+        return SCENE.file_name
+    raise NotImplementedError('file flags: {}'.format(sorted(kwargs)))
+
@@ -0,0 +1,296 @@
+# -*- coding: UTF-8 -*-
+# The steps that work on whole vertex buffers or matrix arrays with numpy: wheel detection and fitting,
+# terrain following and transform caches.
+# Their meshes are synthetic point sets, kept on the stand-in mesh shapes as 'points'. These steps make few
+# maya.cmds calls by design, so the budgets here are in seconds.
+import array
+import json
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import AutoVehicleRig.AVR_Base as avr  # noqa: E402
+import AutoVehicleRig.AVR_Cache as avr_cache  # noqa: E402
+import AutoVehicleRig.AVR_Detect as avr_detect  # noqa: E402
+import AutoVehicleRig.AVR_Terrain as avr_terrain  # noqa: E402
+import maya.cmds as cmds  # noqa: E402
+import maya.OpenMaya as om  # noqa: E402
+import vehicles  # noqa: E402
+
+# Seconds read_points may take for 100k vertices spread over 500 meshes
+READ_POINTS_SECONDS = 0.5
+# Seconds detect may take for a 500 mesh vehicle
+DETECT_SECONDS = 1.0
+
+
+def add_mesh(scene, name, points, parent=None, triangles=None):
+    transform = scene.create('transform', name, parent)
+    shape = scene.create('mesh', name + 'Shape', transform)
+    points = np.asarray(points, dtype=np.float32)
+    shape.attrs['points'] = array.array('f', points.tobytes())
+    if triangles:
+        shape.attrs['triangles'] = triangles
+        shape.attrs['faces'] = len(triangles)
+    shape.attrs['bbox'] = (tuple(points.min(axis=0).tolist()), tuple(points.max(axis=0).tolist()))
+    return transform.name
+
+
+def disc(center, radius, width, inner=0.0, segments=48):
+    # A wheel-like ring (or a full disc with inner=0) on both faces, facing Z
+    angles = np.linspace(0.0, 2 * np.pi, segments, endpoint=False)
+    rings = [(r, z) for r in sorted({radius, inner}) if r > 0 for z in (-width / 2.0, width / 2.0)]
+    if not inner:
+        rings += [(0.0, -width / 2.0), (0.0, width / 2.0)]
+    points = [(r * np.cos(angle), r * np.sin(angle), z) for r, z in rings for angle in angles]
+    return np.array(points) + center
+
+
+def box(low, high, steps=4):
+    axes = [np.linspace(low[axis], high[axis], steps) for axis in range(3)]
+    return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+
+def build_vehicle(scene, wheels=4, clutter=0, parts=('tire',)):
+    # Body box plus one wheel per part name in vehicles.PARTS, each made of the given pieces. Returns the
+    # expected {part name: [mesh names]}.
+    axles = vehicles.PARTS[wheels]
+    radius, width = vehicles.WHEEL_RADIUS, vehicles.WHEEL_WIDTH
+    expected = {'VehicleBody': [add_mesh(scene, 'body_geo', box((-250, 30, -120), (250, 150, 120)))]}
+    for index in range(clutter):
+        # Seats, lights, mirrors ... small boxes all over the body
+        x, z = -240.0 + 480.0 * (index % 25) / 24.0, -100.0 + 200.0 * (index // 25 % 20) / 19.0
+        expected['VehicleBody'].append(add_mesh(scene, 'clutter_geo_{}'.format(index),
+                                                box((x, 80, z), (x + 6, 86, z + 9), steps=6)))
+
+    pieces = {'tire': (radius, radius * 0.7, width), 'rim': (radius * 0.7, 0.0, width * 0.8),
+              'hubcap': (radius * 0.3, 0.0, width * 0.2)}
+    for x, axle in zip(avr.axle_positions(len(axles)), axles):
+        for z, wheel in zip(avr.side_offsets(len(axle)), axle):
+            expected[wheel] = [add_mesh(scene, '{}_{}_geo'.format(wheel, piece),
+                                        disc((x, radius, z), *pieces[piece]))
+                               for piece in parts]
+    return axles, expected
+
+
+def test_mesh_stats(scene):
+    add_mesh(scene, 'a', box((0, 0, 0), (2, 4, 6)))
+    add_mesh(scene, 'b', disc((10, 35, 5), 35, 20))
+    points, offsets, counts = avr_detect.read_points(['a', 'b'])
+    assert counts.tolist() == [64, 192] and offsets.tolist() == [0, 64]
+
+    stats = avr_detect.mesh_stats(points, offsets, counts)
+    assert np.allclose(stats['min'][0], (0, 0, 0)) and np.allclose(stats['max'][0], (2, 4, 6))
+    assert np.allclose(stats['centroid'], [(1, 2, 3), (10, 35, 5)])
+    # The disc spins around Z, the box's smallest spread is along X
+    assert abs(stats['axis'][1][2]) == pytest.approx(1.0)
+    assert abs(stats['axis'][0][0]) == pytest.approx(1.0)
+
+
+def test_read_points_world_space(scene):
+    grp = scene.create('transform', 'Wheel_Grp')
+    grp.attrs['translate'] = [100.0, 0.0, -50.0]
+    add_mesh(scene, 'wheel_geo', disc((0, 35, 0), 35, 20), grp)
+    points, _, _ = avr_detect.read_points(['wheel_geoShape'])
+    assert np.allclose(points.mean(axis=0), (100, 35, -50))
+
+
+@pytest.mark.parametrize('wheels', [2, 4, 6])
+def test_detect(scene, wheels):
+    axles, expected = build_vehicle(scene, wheels)
+
+    vb_name, names, parts = avr_detect.detect(list(scene.nodes))
+    assert vb_name == 'VehicleBody' and names == axles
+    assert {name: sorted(members) for name, members in parts.items()} == \
+        {name: sorted('|' + member for member in members) for name, members in expected.items()}
+
+
+def test_detect_merges_wheel_pieces(scene):
+    # Tire, rim and hubcap all look like wheels, they make one hub and one part
+    axles, expected = build_vehicle(scene, 4, parts=('tire', 'rim', 'hubcap'))
+    points, offsets, counts = avr_detect.read_points(avr_detect.cmds.ls(type='mesh', long=True))
+    hubs = avr_detect._find_hubs(avr_detect.mesh_stats(points, offsets, counts))
+    assert len(hubs) == 4
+    assert all(hub['radius'] == pytest.approx(vehicles.WHEEL_RADIUS) for hub in hubs)
+
+    _, names, parts = avr_detect.detect(list(scene.nodes))
+    assert names == axles
+    assert all(len(parts[wheel]) == 3 for wheel in avr.wheel_names(axles))
+
+
+def test_sort_axles_and_names():
+    def hub(x, z):
+        return {'center': np.array([x, 35.0, z]), 'radius': 35.0, 'width': 20.0}
+
+    # A trike, front wheel on the center line, and a truck with three wheels on its last axle
+    trike = avr_detect._sort_axles([hub(-150, 80), hub(150, 0), hub(-155, -80)])
+    assert [[h['center'][2] for h in axle] for axle in trike] == [[0], [-80, 80]]
+    assert avr_detect._wheel_names(trike) == [['Wheel_1C'], ['Wheel_2L', 'Wheel_2R']]
+
+    truck = avr_detect._sort_axles([hub(-300, z) for z in (80, -80, 0)] + [hub(150, -80), hub(150, 80)])
+    assert avr_detect._wheel_names(truck) == [['Wheel_1L', 'Wheel_1R'], ['Wheel_2_1', 'Wheel_2_2', 'Wheel_2_3']]
+    assert avr_detect._wheel_names(avr_detect._sort_axles([hub(150, -80), hub(150, 80), hub(-150, -80),
+                                                           hub(-150, 80)])) == vehicles.PARTS[4]
+
+
+def test_detect_large_vehicle(scene, measure):
+    axles, expected = build_vehicle(scene, 4, clutter=500)
+    shapes = avr_detect.cmds.ls(type='mesh', long=True)
+
+    start = time.perf_counter()
+    points, _, _ = avr_detect.read_points(shapes)
+    assert time.perf_counter() - start < READ_POINTS_SECONDS
+    assert len(points) > 100000
+
+    start = time.perf_counter()
+    (_, names, parts), calls = measure('detect', avr_detect.detect, list(scene.nodes))
+    assert time.perf_counter() - start < DETECT_SECONDS
+    assert names == axles and len(parts['VehicleBody']) == 501 and calls <= 1
+
+
+def test_fit_wheels(scene):
+    # A plain wheel, and one with a brake caliper clamped on its upper back quarter and a valve stem
+    front = scene.create('transform', 'Wheel_F')
+    add_mesh(scene, 'wheel_f_geo', disc((150, 30, 0), 30, 18, inner=20), front)
+    back = scene.create('transform', 'Wheel_B')
+    add_mesh(scene, 'wheel_b_geo', disc((-150, 35, 0), 35, 20, inner=25), back)
+    add_mesh(scene, 'caliper_geo', box((-170, 45, -6), (-160, 60, 6)), back)
+    add_mesh(scene, 'valve_geo', box((-137, 52, 8), (-135, 55, 9)), back)
+
+    center, axis, radius = avr_detect.fit_wheels(['Wheel_F', 'Wheel_B'])
+    assert np.allclose(center, [(150, 30, 0), (-150, 35, 0)], atol=1e-4)
+    assert np.allclose(axis, [(0, 0, 1), (0, 0, 1)], atol=1e-3)
+    assert np.allclose(radius, [30, 35], atol=1e-4)
+
+    with pytest.raises(ValueError, match="No meshes found under 'Wheel_X'"):
+        scene.create('transform', 'Wheel_X')
+        avr_detect.fit_wheels(['Wheel_X'])
+
+
+def rig_vehicle(wheels=4):
+    # Step1 to Step3 on a stand-in vehicle, with the joints where create_joints puts them and no skinning
+    vb_name, axles, parts = vehicles.build_vehicle(wheels)
+    for name, meshes in parts.items():
+        if name == vb_name:
+            avr.rename_group_model_world(name, objects=meshes)
+        else:
+            avr.rename_group_model_object(name, objects=meshes)
+    avr.create_joints(vb_name, axles)
+    avr.create_controllers(vb_name, axles)
+    return vb_name, axles
+
+
+def world(node):
+    return np.array(cmds.getAttr(node + '.worldMatrix[0]')).reshape(4, 4)
+
+
+@pytest.mark.parametrize('wheels', [2, 4, 6])
+def test_ground_contact(scene, wheels):
+    vb_name, axles = rig_vehicle(wheels)
+    names = avr.wheel_names(axles)
+    # The joints follow their controllers, which the stand-in does not evaluate, so keep their offsets
+    follow = {name: world(name + '_Jnt').dot(np.linalg.inv(world(name + '_Ctrl'))) for name in names}
+
+    # A tilted plane, ground = 0.2 * x + 0.1 * z - 10, and the body driving 100 units forward per frame.
+    # With all wheels on one line a bike only pitches, so it stands on the plane without its roll.
+    normal = np.array([-0.2, 1.0, 0.0 if wheels == 2 else -0.1])
+    normal /= np.linalg.norm(normal)
+    corners = [(x, 0.2 * x + 0.1 * z - 10.0, z) for x, z in [(-2000, -2000), (2000, -2000), (2000, 2000),
+                                                              (-2000, 2000)]]
+    add_mesh(scene, 'Terrain', corners, triangles=[(0, 1, 2), (0, 2, 3)])
+    curve = scene.create('animCurveTL', 'Body_translateX')
+    curve.attrs['keys'] = [(1.0, 0.0), (5.0, 400.0)]
+    scene.connections[vb_name + '_Ctrl.translateX'] = curve.name + '.output'
+
+    body_grp, wheel_grps = avr_terrain.bake_ground_contact(vb_name, axles, 'Terrain', 1, 5)
+    assert body_grp == vb_name + '_Ctrl_Terrain' and wheel_grps == [name + '_Ctrl_Terrain' for name in names]
+
+    for frame in range(1, 6):
+        with scene.at_time(frame):
+            hubs = np.array([follow[name].dot(world(name + '_Ctrl'))[3, :3] for name in names])
+            up = world(vb_name + '_Ctrl')[1, :3]
+        # Every hub sits one radius off the ground along the normal, and the body stands square on it
+        ground = 0.2 * hubs[:, 0] + 0.1 * hubs[:, 2] - 10.0
+        assert np.allclose((hubs[:, 1] - ground) * normal[1], vehicles.WHEEL_RADIUS, atol=1e-6)
+        assert np.allclose(up / np.linalg.norm(up), normal, atol=1e-6)
+
+    # Undo takes every key curve away again
+    scene.undo_queue[-1].undoIt()
+    assert not [node for node in scene.nodes.values() if node.type.startswith('animCurveT')
+                and node.name != curve.name]
+
+
+def test_ground_contact_bump(scene):
+    # Flat ground with a 6 unit high plateau under the front left wheel: the body tilts a little towards it
+    # and the wheels take up the rest
+    vb_name, axles = rig_vehicle(4)
+    names = avr.wheel_names(axles)
+    follow = {name: world(name + '_Jnt').dot(np.linalg.inv(world(name + '_Ctrl'))) for name in names}
+    bump = world('Wheel_FL_Jnt')[3, [0, 2]]
+
+    grid = np.arange(-500.0, 501.0, 50.0)
+    x, z = [values.ravel() for values in np.meshgrid(grid, grid, indexing='ij')]
+    y = np.where(np.hypot(x - bump[0], z - bump[1]) < 60.0, 6.0, 0.0)
+    size = len(grid)
+    cells = [row * size + col for row in range(size - 1) for col in range(size - 1)]
+    triangles = [triangle for cell in cells
+                 for triangle in [(cell, cell + 1, cell + size + 1), (cell, cell + size + 1, cell + size)]]
+    add_mesh(scene, 'Terrain', np.stack([x, y, z], axis=-1), triangles=triangles)
+
+    avr_terrain.bake_ground_contact(vb_name, axles, 'Terrain', 1, 1)
+    with scene.at_time(1):
+        hubs = np.array([follow[name].dot(world(name + '_Ctrl'))[3, :3] for name in names])
+    ground = np.where(np.hypot(hubs[:, 0] - bump[0], hubs[:, 2] - bump[1]) < 30.0, 6.0, 0.0)
+    assert ground.tolist() == [6.0, 0.0, 0.0, 0.0]
+    assert np.allclose(hubs[:, 1] - ground, vehicles.WHEEL_RADIUS, atol=0.05)
+
+
+def test_transform_cache(scene, tmp_path):
+    vb_name, axles = rig_vehicle(4)
+    joints = avr_cache.rig_joints(vb_name, axles)
+    scene.create('time', 'time1')
+    # The body joint drives 10 units forward per frame, the wheel joints come along
+    curve = scene.create('animCurveTL', 'Body_translateX')
+    curve.attrs['keys'] = [(1.0, 0.0), (10.0, 90.0)]
+    scene.connections[joints[0] + '.translateX'] = curve.name + '.output'
+    rest = {jnt: world(jnt) for jnt in joints}
+
+    path = str(tmp_path / 'car.npy')
+    assert avr_cache.bake_cache(joints, 1, 10, path) == path
+    with open(path + '.json') as f:
+        assert json.load(f) == {'joints': joints, 'start': 1, 'end': 10, 'fps': 24.0}
+    cache = np.load(path, mmap_mode='r')
+    assert cache.shape == (10, len(joints), 16) and cache.dtype == np.float32
+    for frame in (0, 4, 9):
+        expected = np.array([rest[jnt] for jnt in joints]).reshape(len(joints), 16)
+        expected[:, 12] += 10.0 * frame
+        assert np.allclose(cache[frame], expected)
+
+    # Playing back replaces the joints' connections and channels, detaching gives them back
+    connections = dict(scene.connections)
+    node = avr_cache.attach_cache(path)
+    assert scene.connections[node + '.time'] == 'time1.outTime'
+    for index, jnt in enumerate(joints):
+        assert scene.connections[jnt + '.offsetParentMatrix'] == jnt + '_Cache_MM.matrixSum'
+        assert scene.connections[jnt + '_Cache_MM.matrixIn[0]'] == '{}.outMatrix[{}]'.format(node, index)
+        assert scene.get(jnt).attrs['translate'] == [0.0, 0.0, 0.0]
+    assert joints[0] + '.translateX' not in scene.connections
+
+    avr_cache.detach_cache(node)
+    assert scene.connections == connections and node not in scene.nodes
+    assert all(np.allclose(world(jnt), rest[jnt]) for jnt in joints)
+
+    # The node reads the frame in the unit the cache was baked in, so in a 30 fps scene 0.25s (frame 7.5)
+    # still plays frame 6 of the 24 fps cache
+    creator, _ = scene.node_types['avrTransformCache']
+    cache_node = creator()
+    scene.time_unit = om.MTime.kNTSCFrame
+    data = om.MDataBlock({'cachePath': path, 'time': om.MTime(7.5, om.MTime.kNTSCFrame)})
+    out_matrix = om.MPlug(om.MObject(), 'outMatrix[2]')
+    assert cache_node.compute(out_matrix, data) is None
+    assert sorted(data.outputs['outMatrix']) == list(range(len(joints)))
+    assert [data.outputs['outMatrix'][0](3, col) for col in range(3)] == [50.0, 0.0, 0.0]
+    assert data.clean == ['outMatrix[2]']
+    # Other plugs are left to Maya
+    assert cache_node.compute(om.MPlug(om.MObject(), 'cachePath'), data) == om.kUnknownParameter
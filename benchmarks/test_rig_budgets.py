@@ -0,0 +1,790 @@
+# -*- coding: UTF-8 -*-
+# Call-count budgets for the rig steps, measured against the maya stand-in.
+# A budget is the number of maya.cmds calls a step may make for a given vehicle, so a change that adds
+# per-mesh or per-node round trips fails here long before anyone rigs a heavy asset in Maya. When a change
+# legitimately needs more (or fewer) calls, update the budget in the same commit.
+import json
+import math
+
+import pytest
+
+import AutoVehicleRig.AVR_Base as avr
+import AutoVehicleRig.AVR_Batch as avr_batch
+import AutoVehicleRig.AVR_Preset as avr_preset
+import AutoVehicleRig.AVR_Path as avr_path
+import AutoVehicleRig.AVR_Profile as avr_profile
+import AutoVehicleRig.AVR_Proxy as avr_proxy
+import AutoVehicleRig.AVR_Replicate as avr_replicate
+import AutoVehicleRig.AVR_Shapes as avr_shapes
+import AutoVehicleRig.AVR_Suspension as avr_suspension
+import AutoVehicleRig.AVR_Validate as avr_validate
+import maya.cmds as cmds
+import vehicles
+
+# Every step runs inside fast_execution: undo chunk open/close, batch query and refresh suspend/resume
+EXECUTION = 6
+# Steps that leave something selected look it up by UUID on the way out
+SELECT = 1
+
+# step -> (fixed calls, calls per part, calls per wheel, calls per mesh)
+BUDGETS = {'group_world': (16, 0, 0, 0),
+           'group_object': (15, 0, 0, 0),
+           'group_world_unscoped': (17, 0, 0, 0),
+           'group_combine': (31, 0, 0, 1),
+           'restore_meshes': (EXECUTION + SELECT + 12, 0, 0, 1),
+           'create_joints': (9, 0, 0, 0),
+           'snap_joint': (9, 0, 0, 0),
+           'bind_skin': (EXECUTION + SELECT + 2, 1, 0, 1),
+           'bind_rigid': (EXECUTION + SELECT + 2, 8, 0, 0),
+           'create_controllers': (39, 0, 27, 0),
+           'create_controllers_matrix': (40, 0, 43, 0),
+           'convert_constraints': (EXECUTION, 18, 0, 0),
+           'build_rig': (38, 3, 23, 1),
+           'update_rig': (11, 9, 0, 0),
+           'update_rig_swap': (43, 9, 0, 0),
+           'build_fleet': (29, 3, 38, 1),
+           'replicate_rig': (56, 14, 11, 2),
+           'instance_library': (2, 0, 0, 5),
+           'create_proxies': (EXECUTION + SELECT + 15, 16, 0, 5),
+           'validate_rig': (10, 9, 0, 1),
+           'create_suspension': (EXECUTION + SELECT + 71, 0, 35, 0),
+           'create_path_drive': (EXECUTION + SELECT + 53, 0, 0, 0),
+           'update_paths': (EXECUTION + 7, 0, 0, 0)}
+
+
+def budget(step, parts=0, wheels=0, meshes=0):
+    fixed, per_part, per_wheel, per_mesh = BUDGETS[step]
+    return fixed + per_part * parts + per_wheel * wheels + per_mesh * meshes
+
+
+def group_parts(measure, vb_name, parts):
+    # Step1 the way the rename buttons do it: select, then group
+    for name, meshes in parts.items():
+        avr.select_after(meshes)
+        if name == vb_name:
+            _, calls = measure('group_world', avr.rename_group_model_world, name)
+            assert calls <= budget('group_world')
+        else:
+            _, calls = measure('group_object', avr.rename_group_model_object, name)
+            assert calls <= budget('group_object')
+
+
+def rig(measure, wheels, meshes=None, bind='skin', constraint='constraint'):
+    vb_name, axles, parts = vehicles.build_vehicle(wheels, meshes)
+    names = [vb_name] + [name for axle in axles for name in axle]
+    mesh_count = sum(len(members) for members in parts.values())
+
+    group_parts(measure, vb_name, parts)
+
+    joints, calls = measure('create_joints', avr.create_joints, vb_name, axles)
+    assert joints == [name + '_Jnt' for name in names]
+    assert calls <= budget('create_joints')
+
+    for name in names:
+        _, calls = measure('snap_joint', avr.snap_joint, [name + '_Jnt', name])
+        assert calls <= budget('snap_joint')
+
+    _, calls = measure('bind_' + bind, avr.bind_skin, vb_name, axles, mode=bind)
+    assert calls <= budget('bind_' + bind, parts=len(names), meshes=mesh_count)
+
+    step = 'create_controllers' + ('_matrix' if constraint == 'matrix' else '')
+    (body_ctrl, wheel_ctrls), calls = measure(step, avr.create_controllers, vb_name, axles,
+                                              constraint=constraint, auto_spin=True)
+    assert calls <= budget(step, wheels=wheels)
+    assert body_ctrl == vb_name + '_Ctrl'
+    assert wheel_ctrls == [name + '_Ctrl' for name in names[1:]]
+
+    return vb_name, axles, parts
+
+
+@pytest.mark.parametrize('wheels', [2, 4, 6])
+def test_rig_vehicle(scene, measure, wheels):
+    vb_name, axles, parts = rig(measure, wheels)
+
+    meshes = sum(len(members) for members in parts.values())
+    assert len(scene.calls) and len(avr.wheel_names(axles)) == wheels
+    assert len([node for node in scene.nodes.values() if node.type == 'skinCluster']) == meshes
+    # The import groups were emptied by grouping and cleaned up
+    assert not [name for name in scene.nodes if name.startswith('Vehicle_')
+                and scene.nodes[name].type == 'transform' and not scene.nodes[name].children]
+
+
+@pytest.mark.parametrize('bind, constraint', [('rigid', 'matrix'), ('skin', 'matrix'), ('rigid', 'constraint')])
+def test_rig_modes(scene, measure, bind, constraint):
+    rig(measure, 4, bind=bind, constraint=constraint)
+    if bind == 'rigid':
+        assert not [node for node in scene.nodes.values() if node.type == 'skinCluster']
+
+
+def test_controller_shapes(scene, measure, tmp_path, monkeypatch):
+    # Controllers come from the shape library, sized to their parts, and user shapes replace shipped ones
+    monkeypatch.setattr(avr_shapes, '_SHAPES', {})
+    vb_name, axles, _ = rig(measure, 4)
+    assert not scene.calls['file']
+    wheel = scene.get('Wheel_FL_CtrlShape').attrs
+    assert wheel['degree'] == 3 and wheel['periodic']
+    assert max(cv[0] for cv in wheel['cvs']) == pytest.approx(1.108194 * vehicles.WHEEL_RADIUS)
+    body = scene.get(vb_name + '_CtrlShape').attrs['cvs']
+    assert max(cv[0] for cv in body) == pytest.approx(270.0) and max(cv[2] for cv in body) == pytest.approx(120.0)
+
+    with pytest.raises(ValueError):
+        avr_shapes.save_shape(vb_name + '_Ctrl', 'body')
+    monkeypatch.setenv(avr_shapes.SHAPES_ENV, str(tmp_path))
+    path = avr_shapes.save_shape(vb_name + '_Ctrl', 'body')
+    avr_shapes.reload_shapes()
+    saved = avr_shapes.load_shape('body')
+    assert saved == json.load(open(path))['curves']
+    assert max(abs(value) for cv in saved[0]['cvs'] for value in cv) == 1.0
+    assert avr_shapes.shape_names() == ['body', 'wheel']
+
+    # Sized by the drawn curve, so a saved wheel comes back like the shipped one and not smaller
+    avr_shapes.save_shape('Wheel_FL_Ctrl', 'tyre')
+    for cv, shipped in zip(avr_shapes.load_shape('tyre')[0]['cvs'], avr_shapes.load_shape('wheel')[0]['cvs']):
+        assert cv == pytest.approx(shipped, abs=1e-5)
+    with pytest.raises(ValueError):
+        avr_shapes.load_shape('tank')
+
+
+def test_multi_curve_shape(scene, tmp_path, monkeypatch):
+    # Every curve of a shape ends up under one transform, the extra transforms go away
+    monkeypatch.setattr(avr_shapes, '_SHAPES', {})
+    monkeypatch.setenv(avr_shapes.SHAPES_ENV, str(tmp_path))
+    line = {'degree': 1, 'periodic': False, 'knots': [0.0, 1.0]}
+    with open(str(tmp_path / 'cross.json'), 'w') as f:
+        json.dump({'curves': [dict(line, cvs=[[-1, 0, 0], [1, 0, 0]]), dict(line, cvs=[[0, 0, -1], [0, 0, 1]]),
+                              dict(line, cvs=[[0, -1, 0], [0, 1, 0]])]}, f)
+
+    ctrl = avr_shapes.create_shape('cross', 'Cross_Ctrl', (2.0, 3.0, 4.0))
+    assert ctrl == 'Cross_Ctrl'
+    shapes = cmds.listRelatives(ctrl, s=1)
+    assert shapes == ['Cross_CtrlShape', 'Cross_CtrlShape1', 'Cross_CtrlShape2']
+    assert scene.get('Cross_CtrlShape1').attrs['cvs'] == [(0.0, 0.0, -4.0), (0.0, 0.0, 4.0)]
+    assert [name for name in scene.nodes if scene.nodes[name].type == 'transform'] == ['Cross_Ctrl']
+
+
+@pytest.mark.parametrize('wheels', [2, 4, 6])
+def test_convert_constraints(scene, measure, wheels):
+    vb_name, axles, _ = rig(measure, wheels)
+    converted, calls = measure('convert_constraints', avr.convert_constraints, vb_name, axles)
+    assert len(converted) == wheels + 1
+    assert calls <= budget('convert_constraints', parts=wheels + 1)
+
+
+@pytest.mark.parametrize('meshes', [10, 100, 1000, 10000])
+def test_synthetic_vehicle(scene, measure, meshes):
+    # Grouping must not make per-mesh calls, skinning makes exactly one per mesh
+    rig(measure, 4, meshes)
+
+
+@pytest.mark.parametrize('scoped', [True, False])
+def test_group_in_large_scene(scene, measure, scoped):
+    # 100k unrelated transforms: the scoped clean-up only looks at the selection's old parents
+    vehicles.add_clutter(100000)
+    vb_name, _, parts = vehicles.build_vehicle(4, 100)
+
+    step = 'group_world' if scoped else 'group_world_unscoped'
+    avr.select_after(parts[vb_name])
+    report, calls = measure(step, avr.rename_group_model_world, vb_name, scoped)
+    assert calls <= budget(step)
+    assert len(report['items']) == len(parts[vb_name])
+    assert 'Set_Grp_0' in scene.nodes
+
+
+def test_combine_meshes(scene, measure):
+    # One mesh per material in the part group, and the pieces come back from their face ranges
+    vb_name, _, parts = vehicles.build_vehicle(4, 100)
+    meshes = parts[vb_name]
+    paint = cmds.sets(renderable=True, noSurfaceShader=True, empty=True, n='Paint_SG')
+    glass = cmds.sets(renderable=True, noSurfaceShader=True, empty=True, n='Glass_SG')
+    cmds.sets(meshes[:60], e=True, forceElement=paint)
+    cmds.sets(meshes[60:], e=True, forceElement=glass)
+
+    report, calls = measure('group_combine', avr.rename_group_model_object, vb_name, objects=meshes,
+                            combine=True)
+    assert calls <= budget('group_combine', meshes=len(meshes))
+    assert sorted(report['combined']) == [vb_name + '_Combined0', vb_name + '_Combined1']
+    assert cmds.listRelatives(vb_name, c=1, type='transform') == report['combined']
+    assert sorted(avr.part_pieces(vb_name)) == sorted(meshes)
+    pieces = json.loads(cmds.getAttr(vb_name + '.' + avr.PIECES_ATTR))
+    assert sorted(len(ranges) for ranges in pieces.values()) == [len(meshes) - 60, 60]
+    assert sorted(cmds.polyEvaluate(mesh, f=True) for mesh in pieces) == [6 * (len(meshes) - 60), 360]
+
+    restored, calls = measure('restore_meshes', avr.restore_meshes, vb_name)
+    assert calls <= budget('restore_meshes', meshes=len(meshes))
+    assert sorted(restored) == sorted(meshes)
+    assert all(cmds.polyEvaluate(mesh, f=True) == 6 for mesh in restored)
+    assert not cmds.attributeQuery(avr.PIECES_ATTR, node=vb_name, exists=True)
+    assert sorted(cmds.listRelatives(vb_name, c=1, type='transform')) == sorted(meshes)
+
+
+def test_early_return_closes_undo_chunk(scene):
+    avr.select_after([])
+    assert avr.rename_group_model_world('VehicleBody') is None
+    assert scene.messages[-1][0] == 'warning'
+    assert scene.open_chunks == 0 and scene.chunk_names == ['rename_group_model_world']
+
+
+def test_error_closes_undo_chunk(scene):
+    vb_name, axles, _ = vehicles.build_vehicle(2)
+    with pytest.raises(ValueError):
+        avr.bind_skin(vb_name, axles, mode='unknown')
+    assert scene.open_chunks == 0
+    assert not scene.refresh_suspended
+
+
+def test_chunked_run(scene):
+    # One undo chunk kept open across the chunks, closed when the step runs out
+    vb_name, axles, parts = vehicles.build_vehicle(4, 100)
+    for name, meshes in parts.items():
+        avr.rename_group_model_object(name, objects=meshes)
+    avr.create_joints(vb_name, axles)
+
+    run = avr.ChunkedRun('bind_skin', avr.bind_skin_chunks(vb_name, axles, chunk_size=30))
+    progress = []
+    while run.step():
+        progress.append(run.progress)
+        assert scene.open_chunks == 1 and scene.refresh_suspended
+    assert progress == [(30, 100), (60, 100), (90, 100), (100, 100)]
+    assert run.eta() == 0
+    assert len([node for node in scene.nodes.values() if node.type == 'skinCluster']) == 100
+    assert scene.open_chunks == 0 and scene.chunk_names[-1] == 'bind_skin'
+    assert [node.name for node in scene.selection] == [vb_name + '_Jnt']
+
+    run = avr.ChunkedRun('create_controllers', avr.create_controllers_chunks(vb_name, axles, auto_spin=True))
+    while run.step():
+        pass
+    assert run.progress == (4, 4)
+    assert scene.get('Wheel_FL_Ctrl_Spin').parent.name == vb_name + '_Ctrl'
+
+
+def test_chunked_run_cancel(scene):
+    # Cancelling, or a chunk failing, closes the chunk and undoes the whole run
+    vb_name, axles, parts = vehicles.build_vehicle(4, 100)
+    for name, meshes in parts.items():
+        avr.rename_group_model_object(name, objects=meshes)
+    avr.create_joints(vb_name, axles)
+
+    run = avr.ChunkedRun('bind_skin', avr.bind_skin_chunks(vb_name, axles, chunk_size=30))
+    run.step()
+    run.cancel()
+    assert scene.calls['undo'] == 1
+    assert scene.open_chunks == 0 and not scene.refresh_suspended
+
+    # Every mesh is bound already from the cancelled run, which the stand-in does not undo
+    run = avr.ChunkedRun('bind_skin', avr.bind_skin_chunks(vb_name, axles, chunk_size=30))
+    with pytest.raises(RuntimeError):
+        run.step()
+    assert scene.calls['undo'] == 2
+    assert scene.open_chunks == 0 and not scene.refresh_suspended
+
+    with pytest.raises(ValueError):
+        avr.bind_skin_chunks(vb_name, axles, mode='unknown')
+
+
+def test_nested_steps_share_one_chunk(scene):
+    vb_name, axles, parts = vehicles.build_vehicle(4)
+    with avr.fast_execution('rig'):
+        for name, meshes in parts.items():
+            avr.rename_group_model_object(name, objects=meshes)
+        avr.create_joints(vb_name, axles)
+        assert scene.refresh_suspended
+    assert scene.chunk_names == ['rig']
+
+
+def test_batch_execution_skips_undo(scene):
+    vb_name, axles, _ = vehicles.build_vehicle(4)
+    with avr.fast_execution('batch', undo=False):
+        avr.create_joints(vb_name, axles)
+        assert not scene.undo_state
+    assert scene.undo_state and scene.chunk_names == []
+
+
+def test_profile(scene, measure):
+    # Every step and sub-step is a section, its commands are the maya.cmds calls it made, and the trace
+    # is one complete ('X') event per section
+    vb_name, axles, parts = rig(measure, 4)
+    avr_profile.reset()
+    avr_profile.enable()
+    try:
+        _, calls = measure('bind_rigid', avr.bind_skin, vb_name, axles, mode='rigid')
+    finally:
+        avr_profile.disable()
+    assert avr.cmds is cmds
+
+    steps = avr_profile.report()['steps']
+    assert sorted(steps) == ['bind_skin', 'rigid_attach']
+    assert steps['bind_skin']['calls'] == 1 and steps['rigid_attach']['calls'] == len(parts)
+    assert sum(steps['bind_skin']['commands'].values()) == calls
+    assert steps['bind_skin']['commands']['undoInfo'] == 3
+
+    trace = json.loads(json.dumps(avr_profile.chrome_trace()))
+    assert trace['displayTimeUnit'] == 'ms'
+    assert [event['name'] for event in trace['traceEvents']] == ['bind_skin'] + ['rigid_attach'] * len(parts)
+    outer = trace['traceEvents'][0]
+    for event in trace['traceEvents']:
+        assert set(event) == {'name', 'cat', 'ph', 'pid', 'tid', 'ts', 'dur', 'args'} and event['ph'] == 'X'
+        assert outer['ts'] <= event['ts'] and event['ts'] + event['dur'] <= outer['ts'] + outer['dur']
+        assert event['args']['totalCommands'] == sum(v for k, v in event['args'].items() if k != 'totalCommands')
+    assert outer['args']['totalCommands'] == calls
+
+    avr_profile.reset()
+    assert avr_profile.report() == {'events': [], 'steps': {}, 'total': 0.0}
+
+
+def test_batch_axles():
+    assert avr_batch._axles(['Wheel_F', 'Wheel_B']) == [['Wheel_F'], ['Wheel_B']]
+    assert avr_batch._axles(['W1L', 'W1R', 'W2L', 'W2R', 'W3L', 'W3R']) == [['W1L', 'W1R'], ['W2L', 'W2R'],
+                                                                             ['W3L', 'W3R']]
+    # A trike lists its axles, one wheel in front and two at the back
+    assert avr_batch._axles(['W_F', 'W_BL', 'W_BR'], [['W_F'], ('W_BL', 'W_BR')]) == [['W_F'], ['W_BL', 'W_BR']]
+    for wheels, axles in [(['W_F', 'W_BL', 'W_BR'], None), (['W_F', 'W_B'], [['W_F'], ['W_X']]),
+                          (['W_FL', 'W_FR'], [['W_FL', 'W_FR']])]:
+        with pytest.raises(ValueError):
+            avr_batch._axles(wheels, axles)
+
+
+def test_batch_load_jobs(tmp_path):
+    parts = {'VehicleBody': ['body'], 'Wheel_F': ['wheel_f'], 'Wheel_B': ['wheel_b']}
+    manifest = {'suffix': '_J', 'combine': True, 'parts': parts, 'preset': 'sedan.json',
+                'jobs': ['a.mb', {'scene': 'b.mb', 'parts': {'VehicleBody': ['hull']}, 'suffix': '_Bone'},
+                         {'scene': 'c.mb', 'fleet': [{'namespace': 'Car01', 'preset': 'sedan.json'}]}]}
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps(manifest))
+
+    a, b, c = avr_batch.load_jobs(str(path))
+    # Jobs without their own parts or fleet replay the top-level preset, everything else is copied
+    assert a == {'scene': 'a.mb', 'preset': 'sedan.json', 'parts': parts, 'suffix': '_J', 'combine': True}
+    assert b == {'scene': 'b.mb', 'parts': {'VehicleBody': ['hull']}, 'suffix': '_Bone', 'combine': True}
+    assert 'preset' not in c and c['parts'] == parts
+
+    del manifest['parts'], manifest['preset']
+    path.write_text(json.dumps(manifest))
+    with pytest.raises(ValueError, match="No part mapping for 'a.mb'"):
+        avr_batch.load_jobs(str(path))
+
+
+@pytest.mark.parametrize('wheels', [2, 4])
+def test_batch_rig_scene(scene, wheels):
+    vb_name, axles, parts = vehicles.build_vehicle(wheels)
+    job = {'scene': 'D:/cars/car.mb', 'output': 'D:/cars/car_rig.ma', 'parts': parts, 'constraint': 'matrix'}
+
+    result = avr_batch.rig_scene(job)
+    assert result['ok'], result['error']
+    assert result['scene'] == 'D:/cars/car.mb' and result['output'] == 'D:/cars/car_rig.ma'
+    assert sorted(result['timings']) == ['bind', 'controllers', 'group', 'joints', 'open', 'save', 'snap']
+    assert result['total'] >= sum(result['timings'].values())
+    assert scene.saved == [('D:/cars/car_rig.ma', 'mayaAscii')]
+    assert all(name + '_Ctrl' in scene.nodes for name in avr.wheel_names(axles))
+    # Nothing went to the undo queue
+    assert scene.undo_state and not scene.undo_queue
+
+    # The rig definition is kept on the rig, so batch rigs can be updated and replicated
+    definition = avr_preset.stored(vb_name)
+    assert definition['axles'] == [list(axle) for axle in axles] and definition['constraint'] == 'matrix'
+    assert sorted(definition['parts']) == sorted(parts)
+    copies = avr_replicate.replicate_rig(vb_name, 1)
+    assert list(copies) == [vb_name + '_Copy01']
+    assert not any(avr_preset.update_rig(vb_name).values())
+
+    # A failing scene reports its error instead of raising
+    result = avr_batch.rig_scene(dict(job, parts={'VehicleBody': parts['VehicleBody'], 'Wheel_X': []}))
+    assert not result['ok'] and 'ValueError' in result['error']
+
+
+def test_create_joints_undo(scene):
+    vb_name, axles, _ = vehicles.build_vehicle(4)
+    joints = avr.create_joints(vb_name, axles)
+    assert all(joint in scene.nodes for joint in joints)
+    assert all(scene.connections[joint + '.inverseScale'] == joints[0] + '.scale' for joint in joints[1:])
+
+    scene.undo_queue[-1].undoIt()
+    assert not [joint for joint in joints if joint in scene.nodes]
+    assert not [plug for plug in scene.connections if plug.endswith('.inverseScale')]
+
+
+@pytest.mark.parametrize('wheels', [2, 4, 6])
+def test_preset_replay(scene, measure, wheels):
+    # Step1 to Step3 from a recorded definition, in one undo chunk
+    vb_name, axles, parts = rig(measure, wheels)
+    definition = avr_preset.record_rig(vb_name, axles)
+    avr_preset.store(definition)
+    assert avr_preset.stored(vb_name) == definition
+
+    # Replay on a fresh import of the same vehicle
+    scene.reset()
+    vehicles.build_vehicle(wheels)
+    joints, calls = measure('build_rig', avr_preset.build_rig, definition)
+    assert calls <= budget('build_rig', parts=wheels + 1, wheels=wheels,
+                           meshes=sum(len(members) for members in parts.values()))
+    assert scene.chunk_names == ['build_rig']
+    for name, matrix in definition['joints'].items():
+        assert list(scene.world_matrix(scene.get(name + '_Jnt'))) == pytest.approx(matrix)
+    assert joints == [name + '_Jnt' for name in [vb_name] + avr.wheel_names(axles)]
+
+
+@pytest.mark.parametrize('bind', ['skin', 'rigid'])
+def test_update_rig(scene, measure, bind):
+    # Swapping one wheel's meshes only touches that wheel, without importing any controller again
+    vb_name, axles, parts = rig(measure, 4, bind=bind)
+    avr_preset.store(avr_preset.record_rig(vb_name, axles, bind=bind))
+
+    report, calls = measure('update_rig', avr_preset.update_rig, vb_name)
+    assert report == {'rebound': [], 'replaced': [], 'reconstrained': []}
+    assert calls <= budget('update_rig', parts=len(parts))
+
+    # The new wheel sits 10 units further out
+    avr.select_after([])
+    scene.remove(scene.get(parts['Wheel_FL'][0]))
+    before = avr_preset.stored(vb_name)
+    box = before['bounds']['Wheel_FL']
+    wheel = vehicles._mesh('new_tire_geo', None, ((box[0], box[1], box[2] - 10.0), (box[3], box[4], box[5] - 10.0)))
+
+    report, calls = measure('update_rig_swap', avr_preset.update_rig, vb_name, parts={'Wheel_FL': [wheel]})
+    assert report == {'rebound': ['Wheel_FL_Jnt'], 'replaced': ['Wheel_FL_Jnt'], 'reconstrained': []}
+    assert calls <= budget('update_rig_swap', parts=len(parts))
+    assert not scene.calls['file']
+    assert list(scene.get('Wheel_FL_Ctrl').attrs['offsetParentMatrix'][12:15]) == pytest.approx([0.0, 0.0, -10.0])
+    assert scene.get(wheel).parent.name == 'Wheel_FL'
+    if bind == 'skin':
+        assert 'skinCluster' in scene.get(wheel + 'Shape').attrs
+    else:
+        assert scene.connections['Wheel_FL.offsetParentMatrix'].startswith('Wheel_FL_Rigid_MM')
+
+    definition = avr_preset.stored(vb_name)
+    assert definition['parts']['Wheel_FL'] == [wheel]
+    assert definition['joints']['Wheel_FL'][14] == pytest.approx(before['joints']['Wheel_FL'][14] - 10.0)
+    assert avr_preset.update_rig(vb_name) == {'rebound': [], 'replaced': [], 'reconstrained': []}
+
+
+@pytest.mark.parametrize('bind', ['skin', 'rigid'])
+def test_update_rig_in_place(scene, measure, bind):
+    # A wheel remodelled 10 units further out under the same mesh name is re-placed all the same
+    vb_name, axles, parts = rig(measure, 4, bind=bind)
+    avr_preset.store(avr_preset.record_rig(vb_name, axles, bind=bind))
+    before = avr_preset.stored(vb_name)
+    for mesh in parts['Wheel_FL']:
+        for shape in scene.get(mesh).children:
+            low, high = shape.attrs['bbox']
+            shape.attrs['bbox'] = ((low[0], low[1], low[2] - 10.0), (high[0], high[1], high[2] - 10.0))
+
+    report, calls = measure('update_rig', avr_preset.update_rig, vb_name)
+    assert report == {'rebound': ['Wheel_FL_Jnt'], 'replaced': ['Wheel_FL_Jnt'], 'reconstrained': []}
+    assert calls <= budget('update_rig_swap', parts=len(parts))
+    assert list(scene.get('Wheel_FL_Ctrl').attrs['offsetParentMatrix'][12:15]) == pytest.approx([0.0, 0.0, -10.0])
+    definition = avr_preset.stored(vb_name)
+    assert definition['joints']['Wheel_FL'][14] == pytest.approx(before['joints']['Wheel_FL'][14] - 10.0)
+    assert definition['bounds']['Wheel_FL'][2] == pytest.approx(before['bounds']['Wheel_FL'][2] - 10.0)
+    assert avr_preset.update_rig(vb_name) == {'rebound': [], 'replaced': [], 'reconstrained': []}
+
+
+@pytest.mark.parametrize('count', [1, 10, 50])
+def test_build_fleet(scene, measure, count):
+    # Identical vehicles side by side, one namespace each, with controllers built without any file import
+    fleet = []
+    for index in range(count):
+        namespace = 'Car{:02d}'.format(index)
+        with avr.vehicle_namespace(namespace):
+            vb_name, axles, parts = vehicles.build_vehicle(4)
+        fleet.append((namespace, {'vehicle': vb_name, 'axles': axles,
+                                  'parts': dict((name, [mesh.split(':')[-1] for mesh in meshes])
+                                                for name, meshes in parts.items())}))
+
+    rigged, calls = measure('build_fleet', avr_preset.build_fleet, fleet)
+    assert calls <= budget('build_fleet', parts=5 * count, wheels=4 * count, meshes=15 * count)
+    assert not scene.calls['file']
+    assert sorted(rigged) == [namespace for namespace, _ in fleet]
+    assert scene.namespace == '' and not scene.relative
+
+    for namespace, _ in fleet:
+        ctrl = scene.get(':{}:Wheel_FL_Ctrl'.format(namespace))
+        assert ctrl.parent.name == namespace + ':VehicleBody_Ctrl'
+        assert [child.name for child in scene.get(':{}:Wheel_FL_Jnt'.format(namespace)).children
+                if child.type == 'pointConstraint'] == [namespace + ':Wheel_FL_Jnt_pointConstraint1']
+        assert avr_preset.stored(':{}:VehicleBody'.format(namespace))['parts']['Wheel_FL']
+
+
+@pytest.mark.parametrize('bind', ['skin', 'rigid'])
+@pytest.mark.parametrize('count', [1, 10])
+def test_replicate_rig(scene, measure, bind, count):
+    # Copies get their own joints and controllers but share the source geometry through instancing
+    vb_name, axles, parts = rig(measure, 4, bind=bind)
+    avr_preset.store(avr_preset.record_rig(vb_name, axles, bind=bind))
+    paint = cmds.sets(renderable=True, noSurfaceShader=True, empty=True, n='Paint_SG')
+    cmds.sets(parts[vb_name], e=True, forceElement=paint)
+
+    def geometry():
+        return set(id(node.attrs) for node in scene.nodes.values() if node.type == 'mesh')
+    before = geometry()
+    skins = len([node for node in scene.nodes.values() if node.type == 'skinCluster'])
+
+    copies, calls = measure('replicate_rig', avr_replicate.replicate_rig, vb_name, count,
+                            variants=[None, (1.0, 0.0, 0.0)])
+    meshes = sum(len(members) for members in parts.values())
+    library = budget('instance_library', meshes=meshes) if bind == 'skin' else 0
+    assert calls <= budget('replicate_rig', parts=5 * count, wheels=4 * count, meshes=meshes * count) + library
+    assert not scene.calls['file']
+    assert sorted(copies) == ['VehicleBody_Copy{:02d}'.format(index + 1) for index in range(count)]
+
+    # No deformers and no mesh data per copy: a skinned source adds one undeformed library copy of its
+    # meshes, shared by every copy
+    assert len([node for node in scene.nodes.values() if node.type == 'skinCluster']) == skins
+    assert len(geometry() - before) == (meshes if bind == 'skin' else 0)
+
+    for namespace in copies:
+        assert scene.connections[namespace + ':Wheel_FL.offsetParentMatrix'] == namespace + ':Wheel_FL_Rigid_MM.matrixSum'
+        assert scene.get(':{}:Wheel_FL_Ctrl'.format(namespace)).parent.name == namespace + ':VehicleBody_Ctrl'
+    # The first copy keeps the source shading, the second is painted red
+    body_shape = scene.get(':VehicleBody_Copy01:' + parts[vb_name][0]).children[0].name
+    members = [src for dst, src in scene.connections.items() if dst.startswith('Paint_SG.dagSetMembers')]
+    assert body_shape + '.instObjGroups[0]' in members
+    if count > 1:
+        assert scene.get(':VehicleBody_Copy02:Paint_Mtl').attrs['color'] == [1.0, 0.0, 0.0]
+
+
+def test_replicate_rig_faces_and_namespaces(scene, measure):
+    # Per-face shading carries over to the copies, and copies never go into a namespace that is in use
+    vb_name, axles, parts = rig(measure, 4, bind='rigid')
+    avr_preset.store(avr_preset.record_rig(vb_name, axles, bind='rigid'))
+    body_geo = parts[vb_name][0]
+    for engine, faces in (('Paint_SG', 'f[0:3]'), ('Glass_SG', 'f[4:5]')):
+        cmds.sets(renderable=True, noSurfaceShader=True, empty=True, n=engine)
+        cmds.sets('{}.{}'.format(body_geo, faces), e=True, forceElement=engine)
+
+    def assigned():
+        members = {}
+        for dst, src in scene.connections.items():
+            if '.dagSetMembers[' in dst and dst.split('.')[0] in ('Paint_SG', 'Glass_SG'):
+                members.setdefault(dst.split('.')[0], []).append(cmds.getAttr(src + '.objectGrpCompList'))
+        return members
+
+    copies = avr_replicate.replicate_rig(vb_name, 1)
+    assert list(copies) == ['VehicleBody_Copy01']
+    assert assigned() == {'Paint_SG': [['f[0:3]']] * 2, 'Glass_SG': [['f[4:5]']] * 2}
+
+    copies = avr_replicate.replicate_rig(vb_name, 2)
+    assert sorted(copies) == ['VehicleBody_Copy02', 'VehicleBody_Copy03']
+    first, third = [cmds.getAttr(':VehicleBody_Copy0{}:VehicleBody.translateZ'.format(index)) for index in (1, 3)]
+    assert third == pytest.approx(3 * first)
+
+    with pytest.raises(ValueError, match="'VehicleBody_Copy01' is already in use"):
+        avr_replicate.replicate_rig(vb_name, 1, namespaces=['VehicleBody_Copy01'])
+    with pytest.raises(ValueError, match='its own namespace'):
+        avr_replicate.replicate_rig(vb_name, 2, namespaces=['Car', 'Car'])
+    assert not cmds.namespace(exists=':Car')
+
+
+@pytest.mark.parametrize('bind, mode', [('skin', 'box'), ('rigid', 'box'), ('skin', 'reduce')])
+def test_create_proxies(scene, measure, bind, mode):
+    # One proxy per part, bound like the part, and a switch that hides the full meshes and blocks their skins
+    vb_name, axles, parts = rig(measure, 4, 100, bind=bind)
+    meshes = sum(len(members) for members in parts.values())
+    rest = scene.world_matrix(scene.get('Wheel_FL_Jnt'))
+    cmds.move(0, 50, 0, 'Wheel_FL_Jnt', r=1)  # Built on an animated frame
+    proxies, calls = measure('create_proxies', avr_proxy.create_proxies, vb_name, axles, mode=mode)
+    assert calls <= budget('create_proxies', parts=len(parts), meshes=meshes)
+    assert sorted(proxies) == sorted(parts)
+
+    ctrl = scene.get(vb_name + '_Ctrl')
+    assert ctrl.attrs[avr_proxy.PROXY_ATTR] == 1
+    for name, proxy in proxies.items():
+        assert scene.get(proxy).parent.name == name
+        assert scene.connections[proxy + '.visibility'] == vb_name + '_Ctrl.proxy'
+        for mesh in parts[name]:
+            assert scene.connections[mesh + '.visibility'] == vb_name + '_Proxy_Rev.outputX'
+        if bind == 'skin':
+            assert 'skinCluster' in scene.get(proxy).attrs
+    if bind == 'skin':
+        # Bound at rest, like the full meshes
+        cluster = scene.get(proxies['Wheel_FL']).attrs['skinCluster']
+        assert list(cmds.getAttr(cluster + '.bindPreMatrix[0]')) == \
+            pytest.approx(avr.to_list(avr.to_mmatrix(rest).inverse()))
+    clusters = [node.name for node in scene.nodes.values() if node.type == 'skinCluster']
+    blocked = [name for name in clusters if scene.connections.get(name + '.nodeState') == vb_name + '_Proxy_State.output']
+    assert len(blocked) == (meshes if bind == 'skin' else 0)
+
+    # Rebuilding replaces the proxies and keeps the switch
+    avr_proxy.create_proxies(vb_name, axles, mode=mode)
+    assert len([node for node in scene.nodes.values() if node.name.endswith('_Proxy')]) == len(parts)
+
+
+def test_validate_rig(scene, measure, monkeypatch):
+    # Every kind of slowdown is found, everything but the expression is fixed, and the report is plain JSON
+    vb_name, axles, parts = rig(measure, 4)
+    avr_preset.store(avr_preset.record_rig(vb_name, axles))
+    cmds.evaluationManager(mode='off')
+    smooth = cmds.createNode('polySmoothFace')
+    cmds.connectAttr(smooth + '.output', parts[vb_name][0] + 'Shape.inMesh', f=True)
+    # History in front of a skinCluster hangs off its undeformed input shape
+    cmds.connectAttr(cmds.createNode('polySmoothFace') + '.output',
+                     cmds.ls('Wheel_FL', dag=1, et='mesh', io=1)[0] + '.inMesh')
+    expression = cmds.createNode('expression')
+    cmds.connectAttr(expression + '.output[0]', 'Wheel_FL_Ctrl.rotateX')
+    cmds.setAttr('Wheel_BR_Jnt.frozen', True)
+    cmds.createNode('reverse', n=vb_name + '_Proxy_Rev')
+
+    issues, calls = measure('validate_rig', avr_validate.validate_rig, vb_name, axles)
+    assert calls <= budget('validate_rig', parts=len(parts), meshes=sum(len(members) for members in parts.values()))
+    assert [issue['check'] for issue in issues] == list(avr_validate.CHECKS)
+    nodes = dict((issue['check'], issue['nodes']) for issue in issues)
+    assert nodes['frozen'] == ['Wheel_BR_Jnt']
+    assert nodes['history'] == [parts[vb_name][0] + 'Shape', parts['Wheel_FL'][0]]
+
+    # Playback sets every frame with an update while the viewport is suspended
+    times = []
+    monkeypatch.setattr(avr_validate.cmds, 'currentTime', lambda *args, **kwargs: times.append(
+        (args, kwargs.get('update'), scene.refresh_suspended)) or 1.0)
+    cmds.playbackOptions(min=1, max=10)
+    assert avr_validate.measure_playback() > 0
+    assert times[1:-1] == [((frame,), True, True) for frame in range(1, 11)]
+    monkeypatch.undo()
+
+    report = avr_validate.check_rig(vb_name, axles, fix=True, playback=True)
+    assert json.loads(json.dumps(report)) == report
+    assert report['fixed'] == [check for check in avr_validate.CHECKS if check != 'expressions']
+    assert sorted(report['fps']) == ['after', 'before']
+    assert scene.chunk_names[-1] == 'fix_rig'
+
+    assert [issue['check'] for issue in avr_validate.validate_rig(vb_name, axles)] == ['expressions']
+    assert not [node for node in scene.nodes.values() if node.type == 'pointConstraint']
+    for name in parts:
+        assert not avr_preset.skinned_meshes(name + '_Jnt')
+        assert scene.connections[name + '.offsetParentMatrix'] == name + '_Rigid_MM.matrixSum'
+        assert scene.connections[name + '_Jnt.offsetParentMatrix'] == name + '_Jnt_MM.matrixSum'
+    assert avr_preset.stored(vb_name)['bind'] == 'rigid'
+
+
+def evaluate(scene, plug):
+    # The value of a plug of the utility node network, worked out from the stand-in's connections
+    if plug in scene.connections:
+        node, attr = scene.connections[plug].split('.', 1)
+        node = scene.get(node)
+        value = lambda name: evaluate(scene, '{}.{}'.format(node.name, name))
+        if node.type == 'plusMinusAverage':
+            plugs = set('{}.{}'.format(node.name, name) for name in node.attrs) | set(scene.connections)
+            inputs = [evaluate(scene, key) for key in sorted(plugs) if key.startswith(node.name + '.input1D[')]
+            operation = node.attrs.get('operation', 1)
+            return sum(inputs) / len(inputs) if operation == 3 else inputs[0] - sum(inputs[1:]) if operation == 2 else sum(inputs)
+        if node.type == 'multDoubleLinear':
+            return value('input1') * value('input2')
+        if node.type == 'addDoubleLinear':
+            return value('input1') + value('input2')
+        if node.type == 'clamp':
+            return min(max(value('inputR'), value('minR')), value('maxR'))
+        return evaluate(scene, '{}.{}'.format(node.name, attr))
+
+    node, attr = plug.split('.', 1)
+    node = scene.get(node)
+    if attr[:-1] in ('translate', 'rotate') and attr[-1] in 'XYZ':
+        return node.attrs[attr[:-1]]['XYZ'.index(attr[-1])]
+    return node.attrs.get(attr, 0.0)
+
+
+@pytest.mark.parametrize('constraint', ['constraint', 'matrix'])
+def test_create_suspension(scene, measure, constraint):
+    # Utility nodes only, the body joint follows the suspension group, and the body plane follows the wheels
+    vb_name, axles, parts = rig(measure, 6, constraint=constraint)
+    placements = avr.default_placements(vb_name, axles)
+    for name in avr.wheel_names(axles):
+        scene.set_world_position(scene.get(name + '_Jnt'), [placements[name](3, axis) for axis in range(3)])
+    body, calls = measure('create_suspension', avr_suspension.create_suspension, vb_name, axles,
+                          travel=10.0, droop=5.0)
+    assert calls <= budget('create_suspension', wheels=6)
+    assert not [node for node in scene.nodes.values() if node.type == 'expression']
+    if constraint == 'matrix':
+        assert scene.connections[vb_name + '_Jnt_MM.matrixIn[1]'] == body + '.worldMatrix[0]'
+    else:
+        assert scene.get(vb_name + '_Jnt_pointConstraint1').attrs['targets'] == [body]
+    for name in avr.wheel_names(axles):
+        assert scene.get(name + '_Ctrl_Susp').parent.name == vb_name + '_Ctrl'
+
+    # Front left wheel 8 up, 4 of it through the half stiff spring; rear right 20 up, 10 beyond its travel
+    scene.get('Wheel_FL_Ctrl_Susp').attrs['translate'][1] = 8.0
+    scene.get('Wheel_BR_Ctrl_Susp').attrs['translate'][1] = 20.0
+    corners = {'Wheel_FL': 4.0, 'Wheel_BR': 15.0}
+    assert evaluate(scene, body + '.translateY') == pytest.approx(sum(corners.values()) / 6)
+    pitch = (4.0 / 2 - 15.0 / 2) / (avr.AXLE_SPACING * 3)
+    roll = -(4.0 / 3 - 15.0 / 3) / (-avr.HALF_TRACK * 2)
+    assert evaluate(scene, body + '.rotateZ') == pytest.approx(math.degrees(pitch))
+    assert evaluate(scene, body + '.rotateX') == pytest.approx(math.degrees(roll))
+
+    scene.get(vb_name + '_Ctrl').attrs[avr_suspension.SUSPENSION_ATTR] = 0.0
+    assert evaluate(scene, body + '.translateY') == 0.0
+
+
+def test_create_suspension_outside_body(scene, measure):
+    # A wheel controller taken out of the body controller is reported instead of walking past the root
+    vb_name, axles, parts = rig(measure, 4)
+    cmds.parent(avr.top_under('Wheel_FL_Ctrl', vb_name + '_Ctrl'), w=1)
+    with pytest.raises(ValueError, match="'Wheel_FL_Ctrl' is not under"):
+        avr_suspension.create_suspension(vb_name, axles)
+
+
+def test_wheel_spin(scene, measure):
+    # Driving forward spins the wheels by travel / radius, turning in place leaves them where they are
+    vb_name, axles, parts = rig(measure, 4)
+    body = scene.get(vb_name + '_Ctrl')
+    body.attrs['translate'][0] += 50.0
+    radius = avr.wheel_radius('Wheel_FL', '', '_Jnt')
+    spin = evaluate(scene, 'Wheel_FL_Ctrl_Spin.rotateZ')
+    assert evaluate(scene, body.name + '.travel') == pytest.approx(50.0)
+    assert spin == pytest.approx(-math.degrees(50.0 / radius))
+
+    body.attrs['rotate'][1] = 90.0
+    assert evaluate(scene, 'Wheel_FL_Ctrl_Spin.rotateZ') == pytest.approx(spin)
+
+    body.attrs['autoSpin'] = 0
+    assert evaluate(scene, 'Wheel_FL_Ctrl_Spin.rotateZ') == 0.0
+
+
+def test_path_drive(scene, measure):
+    # Constant speed from the arc-length table, and only the changed path is rebuilt
+    vb_name, axles, parts = rig(measure, 4)
+    road = scene.create('transform', 'Road')
+    scene.create('nurbsCurve', 'RoadShape', road).attrs['cvs'] = [(0.0, 0.0, 0.0), (300.0, 0.0, 0.0),
+                                                                   (300.0, 0.0, 400.0)]
+
+    group, calls = measure('create_path_drive', avr_path.create_path_drive, vb_name, axles, 'Road')
+    assert calls <= budget('create_path_drive')
+    assert group == vb_name + '_Ctrl_Path'
+    assert scene.get(vb_name + '_Ctrl').parent.name == group
+
+    table = avr_path.arc_length_table('Road')
+    assert table[0] == (0.0, 0.0) and table[-1] == (700.0, 2.0)
+    assert (300.0, 1.0) in table
+    assert all(low[0] < high[0] for low, high in zip(table, table[1:]))
+
+    lookup = vb_name + '_Path_LUT'
+    assert scene.get(lookup).attrs['keys'] == table
+    keys = scene.get('Road_ArcLength_LUT')
+    assert keys.attrs['keys'] == table
+    scene.undo_queue[-1].undoIt()
+    assert keys.attrs['keys'] == []
+    scene.undo_queue[-1].redoIt()
+    assert keys.attrs['keys'] == table
+    assert scene.connections[lookup + '.input'] == group + '.distance'
+    assert scene.connections[vb_name + '_Path_POCI.parameter'] == lookup + '.output'
+    assert scene.connections[group + '.translate'] == vb_name + '_Path_PMA.output3D'
+    heading = vb_name + '_Heading_AM'
+    assert scene.connections[group + '.rotate'] == vb_name + '_Heading_DM.outputRotate'
+    assert scene.connections[vb_name + '_Heading_DM.inputMatrix'] == heading + '.outputMatrix'
+    assert scene.connections[heading + '.primaryTargetVectorX'] == vb_name + '_Path_POCI.tangentX'
+    assert cmds.getAttr(heading + '.primaryMode') == cmds.getAttr(heading + '.secondaryMode') == 2
+    assert scene.connections[vb_name + '_Ctrl.travel'] == vb_name + '_PathTravel_ADL.output'
+    assert not [node for node in scene.nodes.values() if node.type == 'expression']
+
+    updated, calls = measure('update_paths', avr_path.update_paths)
+    assert updated == [] and calls <= budget('update_paths')
+
+    # Other pointOnCurveInfo nodes on the path are left alone
+    markers = [cmds.createNode('pointOnCurveInfo', n='Marker{}_POCI'.format(index)) for index in range(2)]
+    for marker in markers:
+        cmds.connectAttr('RoadShape.worldSpace[0]', marker + '.inputCurve')
+    driven = cmds.createNode('animCurveUU', n='Marker_Driven')
+    cmds.connectAttr(driven + '.output', markers[1] + '.parameter')
+
+    scene.get('RoadShape').attrs['cvs'][2] = (300.0, 0.0, 100.0)
+    assert avr_path.update_paths() == ['Road_ArcLength_LUT']
+    assert scene.connections[markers[1] + '.parameter'] == driven + '.output'
+    assert scene.get(lookup).attrs['keys'][-1] == (400.0, 2.0)
+    assert scene.connections[lookup + '.input'] == group + '.distance'
+    assert scene.connections[vb_name + '_Path_POCI.parameter'] == lookup + '.output'
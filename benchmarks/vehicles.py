@@ -0,0 +1,62 @@
+# -*- coding: UTF-8 -*-
+# Synthetic vehicle scenes for the benchmarks, built straight into the stand-in scene.
+# A vehicle looks like a typical import: every part's meshes sit a few groups deep under one import group,
+# so grouping them leaves empty groups behind for the clean-up to find.
+from maya._scene import SCENE
+
+import AutoVehicleRig.AVR_Base as avr
+
+
+# Part names per wheel count, the same as the UI tabs
+PARTS = {2: [['Wheel_F'], ['Wheel_B']],
+         4: [['Wheel_FL', 'Wheel_FR'], ['Wheel_BL', 'Wheel_BR']],
+         6: [['Wheel_FL', 'Wheel_FR'], ['Wheel_ML', 'Wheel_MR'], ['Wheel_BL', 'Wheel_BR']]}
+
+WHEEL_RADIUS = 35.0
+WHEEL_WIDTH = 20.0
+
+
+def _mesh(name, parent, box):
+    transform = SCENE.create('transform', name, parent)
+    shape = SCENE.create('mesh', name + 'Shape', transform)
+    shape.attrs['bbox'] = box
+    return transform.name
+
+
+def build_vehicle(wheels=4, meshes=None, name='Vehicle'):
+    # Returns (body name, wheel names per axle, {part name: [mesh transforms]})
+    axles = PARTS[wheels]
+    names = [wheel for axle in axles for wheel in axle]
+    meshes = max(meshes or 3 * (wheels + 1), wheels + 1)
+
+    # Wheels get a tenth of the meshes between them, at least one each, the body gets the rest
+    per_wheel = max(1, meshes // (10 * wheels))
+    body_meshes = meshes - per_wheel * wheels
+
+    root = SCENE.create('transform', name + '_Import')
+    body = SCENE.create('transform', name + '_Body_Grp', SCENE.create('transform', name + '_Chassis_Grp', root))
+    parts = {'VehicleBody': []}
+    for index in range(body_meshes):
+        x = -250.0 + 500.0 * index / max(body_meshes - 1, 1)
+        parts['VehicleBody'].append(_mesh('{}_body_geo_{}'.format(name, index), body,
+                                          ((x - 20.0, 30.0, -120.0), (x + 20.0, 150.0, 120.0))))
+
+    wheel_root = SCENE.create('transform', name + '_Wheels_Grp', root)
+    for x, axle in zip(avr.axle_positions(len(axles)), axles):
+        for z, wheel in zip(avr.side_offsets(len(axle)), axle):
+            grp = SCENE.create('transform', '{}_{}_Grp'.format(name, wheel), wheel_root)
+            box = ((x - WHEEL_RADIUS, 0.0, z - WHEEL_WIDTH / 2), (x + WHEEL_RADIUS, 2 * WHEEL_RADIUS, z + WHEEL_WIDTH / 2))
+            parts[wheel] = [_mesh('{}_{}_geo_{}'.format(name, wheel, index), grp, box) for index in range(per_wheel)]
+
+    return 'VehicleBody', axles, parts
+
+
+def add_clutter(count, per_group=100):
+    # Unrelated set dressing: 'count' transforms, meshes in groups of 'per_group'
+    created = 0
+    while created < count:
+        grp = SCENE.create('transform', 'Set_Grp_{}'.format(created // per_group))
+        created += 1
+        for _ in range(min(per_group - 1, count - created)):
+            _mesh('set_item_{}'.format(created), grp, ((0.0, 0.0, 0.0), (1.0, 1.0, 1.0)))
+            created += 1
@@ -1,11 +1,294 @@
+import AutoVehicleRig.AVR_Profile as avr_profile
+import AutoVehicleRig.AVR_Shapes as avr_shapes
+import AutoVehicleRig.AVR_Undo as avr_undo
 import maya.cmds as cmds
 import maya.OpenMaya as om
+import contextlib
+import functools
+import json
+import math
 import os
 import re
+import time
 
+try:
+    import numpy
+except ImportError:  # numpy ships with mayapy from Maya 2022, older versions need it installed
+    numpy = None
 
-def rename_group_model_world(vehicle_part_name):
-    mesh = cmds.ls(sl=1)
+
+# Plug-ins live next to this module, wherever the package is installed
+AVR_DIR = os.path.dirname(os.path.abspath(__file__))
+UNDO_PLUGIN = os.path.join(AVR_DIR, 'AVR_Undo.py')
+
+# Default joint layout: axles 150 units apart, wheels 150 units left and right of the center line
+AXLE_SPACING = 150
+HALF_TRACK = 150
+
+# Joints are rotated -90 degrees around X, so their Y axis runs along the axle
+JOINT_ORIENT = om.MEulerRotation(math.radians(-90), 0, 0)
+
+BIND_MODES = ('skin', 'rigid')
+CONSTRAINT_MODES = ('constraint', 'matrix')
+
+# Meshes bound per chunk when bind_skin runs in chunks from the UI
+CHUNK_SIZE = 25
+
+# Part group attribute mapping its combined meshes to their pieces, {mesh: [[piece, first face, end face]]}
+PIECES_ATTR = 'avrPieces'
+
+# Controller shapes from the shape library (see AVR_Shapes), sized to the body footprint and the wheels
+BODY_SHAPE = 'body'
+WHEEL_SHAPE = 'wheel'
+
+
+# Nesting depth of fast_execution and the selection to apply when the outermost block exits
+_EXECUTION = {'depth': 0, 'selection': None}
+
+
+@contextlib.contextmanager
+def fast_execution(name='AVR', undo=True):
+    # One undo chunk (or no undo at all for batch runs), no viewport refresh and a single selection
+    # change for everything inside. Nested blocks join the outermost one. The chunk is closed and the
+    # viewport resumed however the block exits.
+    if _EXECUTION['depth']:
+        _EXECUTION['depth'] += 1
+        try:
+            yield
+        finally:
+            _EXECUTION['depth'] -= 1
+        return
+
+    undo_state = cmds.undoInfo(q=True, state=True)
+    if undo:
+        cmds.undoInfo(openChunk=True, chunkName=name)
+    elif undo_state:
+        cmds.undoInfo(stateWithoutFlush=False)
+
+    interactive = not cmds.about(batch=True)
+    if interactive:
+        cmds.refresh(suspend=True)
+
+    _EXECUTION.update(depth=1, selection=None)
+    try:
+        yield
+    finally:
+        selection = _EXECUTION['selection']
+        _EXECUTION.update(depth=0, selection=None)
+        try:
+            if selection:
+                cmds.select(cmds.ls(selection), replace=True)
+            elif selection is not None:
+                cmds.select(clear=True)
+        finally:
+            if interactive:
+                cmds.refresh(suspend=False)
+            if undo:
+                cmds.undoInfo(closeChunk=True)
+            elif undo_state:
+                cmds.undoInfo(stateWithoutFlush=True)
+
+
+def fast_step(func):
+    # Run a rig step inside fast_execution, named after the step in the undo history and the profile
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with avr_profile.section(func.__name__), fast_execution(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class ChunkedRun(object):
+    # Runs a rig step that yields (done, total) after every chunk, one chunk per call to step(), so the UI
+    # can stay responsive in between. The whole run is one fast_execution block and one undo chunk, kept
+    # open across the calls, and cancel() (or an error in a chunk) undoes all of it.
+
+    def __init__(self, name, chunks):
+        self.name = name
+        self.chunks = chunks
+        self.progress = (0, 0)
+        self.started = None
+        self._block = None
+
+    def step(self):
+        # Run the next chunk, False once the step is finished
+        if self._block is None:
+            self.started = time.time()
+            self._block = fast_execution(self.name)
+            self._block.__enter__()
+            # Something to undo even if the first chunk fails, so cancel() never undoes an earlier step
+            select_after(cmds.ls(sl=1))
+
+        try:
+            with avr_profile.section(self.name):
+                self.progress = next(self.chunks)
+            return True
+        except StopIteration:
+            self._close()
+            return False
+        except Exception:
+            self.cancel()
+            raise
+
+    def eta(self):
+        # Seconds left, extrapolated from the chunks so far
+        done, total = self.progress
+        if not done or self.started is None:
+            return None
+        return (time.time() - self.started) * (total - done) / done
+
+    def cancel(self):
+        if self._close():
+            cmds.undo()
+
+    def _close(self):
+        block, self._block = self._block, None
+        if block is None:
+            return False
+        self.chunks.close()
+        block.__exit__(None, None, None)
+        return True
+
+
+def select_after(nodes):
+    # Select nodes once the current fast_execution block is done, right away outside of one.
+    # Deferred nodes are kept by UUID, so they resolve the same outside of vehicle_namespace().
+    if _EXECUTION['depth']:
+        _EXECUTION['selection'] = cmds.ls(nodes, uuid=True) if nodes else []
+        return
+
+    nodes = cmds.ls(nodes) if nodes else []
+    if nodes:
+        cmds.select(nodes, replace=True)
+    else:
+        cmds.select(clear=True)
+
+
+@contextlib.contextmanager
+def vehicle_namespace(namespace):
+    # Scope every rig step inside the block to one vehicle: new nodes go into the namespace (created if
+    # needed) and names are looked up relative to it, so 'VehicleBody' means 'Car01:VehicleBody' and
+    # several vehicles with the same part names live side by side. ':' is the root namespace.
+    if not namespace:
+        yield
+        return
+
+    current = cmds.namespaceInfo(cur=True, an=True)
+    relative = cmds.namespace(q=True, rel=True)
+    namespace = ':' + namespace.strip(':')
+    if namespace != ':' and not cmds.namespace(exists=namespace):
+        cmds.namespace(add=namespace[1:], parent=':')
+
+    cmds.namespace(set=namespace)
+    cmds.namespace(rel=True)
+    try:
+        yield
+    finally:
+        cmds.namespace(rel=relative)
+        cmds.namespace(set=current)
+
+
+def ancestor_paths(nodes):
+    # Long names already encode the whole parent chain, so no extra queries are needed
+    ancestors = set()
+    for node in cmds.ls(nodes, long=True):
+        path = node.rsplit('|', 1)[0]
+        while path:
+            ancestors.add(path)
+            path = path.rsplit('|', 1)[0]
+    return ancestors
+
+
+def delete_empty_groups(candidates):
+    # Delete every candidate left without children, deepest first, so that parents emptied by the
+    # deletion of their last child group are removed too. Costs one query and one delete.
+    candidates = cmds.ls(list(candidates), long=True, et='transform') if candidates else []
+    if not candidates:
+        return []
+
+    children = {}
+    for child in cmds.listRelatives(candidates, c=1, f=1) or []:
+        children.setdefault(child.rsplit('|', 1)[0], []).append(child)
+
+    empty = set()
+    for grp in sorted(candidates, key=lambda path: path.count('|'), reverse=True):
+        if all(child in empty for child in children.get(grp, [])):
+            empty.add(grp)
+
+    # Only delete the topmost empty groups, their empty descendants go with them
+    removed = [grp for grp in empty if grp.rsplit('|', 1)[0] not in empty]
+    if removed:
+        cmds.delete(removed)
+    return sorted(empty)
+
+
+def _combine_meshes(group):
+    # One mesh per material in the group, or per set of materials for meshes with per-face assignments.
+    # polyUnite keeps the UVs and the face assignments, and every piece's face range is recorded on the
+    # group for restore_meshes(). Returns the combined meshes and the pieces, whose transforms may be left
+    # behind empty.
+    shapes = cmds.ls(group, dag=1, et='mesh', ni=1, l=1)
+    if len(shapes) < 2:
+        return [], []
+
+    # All the assignments in one query, matched back to the long shape names by their short names
+    connected = cmds.listConnections([shape + '.instObjGroups' for shape in shapes], s=0, d=1, c=1,
+                                     type='shadingEngine') or []
+    engines, leaves = {}, {}
+    for shape in shapes:
+        engines[shape] = set()
+        leaves.setdefault(shape.rsplit('|', 1)[-1], []).append(shape)
+    for plug, engine in zip(connected[::2], connected[1::2]):
+        node = plug.split('.', 1)[0]
+        shape = [shape for shape in leaves[node.rsplit('|', 1)[-1]]
+                 if shape == node or shape.endswith('|' + node.lstrip('|'))][0]
+        engines[shape].add(engine)
+
+    by_material = {}
+    for shape in shapes:
+        by_material.setdefault(tuple(sorted(engines[shape])), []).append(shape.rsplit('|', 1)[0])
+
+    pieces = {}
+    for materials in sorted(by_material):
+        items = by_material[materials]
+        if len(items) < 2:
+            continue
+
+        ranges, start = [], 0
+        for item in items:
+            count = cmds.polyEvaluate(item, f=True)
+            ranges.append([item.rsplit('|', 1)[-1], start, start + count])
+            start += count
+        mesh = cmds.polyUnite(items, n='{}_Combined{}'.format(group, len(pieces)), ch=0, muv=1)[0]
+        # Only the shapes go, a piece may still hold other meshes
+        leftovers = cmds.ls(items)
+        leftover_shapes = cmds.listRelatives(leftovers, s=1, f=1) if leftovers else None
+        if leftover_shapes:
+            cmds.delete(leftover_shapes)
+        mesh = cmds.parent(mesh, group)[0]
+        pieces[mesh] = ranges
+
+    if pieces:
+        if not cmds.attributeQuery(PIECES_ATTR, node=group, exists=True):
+            cmds.addAttr(group, ln=PIECES_ATTR, dt='string')
+        cmds.setAttr(group + '.' + PIECES_ATTR, json.dumps(pieces), type='string')
+    return sorted(pieces), [item for items in by_material.values() if len(items) > 1 for item in items]
+
+
+def part_pieces(vehicle_part_name):
+    # The meshes a part group was made of: its children, with combined meshes standing for their pieces
+    children = cmds.listRelatives(vehicle_part_name, c=1, type='transform') or []
+    if not cmds.attributeQuery(PIECES_ATTR, node=vehicle_part_name, exists=True):
+        return children
+
+    combined = json.loads(cmds.getAttr(vehicle_part_name + '.' + PIECES_ATTR) or '{}')
+    return [piece for child in children
+            for piece in ([entry[0] for entry in combined[child]] if child in combined else [child])]
+
+
+def _group_and_clean(vehicle_part_name, scoped=True, objects=None, combine=False):
+    # objects defaults to the selection, batch code passes them directly to leave the selection alone
+    mesh = cmds.ls(objects) if objects is not None else cmds.ls(sl=1)
 
     if not mesh:
         om.MGlobal.displayWarning('Please select at least one object!')
@@ -21,176 +304,242 @@ def rename_group_model_world(vehicle_part_name):
         om.MGlobal.displayWarning("Please enter a valid name starting with 'a-z', 'A-Z', or'_'")
         return
 
-    cmds.group(mesh, n=vehicle_part_name)
+    # Only the old parents of the selection can become empty by grouping it
+    candidates = ancestor_paths(mesh) if scoped else cmds.ls(et='transform', long=True)
 
-    for item in mesh:
-        cmds.delete(item, ch=1)
-        cmds.makeIdentity(item, a=1, n=0, pn=1)
+    group = cmds.group(mesh, n=vehicle_part_name)
+    items = cmds.listRelatives(group, c=1, f=1)
 
-    trans = cmds.ls(et='transform')
+    with avr_profile.section('delete_history'):
+        cmds.delete(items, ch=1)
+    with avr_profile.section('freeze_transforms'):
+        cmds.makeIdentity(items, a=1, n=0, pn=1)
 
-    for emptyGrp in trans:
-        if not cmds.listRelatives(emptyGrp, c=1):
-            cmds.delete(emptyGrp)
+    combined = []
+    if combine:
+        with avr_profile.section('combine_meshes'):
+            combined, pieces = _combine_meshes(group)
+        candidates = set(candidates) | set(pieces)
 
-    cmds.move(0, 0, 0, '{}.rotatePivot'.format(vehicle_part_name), '{}.scalePivot'.format(vehicle_part_name), rpr=True)
-    cmds.makeIdentity(vehicle_part_name, a=1, n=0, pn=1)
+    with avr_profile.section('delete_empty_groups'):
+        removed = delete_empty_groups(candidates)
+    if combined:
+        items = cmds.listRelatives(group, c=1, f=1)
 
+    # History deleted and transforms frozen on every item, empty groups removed, meshes combined per material
+    return {'group': group, 'items': items, 'removed_groups': removed, 'combined': combined}
 
-def rename_group_model_object(vehicle_part_name):
-    mesh = cmds.ls(sl=1)
 
-    if not mesh:
-        om.MGlobal.displayWarning('Please select at least one object!')
+@fast_step
+def rename_group_model_world(vehicle_part_name, scoped=True, objects=None, combine=False):
+    report = _group_and_clean(vehicle_part_name, scoped, objects, combine)
+    if not report:
         return
 
-    if vehicle_part_name in mesh:
-        om.MGlobal.displayWarning("Please rename '{}' to avoid conflict".format(vehicle_part_name))
+    cmds.move(0, 0, 0, '{}.rotatePivot'.format(vehicle_part_name), '{}.scalePivot'.format(vehicle_part_name), rpr=True)
+    cmds.makeIdentity(vehicle_part_name, a=1, n=0, pn=1)
+
+    return report
+
+
+@fast_step
+def rename_group_model_object(vehicle_part_name, scoped=True, objects=None, combine=False):
+    report = _group_and_clean(vehicle_part_name, scoped, objects, combine)
+    if not report:
         return
 
-    rule = re.compile(r'^[a-zA-Z_].*$')
+    cmds.makeIdentity(vehicle_part_name, a=1, n=0, pn=1)
 
-    if not rule.match(vehicle_part_name):
-        om.MGlobal.displayWarning("Please enter a valid name starting with 'a-z', 'A-Z', or'_'")
+    return report
+
+
+@fast_step
+def restore_meshes(vehicle_part_name):
+    # Split the combined meshes of a part group back into the pieces they were made of, each piece a copy
+    # of its combined mesh with the faces of the other pieces deleted. Returns the restored pieces.
+    if not cmds.attributeQuery(PIECES_ATTR, node=vehicle_part_name, exists=True):
+        return []
+
+    combined = json.loads(cmds.getAttr(vehicle_part_name + '.' + PIECES_ATTR) or '{}')
+    meshes = cmds.ls(list(combined))
+    skinned = cmds.ls(meshes, dag=1, et='mesh', io=1)
+    if skinned:
+        raise ValueError("Please unbind '{}' before restoring its pieces".format(vehicle_part_name))
+
+    restored, faces = [], []
+    for mesh in meshes:
+        total = cmds.polyEvaluate(mesh, f=True)
+        for name, start, end in combined[mesh]:
+            piece = cmds.duplicate(mesh, n=name)[0]
+            faces += (['{}.f[0:{}]'.format(piece, start - 1)] if start else []) + \
+                     (['{}.f[{}:{}]'.format(piece, end, total - 1)] if end < total else [])
+            restored.append(piece)
+
+    # The faces of the other pieces, all in one go
+    if faces:
+        cmds.delete(faces)
+    if meshes:
+        cmds.delete(meshes)
+    if restored:
+        cmds.delete(restored, ch=1)
+    cmds.deleteAttr(vehicle_part_name, at=PIECES_ATTR)
+    select_after(restored)
+    return restored
+
+
+def commit_modifier(modifier):
+    modifier.doIt()
+
+    # Hand the modifier over to Maya's undo queue, if the helper plug-in can be loaded
+    try:
+        if not cmds.pluginInfo(UNDO_PLUGIN, q=True, loaded=True):
+            cmds.loadPlugin(UNDO_PLUGIN, quiet=True)
+    except RuntimeError:
         return
 
-    cmds.group(mesh, n=vehicle_part_name)
+    avr_undo.PENDING.append(modifier)
+    getattr(cmds, avr_undo.COMMAND_NAME)()
 
-    for item in mesh:
-        cmds.delete(item, ch=1)
-        cmds.makeIdentity(item, a=1, n=0, pn=1)
 
-    trans = cmds.ls(et='transform')
+def wheel_names(axles):
+    return [name for axle in axles for name in axle]
 
-    for emptyGrp in trans:
-        if not cmds.listRelatives(emptyGrp, c=1):
-            cmds.delete(emptyGrp)
 
-    cmds.makeIdentity(vehicle_part_name, a=1, n=0, pn=1)
+def top_under(node, ancestor):
+    # The parent of node, or its parent's parent and so on, that sits directly under ancestor
+    top = node
+    while True:
+        parent = cmds.listRelatives(top, p=1)
+        if not parent:
+            raise ValueError("'{}' is not under '{}'".format(node, ancestor))
+        if parent[0] == ancestor:
+            return top
+        top = parent[0]
 
 
-def create_joints_2w(vb_name, wf_name, wb_name, prefix='', suffix='_Jnt'):
-    cmds.select(clear=True)
+def axle_positions(count, spacing=AXLE_SPACING):
+    # Front axle ahead of the origin, the others behind it (150, -150, -300, ...)
+    return [spacing] + [-spacing * i for i in range(1, count)]
 
-    jnt_vb = cmds.joint(p=(0, 0, 0))
-    cmds.rename(jnt_vb, '{}{}{}'.format(prefix, vb_name, suffix))
-    cmds.select(clear=True)
 
-    jnt_wf = cmds.joint(p=(150, 0, 0))
-    cmds.rename(jnt_wf, '{}{}{}'.format(prefix, wf_name, suffix))
-    cmds.select(clear=True)
+def side_offsets(count, half_track=HALF_TRACK):
+    # Left to right along Z, a single wheel stays on the center line
+    if count == 1:
+        return [0.0]
+    return [-half_track + 2.0 * half_track * i / (count - 1) for i in range(count)]
 
-    jnt_wb = cmds.joint(p=(-150, 0, 0))
-    cmds.rename(jnt_wb, '{}{}{}'.format(prefix, wb_name, suffix))
-    cmds.select(clear=True)
 
-    joint = ['{}{}{}'.format(prefix, vb_name, suffix),
-             '{}{}{}'.format(prefix, wf_name, suffix),
-             '{}{}{}'.format(prefix, wb_name, suffix)]
+def _world_matrix(position, rotation=JOINT_ORIENT):
+    matrix = om.MTransformationMatrix(rotation.asMatrix())
+    matrix.setTranslation(om.MVector(*position), om.MSpace.kTransform)
+    return matrix.asMatrix()
 
-    for jnt in joint:
-        cmds.joint(jnt, e=1, orientJoint='none', zeroScaleOrient=True)
-        cmds.rotate(-90, 0, 0, jnt, forceOrderXYZ=True, relative=True, objectSpace=True)
-        cmds.makeIdentity(jnt, apply=True, t=True, r=True, s=True, n=True, pn=True)
 
-    for jnt in joint[1:]:
-        cmds.parent(jnt, '{}{}{}'.format(prefix, vb_name, suffix))
+def default_placements(vb_name, axles):
+    placements = {vb_name: _world_matrix((0, 0, 0))}
 
-    cmds.select(clear=True)
+    for x, axle in zip(axle_positions(len(axles)), axles):
+        for z, name in zip(side_offsets(len(axle)), axle):
+            placements[name] = _world_matrix((x, 0, z))
 
+    return placements
 
-def create_joints_4w(vb_name, wfl_name, wfr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt'):
-    cmds.select(clear=True)
 
-    jnt_vb = cmds.joint(p=(0, 0, 0))
-    cmds.rename(jnt_vb, '{}{}{}'.format(prefix, vb_name, suffix))
-    cmds.select(clear=True)
+def _set_joint_matrix(modifier, node, matrix):
+    # Translation goes to translate and rotation to jointOrient, leaving rotate at zero just like
+    # 'makeIdentity -apply' does on a freshly created joint
+    matrix = om.MTransformationMatrix(matrix)
+    translation = matrix.getTranslation(om.MSpace.kTransform)
+    rotation = matrix.eulerRotation()
 
-    jnt_wfl = cmds.joint(p=(150, 0, -150))
-    cmds.rename(jnt_wfl, '{}{}{}'.format(prefix, wfl_name, suffix))
-    cmds.select(clear=True)
+    fn = om.MFnDependencyNode(node)
+    for axis, value in zip('XYZ', (translation.x, translation.y, translation.z)):
+        modifier.newPlugValueDouble(fn.findPlug('translate' + axis), value)
+    for axis, value in zip('XYZ', (rotation.x, rotation.y, rotation.z)):
+        modifier.newPlugValueDouble(fn.findPlug('jointOrient' + axis), value)
+        modifier.newPlugValueDouble(fn.findPlug('rotate' + axis), 0.0)
 
-    jnt_wfr = cmds.joint(p=(150, 0, 150))
-    cmds.rename(jnt_wfr, '{}{}{}'.format(prefix, wfr_name, suffix))
-    cmds.select(clear=True)
 
-    jnt_wbl = cmds.joint(p=(-150, 0, -150))
-    cmds.rename(jnt_wbl, '{}{}{}'.format(prefix, wbl_name, suffix))
-    cmds.select(clear=True)
+def _local_matrices(vb_name, wheels, placements):
+    # Wheel joints live under the body joint: local = world * bodyWorld^-1
+    body_matrix = placements[vb_name]
+    body_inverse = body_matrix.inverse()
+    return [body_matrix] + [placements[name] * body_inverse for name in wheels]
 
-    jnt_wbr = cmds.joint(p=(-150, 0, 150))
-    cmds.rename(jnt_wbr, '{}{}{}'.format(prefix, wbr_name, suffix))
-    cmds.select(clear=True)
 
-    joint = ['{}{}{}'.format(prefix, vb_name, suffix),
-             '{}{}{}'.format(prefix, wfl_name, suffix),
-             '{}{}{}'.format(prefix, wfr_name, suffix),
-             '{}{}{}'.format(prefix, wbl_name, suffix),
-             '{}{}{}'.format(prefix, wbr_name, suffix)]
+@fast_step
+def create_joints(vb_name, axles, prefix='', suffix='_Jnt', placements=None):
+    # axles: wheel part names per axle, front to back and left to right, e.g.
+    # [['Wheel_FL', 'Wheel_FR'], ['Wheel_BL', 'Wheel_BR']]. Any number of axles and wheels works.
+    # placements: optional {part name: world MMatrix}, defaults to the fixed layout above.
+    placements = placements or default_placements(vb_name, axles)
+    wheels = wheel_names(axles)
 
-    for jnt in joint:
-        cmds.joint(jnt, e=1, orientJoint='none', zeroScaleOrient=True)
-        cmds.rotate(-90, 0, 0, jnt, forceOrderXYZ=True, relative=True, objectSpace=True)
-        cmds.makeIdentity(jnt, apply=True, t=True, r=True, s=True, n=True, pn=True)
+    # Every matrix is computed before touching the scene
+    local_matrices = _local_matrices(vb_name, wheels, placements)
 
-    for jnt in joint[1:]:
-        cmds.parent(jnt, '{}{}{}'.format(prefix, vb_name, suffix))
+    # Create, name and parent every joint in one modifier, then set their transforms
+    modifier = om.MDagModifier()
+    body = modifier.createNode('joint')
+    modifier.renameNode(body, '{}{}{}'.format(prefix, vb_name, suffix))
+    nodes = [body]
+    for name in wheels:
+        jnt = modifier.createNode('joint', body)
+        modifier.renameNode(jnt, '{}{}{}'.format(prefix, name, suffix))
+        nodes.append(jnt)
+    modifier.doIt()
 
-    cmds.select(clear=True)
+    for node, matrix in zip(nodes, local_matrices):
+        _set_joint_matrix(modifier, node, matrix)
+    # Wheel joints compensate the body joint's scale, like joints parented with 'parent' or 'joint'
+    body_scale = om.MFnDependencyNode(body).findPlug('scale')
+    for node in nodes[1:]:
+        modifier.connect(body_scale, om.MFnDependencyNode(node).findPlug('inverseScale'))
+    commit_modifier(modifier)
 
+    return ['{}{}{}'.format(prefix, name, suffix) for name in [vb_name] + wheels]
 
-def create_joints_6w(vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt'):
-    cmds.select(clear=True)
 
-    jnt_vb = cmds.joint(p=(0, 0, 0))
-    cmds.rename(jnt_vb, '{}{}{}'.format(prefix, vb_name, suffix))
-    cmds.select(clear=True)
+@fast_step
+def place_joints(vb_name, axles, prefix='', suffix='_Jnt', placements=None):
+    # Move existing joints onto new world matrices in one modifier, or create them if needed
+    if not cmds.objExists(prefix + vb_name + suffix):
+        return create_joints(vb_name, axles, prefix, suffix, placements)
 
-    jnt_wfl = cmds.joint(p=(150, 0, -150))
-    cmds.rename(jnt_wfl, '{}{}{}'.format(prefix, wfl_name, suffix))
-    cmds.select(clear=True)
+    placements = placements or default_placements(vb_name, axles)
+    wheels = wheel_names(axles)
+    local_matrices = _local_matrices(vb_name, wheels, placements)
 
-    jnt_wfr = cmds.joint(p=(150, 0, 150))
-    cmds.rename(jnt_wfr, '{}{}{}'.format(prefix, wfr_name, suffix))
-    cmds.select(clear=True)
+    selection = om.MSelectionList()
+    for name in [vb_name] + wheels:
+        selection.add(prefix + name + suffix)
 
-    jnt_wml = cmds.joint(p=(-150, 0, -150))
-    cmds.rename(jnt_wml, '{}{}{}'.format(prefix, wml_name, suffix))
-    cmds.select(clear=True)
+    modifier = om.MDGModifier()
+    for index, matrix in enumerate(local_matrices):
+        node = om.MObject()
+        selection.getDependNode(index, node)
+        _set_joint_matrix(modifier, node, matrix)
+    commit_modifier(modifier)
 
-    jnt_wmr = cmds.joint(p=(-150, 0, 150))
-    cmds.rename(jnt_wmr, '{}{}{}'.format(prefix, wmr_name, suffix))
-    cmds.select(clear=True)
+    return [prefix + name + suffix for name in [vb_name] + wheels]
 
-    jnt_wbl = cmds.joint(p=(-300, 0, -150))
-    cmds.rename(jnt_wbl, '{}{}{}'.format(prefix, wbl_name, suffix))
-    cmds.select(clear=True)
 
-    jnt_wbr = cmds.joint(p=(-300, 0, 150))
-    cmds.rename(jnt_wbr, '{}{}{}'.format(prefix, wbr_name, suffix))
-    cmds.select(clear=True)
+def create_joints_2w(vb_name, wf_name, wb_name, prefix='', suffix='_Jnt'):
+    return create_joints(vb_name, [[wf_name], [wb_name]], prefix, suffix)
 
-    joint = ['{}{}{}'.format(prefix, vb_name, suffix),
-             '{}{}{}'.format(prefix, wfl_name, suffix),
-             '{}{}{}'.format(prefix, wfr_name, suffix),
-             '{}{}{}'.format(prefix, wml_name, suffix),
-             '{}{}{}'.format(prefix, wmr_name, suffix),
-             '{}{}{}'.format(prefix, wbl_name, suffix),
-             '{}{}{}'.format(prefix, wbr_name, suffix)]
 
-    for jnt in joint:
-        cmds.joint(jnt, e=1, orientJoint='none', zeroScaleOrient=True)
-        cmds.rotate(-90, 0, 0, jnt, forceOrderXYZ=True, relative=True, objectSpace=True)
-        cmds.makeIdentity(jnt, apply=True, t=True, r=True, s=True, n=True, pn=True)
+def create_joints_4w(vb_name, wfl_name, wfr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt'):
+    return create_joints(vb_name, [[wfl_name, wfr_name], [wbl_name, wbr_name]], prefix, suffix)
 
-    for jnt in joint[1:]:
-        cmds.parent(jnt, '{}{}{}'.format(prefix, vb_name, suffix))
 
-    cmds.select(clear=True)
+def create_joints_6w(vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt'):
+    return create_joints(vb_name, [[wfl_name, wfr_name], [wml_name, wmr_name], [wbl_name, wbr_name]], prefix, suffix)
 
 
-def snap_joint():
-    sel = cmds.ls(sl=1)
+@fast_step
+def snap_joint(objects=None):
+    # Move every object onto the pivot of the last one
+    sel = cmds.ls(objects) if objects is not None else cmds.ls(sl=1)
 
     if len(sel) < 2:
         om.MGlobal.displayWarning('Please select at least two objects!')
@@ -201,174 +550,286 @@ def snap_joint():
         cmds.move(base_pos[0], base_pos[1], base_pos[2], item)
 
 
-def bind_skin_2w(vb_name, wf_name, wb_name, prefix='', suffix='_Jnt'):
-    group = [vb_name, wf_name, wb_name]
+def require_numpy(feature):
+    # The vectorized steps (detection, joint fitting, terrain, caches) cannot run without numpy
+    if numpy is None:
+        raise ImportError('{} needs numpy in the Maya Python environment'.format(feature))
 
-    for grp in group:
-        mesh = cmds.ls(grp, dag=1, et='mesh')  # Select all meshes within the group
-        for obj in mesh:
-            cmds.skinCluster(prefix + grp + suffix, obj, tsb=1)
 
-    cmds.select(prefix + vb_name + suffix)
+def to_mmatrix(values):
+    matrix = om.MMatrix()
+    om.MScriptUtil.createMatrixFromList(values, matrix)
+    return matrix
 
 
-def bind_skin_4w(vb_name, wfl_name, wfr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt'):
-    group = [vb_name, wfl_name, wfr_name, wbl_name, wbr_name]
+def to_list(matrix):
+    return [matrix(row, col) for row in range(4) for col in range(4)]
 
-    for grp in group:
-        mesh = cmds.ls(grp, dag=1, et='mesh')  # Select all meshes within the group
-        for obj in mesh:
-            cmds.skinCluster(prefix + grp + suffix, obj, tsb=1)
-
-    cmds.select(prefix + vb_name + suffix)
 
+def attach_rigid(group, jnt, joint_world=None):
+    # Without offsetParentMatrix (before Maya 2020) plain parenting is the rigid attachment
+    if not cmds.attributeQuery('offsetParentMatrix', node=group, exists=True):
+        cmds.parent(group, jnt)
+        return
 
-def bind_skin_6w(vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt'):
-    group = [vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name]
+    # offsetParentMatrix = parentWorld * jointWorld^-1 (both at bind time) * jointWorld * parentInverse,
+    # so the group follows the joint exactly like a single-influence skin, without any deformer.
+    # joint_world overrides the bind time joint matrix, e.g. with the rest pose of an animated rig.
+    parent_world = to_mmatrix(cmds.getAttr(group + '.parentMatrix[0]'))
+    if joint_world is None:
+        joint_world = to_mmatrix(cmds.getAttr(jnt + '.worldMatrix[0]'))
+
+    mult = cmds.createNode('multMatrix', n=group + '_Rigid_MM')
+    cmds.setAttr(mult + '.matrixIn[0]', to_list(parent_world * joint_world.inverse()), type='matrix')
+    cmds.connectAttr(jnt + '.worldMatrix[0]', mult + '.matrixIn[1]')
+    cmds.connectAttr(group + '.parentInverseMatrix[0]', mult + '.matrixIn[2]')
+    cmds.connectAttr(mult + '.matrixSum', group + '.offsetParentMatrix')
+
+
+def bind_skin_chunks(vb_name, axles, prefix='', suffix='_Jnt', mode='skin', chunk_size=CHUNK_SIZE):
+    # bind_skin() as chunks of chunk_size meshes (part groups in rigid mode) for ChunkedRun, yielding
+    # (done, total) after each, None binds everything in one chunk. The mode is checked and the meshes are
+    # looked up right away, before the first chunk.
+    if mode not in BIND_MODES:
+        raise ValueError("Unknown bind mode '{}'".format(mode))
+
+    group = [vb_name] + wheel_names(axles)
+    if mode == 'rigid':
+        items = [(grp, None) for grp in group]
+    else:
+        # Select all meshes within each group
+        items = [(grp, obj) for grp in group for obj in cmds.ls(grp, dag=1, et='mesh')]
+    return _bind_items(items, prefix + vb_name + suffix, prefix, suffix, chunk_size)
+
+
+def _bind_items(items, root, prefix, suffix, chunk_size):
+    chunk_size = chunk_size or len(items) or 1
+    for start in range(0, len(items), chunk_size):
+        for grp, obj in items[start:start + chunk_size]:
+            if obj is None:
+                with avr_profile.section('rigid_attach'):
+                    attach_rigid(grp, prefix + grp + suffix)
+            else:
+                with avr_profile.section('skin_cluster'):
+                    cmds.skinCluster(prefix + grp + suffix, obj, tsb=1)
+        yield min(start + chunk_size, len(items)), len(items)
+
+    select_after(root)
+
+
+@fast_step
+def bind_skin(vb_name, axles, prefix='', suffix='_Jnt', mode='skin'):
+    # mode 'skin' : one single-influence skinCluster per mesh
+    # mode 'rigid': each part group follows its joint through a matrix connection, no deformers
+    for _ in bind_skin_chunks(vb_name, axles, prefix, suffix, mode, chunk_size=None):
+        pass
+
+
+def bind_skin_2w(vb_name, wf_name, wb_name, prefix='', suffix='_Jnt', mode='skin'):
+    bind_skin(vb_name, [[wf_name], [wb_name]], prefix, suffix, mode)
+
+
+def bind_skin_4w(vb_name, wfl_name, wfr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt', mode='skin'):
+    bind_skin(vb_name, [[wfl_name, wfr_name], [wbl_name, wbr_name]], prefix, suffix, mode)
+
+
+def bind_skin_6w(vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt', mode='skin'):
+    bind_skin(vb_name, [[wfl_name, wfr_name], [wml_name, wmr_name], [wbl_name, wbr_name]], prefix, suffix, mode)
+
+
+def _build_controllers(vb_name, wheels, prefix, suffix):
+    # The body controller covers the body's footprint, every wheel controller matches its wheel's radius
+    with avr_profile.section('build_shapes'):
+        bounds = cmds.exactWorldBoundingBox(vb_name)
+        length, width = (bounds[3] - bounds[0]) / 2.0, (bounds[5] - bounds[2]) / 2.0
+        body_ctrl = avr_shapes.create_shape(BODY_SHAPE, vb_name + '_Ctrl', (length, min(length, width), width))
+        wheel_ctrls = []
+        for name in wheels:
+            radius = wheel_radius(name, prefix, suffix)
+            wheel_ctrls.append(avr_shapes.create_shape(WHEEL_SHAPE, name + '_Ctrl', (radius, radius, radius)))
+    return body_ctrl, wheel_ctrls
+
+
+def _matrix_constrain(driver, driven, maintain_offset=True):
+    # Without offsetParentMatrix (before Maya 2020) fall back to regular constraints
+    if not cmds.attributeQuery('offsetParentMatrix', node=driven, exists=True):
+        cmds.pointConstraint(driver, driven, maintainOffset=maintain_offset)
+        cmds.orientConstraint(driver, driven, maintainOffset=maintain_offset)
+        return
 
-    for grp in group:
-        mesh = cmds.ls(grp, dag=1, et='mesh')  # Select all meshes within the group
-        for obj in mesh:
-            cmds.skinCluster(prefix + grp + suffix, obj, tsb=1)
+    # offsetParentMatrix = offset * driverWorld * parentInverse, with the local transform zeroed,
+    # where offset = drivenWorld * driverWorld^-1 keeps the current relative placement
+    offset = om.MMatrix()
+    if maintain_offset:
+        driven_world = to_mmatrix(cmds.getAttr(driven + '.worldMatrix[0]'))
+        driver_world = to_mmatrix(cmds.getAttr(driver + '.worldMatrix[0]'))
+        offset = driven_world * driver_world.inverse()
+
+    mult = cmds.createNode('multMatrix', n=driven + '_MM')
+    cmds.setAttr(mult + '.matrixIn[0]', to_list(offset), type='matrix')
+    cmds.connectAttr(driver + '.worldMatrix[0]', mult + '.matrixIn[1]')
+    cmds.connectAttr(driven + '.parentInverseMatrix[0]', mult + '.matrixIn[2]')
+
+    cmds.setAttr(driven + '.translate', 0, 0, 0)
+    cmds.setAttr(driven + '.rotate', 0, 0, 0)
+    if cmds.attributeQuery('jointOrient', node=driven, exists=True):
+        cmds.setAttr(driven + '.jointOrient', 0, 0, 0)
+    cmds.connectAttr(mult + '.matrixSum', driven + '.offsetParentMatrix')
+
+
+def constrain(driver, driven, mode='constraint'):
+    # mode 'constraint': pointConstraint + orientConstraint pair
+    # mode 'matrix'    : one multMatrix feeding offsetParentMatrix
+    if mode not in CONSTRAINT_MODES:
+        raise ValueError("Unknown constraint mode '{}'".format(mode))
+
+    if mode == 'matrix':
+        _matrix_constrain(driver, driven)
+    else:
+        cmds.pointConstraint(driver, driven, maintainOffset=True)
+        cmds.orientConstraint(driver, driven, maintainOffset=True)
+
+
+def insert_parent(node, name):
+    # Put a node under a new transform whose pivot sits on the node's pivot, keeping its world placement
+    parent = cmds.listRelatives(node, p=1)
+    grp = cmds.createNode('transform', n=name, **({'p': parent[0]} if parent else {}))
+    cmds.xform(grp, ws=1, piv=cmds.xform(node, q=1, ws=1, rp=1))
+    cmds.parent(node, grp)
+    return grp
+
+
+def wheel_radius(item, prefix='', suffix='_Jnt'):
+    # Prefer the radius measured on the joint, otherwise half the height of the wheel group
+    jnt = prefix + item + suffix
+    if cmds.objExists(jnt) and cmds.attributeQuery('wheelRadius', node=jnt, exists=True):
+        return cmds.getAttr(jnt + '.wheelRadius')
+    return (cmds.getAttr(item + '.boundingBoxMaxY') - cmds.getAttr(item + '.boundingBoxMinY')) / 2.0
+
+
+@fast_step
+def create_wheel_spin(vb_name, axles, prefix='', suffix='_Jnt'):
+    # Spin every wheel controller from the distance the body controller travelled along its forward
+    # axis, using utility nodes only so the rig stays parallel-evaluation and cache friendly
+    body_ctrl = vb_name + '_Ctrl'
+    if not cmds.attributeQuery('autoSpin', node=body_ctrl, exists=True):
+        cmds.addAttr(body_ctrl, ln='autoSpin', at='bool', dv=1, k=True)
+        cmds.addAttr(body_ctrl, ln='travel', at='double')
+        cmds.setAttr(body_ctrl + '.travel', cb=True)
+
+    # travel = translateX - restTranslateX, the vehicle faces +X of the controller's parent. Turning does
+    # not change it, so auto spin follows straight-line driving. Curves go through the path drive, which
+    # adds the distance along the path.
+    travel = cmds.createNode('addDoubleLinear', n=vb_name + '_Travel_ADL')
+    cmds.connectAttr(body_ctrl + '.translateX', travel + '.input1')
+    cmds.setAttr(travel + '.input2', -cmds.getAttr(body_ctrl + '.translateX'))
+    cmds.connectAttr(travel + '.output', body_ctrl + '.travel', f=True)
+
+    # rotateZ = -travel / radius, in degrees. Rolling forward along +X turns the wheel around -Z.
+    spin_groups = []
+    for item in wheel_names(axles):
+        ctrl = item + '_Ctrl'
+        spin = insert_parent(ctrl, ctrl + '_Spin')
+
+        angle = cmds.createNode('multDoubleLinear', n=item + '_Spin_MDL')
+        cmds.connectAttr(body_ctrl + '.travel', angle + '.input1')
+        cmds.setAttr(angle + '.input2', -180.0 / (math.pi * wheel_radius(item, prefix, suffix)))
+
+        switch = cmds.createNode('multDoubleLinear', n=item + '_AutoSpin_MDL')
+        cmds.connectAttr(angle + '.output', switch + '.input1')
+        cmds.connectAttr(body_ctrl + '.autoSpin', switch + '.input2')
+        cmds.connectAttr(switch + '.output', spin + '.rotateZ')
+        spin_groups.append(spin)
+
+    return spin_groups
+
+
+def create_controllers_chunks(vb_name, axles, prefix='', suffix='_Jnt', constraint='constraint', auto_spin=False):
+    # create_controllers() as chunks for ChunkedRun, yielding (done, total) after the controller shapes,
+    # the placement, the constraints and the wheel spin
+    wheels = wheel_names(axles)
+    body_ctrl, wheel_ctrls = _build_controllers(vb_name, wheels, prefix, suffix)
+    yield 1, 4
 
-    cmds.select(prefix + vb_name + suffix)
+    # Set controller colors
+    cmds.setAttr(body_ctrl + '.overrideEnabled', 1)
+    cmds.setAttr(body_ctrl + '.overrideColor', 9)  # Purple
+    base_pos = cmds.xform(prefix + vb_name + suffix, q=1, ws=1, piv=1)
+    if len(wheels) == 2:
+        # Two-wheelers keep the body controller on the ground
+        MinY = cmds.getAttr(wheels[0] + '.boundingBoxMinY')
+        cmds.move(base_pos[0], MinY, base_pos[2], body_ctrl)
+    else:
+        MaxY = cmds.getAttr(vb_name + '.boundingBoxMaxY')
+        cmds.move(base_pos[0], MaxY + 20, base_pos[2], body_ctrl)
+
+    # Move wheel controllers 30 units outwards from their wheels, left is -Z and right is +Z
+    sides = [side for axle in axles for side in side_offsets(len(axle), 30)]
+    for ctrl, item, side in zip(wheel_ctrls, wheels, sides):
+        cmds.setAttr(ctrl + '.overrideEnabled', 1)
+        cmds.setAttr(ctrl + '.overrideColor', 17)  # Yellow
 
+        base_pos = cmds.xform(item, q=1, ws=1, piv=1)
+        cmds.move(base_pos[0], base_pos[1], base_pos[2] + side, ctrl)
+    yield 2, 4
 
-def create_controllers_2w(vb_name, wf_name, wb_name, prefix='', suffix='_Jnt'):
-    USERSCRIPTDIR = cmds.internalVar(userScriptDir=True)
-    PATH = os.path.join(USERSCRIPTDIR, 'AutoVehicleRig')
-    cmds.file(PATH + '/BodyController.fbx', i=True, usingNamespaces=False)
-    cmds.file(PATH + '/WheelController_2w.fbx', i=True, usingNamespaces=False)
+    # Set up the constraints
+    with avr_profile.section('constraints'):
+        constrain(body_ctrl, prefix + vb_name + suffix, constraint)
+        for ctrl, item in zip(wheel_ctrls, wheels):
+            constrain(ctrl, prefix + item + suffix, constraint)
+    yield 3, 4
 
-    cmds.setAttr('VehicleBody_Ctrl.overrideEnabled', 1)
-    cmds.setAttr('VehicleBody_Ctrl.overrideColor', 9)  # Purple
-    base_pos = cmds.xform(prefix + vb_name + suffix, q=1, ws=1, piv=1)
-    MinY = cmds.getAttr(wf_name + '.boundingBoxMinY')
-    cmds.move(base_pos[0], MinY, base_pos[2], 'VehicleBody_Ctrl')
+    cmds.parent(wheel_ctrls, body_ctrl)
 
-    wheel_pos = ['F', 'B']
-    wheel_name = [wf_name, wb_name]
-    for pos, item in zip(wheel_pos, wheel_name):
-        cmds.setAttr('Wheel_{}_Ctrl.overrideEnabled'.format(pos), 1)
-        cmds.setAttr('Wheel_{}_Ctrl.overrideColor'.format(pos), 17)  # Yellow
+    if auto_spin:
+        create_wheel_spin(vb_name, axles, prefix, suffix)
 
-        base_pos = cmds.xform(item, q=1, ws=1, piv=1)
-        cmds.move(base_pos[0], base_pos[1], base_pos[2], 'Wheel_{}_Ctrl'.format(pos))
+    select_after([])
+    yield 4, 4
 
-    # Set up the constraints
-    cmds.pointConstraint('VehicleBody_Ctrl', prefix + vb_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('VehicleBody_Ctrl', prefix + vb_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_F_Ctrl', prefix + wf_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_F_Ctrl', prefix + wf_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_B_Ctrl', prefix + wb_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_B_Ctrl', prefix + wb_name + suffix, maintainOffset=True)
 
-    cmds.parent('Wheel_F_Ctrl', 'Wheel_B_Ctrl', 'VehicleBody_Ctrl')
+@fast_step
+def create_controllers(vb_name, axles, prefix='', suffix='_Jnt', constraint='constraint', auto_spin=False):
+    for _ in create_controllers_chunks(vb_name, axles, prefix, suffix, constraint, auto_spin):
+        pass
+    return vb_name + '_Ctrl', [name + '_Ctrl' for name in wheel_names(axles)]
 
-    cmds.rename('VehicleBody_Ctrl', vb_name + '_Ctrl')
-    cmds.rename('Wheel_F_Ctrl', wf_name + '_Ctrl')
-    cmds.rename('Wheel_B_Ctrl', wb_name + '_Ctrl')
 
-    cmds.select(clear=True)
+def create_controllers_2w(vb_name, wf_name, wb_name, prefix='', suffix='_Jnt', constraint='constraint',
+                          auto_spin=False):
+    return create_controllers(vb_name, [[wf_name], [wb_name]], prefix, suffix, constraint, auto_spin)
 
 
-def create_controllers_4w(vb_name, wfl_name, wfr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt'):
-    # Import controller files
-    USERSCRIPTDIR = cmds.internalVar(userScriptDir=True)
-    PATH = os.path.join(USERSCRIPTDIR, 'AutoVehicleRig')
-    cmds.file(PATH + '/BodyController.fbx', i=True, usingNamespaces=False)
-    cmds.file(PATH + '/WheelController_4w.fbx', i=True, usingNamespaces=False)
+def create_controllers_4w(vb_name, wfl_name, wfr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt',
+                          constraint='constraint', auto_spin=False):
+    return create_controllers(vb_name, [[wfl_name, wfr_name], [wbl_name, wbr_name]], prefix, suffix, constraint,
+                              auto_spin)
 
-    # Set controller colors
-    cmds.setAttr('VehicleBody_Ctrl.overrideEnabled', 1)
-    cmds.setAttr('VehicleBody_Ctrl.overrideColor', 9)  # Purple
-    base_pos = cmds.xform(prefix + vb_name + suffix, q=1, ws=1, piv=1)
-    MaxY = cmds.getAttr(vb_name + '.boundingBoxMaxY')
-    cmds.move(base_pos[0], MaxY+20, base_pos[2], 'VehicleBody_Ctrl')
 
-    wheel_pos = ['FL', 'FR', 'BL', 'BR']
-    wheel_name = [wfl_name, wfr_name, wbl_name, wbr_name]
-    for pos, item in zip(wheel_pos, wheel_name):
-        cmds.setAttr('Wheel_{}_Ctrl.overrideEnabled'.format(pos), 1)
-        cmds.setAttr('Wheel_{}_Ctrl.overrideColor'.format(pos), 17)  # Yellow
+def create_controllers_6w(vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt',
+                          constraint='constraint', auto_spin=False):
+    return create_controllers(vb_name, [[wfl_name, wfr_name], [wml_name, wmr_name], [wbl_name, wbr_name]],
+                              prefix, suffix, constraint, auto_spin)
 
-        base_pos = cmds.xform(item, q=1, ws=1, piv=1)
-        if pos == 'FL' or pos == 'BL':
-            cmds.move(base_pos[0], base_pos[1], base_pos[2]-30, 'Wheel_{}_Ctrl'.format(pos))
-        else:
-            cmds.move(base_pos[0], base_pos[1], base_pos[2]+30, 'Wheel_{}_Ctrl'.format(pos))
 
-    # Set up the constraints
-    cmds.pointConstraint('VehicleBody_Ctrl', prefix + vb_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('VehicleBody_Ctrl', prefix + vb_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_FL_Ctrl', prefix + wfl_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_FL_Ctrl', prefix + wfl_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_FR_Ctrl', prefix + wfr_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_FR_Ctrl', prefix + wfr_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_BL_Ctrl', prefix + wbl_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_BL_Ctrl', prefix + wbl_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_BR_Ctrl', prefix + wbr_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_BR_Ctrl', prefix + wbr_name + suffix, maintainOffset=True)
-
-    cmds.parent('Wheel_FL_Ctrl', 'Wheel_FR_Ctrl', 'Wheel_BL_Ctrl', 'Wheel_BR_Ctrl', 'VehicleBody_Ctrl')
-
-    cmds.rename('VehicleBody_Ctrl', vb_name + '_Ctrl')
-    cmds.rename('Wheel_FL_Ctrl', wfl_name + '_Ctrl')
-    cmds.rename('Wheel_FR_Ctrl', wfr_name + '_Ctrl')
-    cmds.rename('Wheel_BL_Ctrl', wbl_name + '_Ctrl')
-    cmds.rename('Wheel_BR_Ctrl', wbr_name + '_Ctrl')
-
-    cmds.select(clear=True)
-
-
-def create_controllers_6w(vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name, prefix='', suffix='_Jnt'):
-    USERSCRIPTDIR = cmds.internalVar(userScriptDir=True)
-    PATH = os.path.join(USERSCRIPTDIR, 'AutoVehicleRig')
-    cmds.file(PATH + '/BodyController.fbx', i=True, usingNamespaces=False)
-    cmds.file(PATH + '/WheelController_6w.fbx', i=True, usingNamespaces=False)
-
-    cmds.setAttr('VehicleBody_Ctrl.overrideEnabled', 1)
-    cmds.setAttr('VehicleBody_Ctrl.overrideColor', 9)  # Purple
-    base_pos = cmds.xform(prefix + vb_name + suffix, q=1, ws=1, piv=1)
-    MaxY = cmds.getAttr(vb_name + '.boundingBoxMaxY')
-    cmds.move(base_pos[0], MaxY + 20, base_pos[2], 'VehicleBody_Ctrl')
+@fast_step
+def convert_constraints(vb_name, axles, prefix='', suffix='_Jnt', maintain_offset=True):
+    # Replace the point/orient constraint pairs of an existing rig with matrix connections
+    converted = []
+    for item in [vb_name] + wheel_names(axles):
+        jnt = prefix + item + suffix
+        constraints = cmds.listRelatives(jnt, type=['pointConstraint', 'orientConstraint']) or []
 
-    wheel_pos = ['FL', 'FR', 'ML', 'MR', 'BL', 'BR']
-    wheel_name = [wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name]
-    for pos, item in zip(wheel_pos, wheel_name):
-        cmds.setAttr('Wheel_{}_Ctrl.overrideEnabled'.format(pos), 1)
-        cmds.setAttr('Wheel_{}_Ctrl.overrideColor'.format(pos), 17)  # Yellow
+        drivers = set()
+        for con in constraints:
+            drivers.update(getattr(cmds, cmds.nodeType(con))(con, q=True, targetList=True) or [])
+        if len(drivers) != 1:
+            continue
 
-        base_pos = cmds.xform(item, q=1, ws=1, piv=1)
-        if pos == 'FL' or pos == 'ML' or pos == 'BL':
-            cmds.move(base_pos[0], base_pos[1], base_pos[2] - 30, 'Wheel_{}_Ctrl'.format(pos))
-        else:
-            cmds.move(base_pos[0], base_pos[1], base_pos[2] + 30, 'Wheel_{}_Ctrl'.format(pos))
+        # Deleting the constraints leaves the joint where it is, so the offset is preserved
+        cmds.delete(constraints)
+        _matrix_constrain(drivers.pop(), jnt, maintain_offset)
+        converted.append(jnt)
 
-    # Set up the constraints
-    cmds.pointConstraint('VehicleBody_Ctrl', prefix + vb_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('VehicleBody_Ctrl', prefix + vb_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_FL_Ctrl', prefix + wfl_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_FL_Ctrl', prefix + wfl_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_FR_Ctrl', prefix + wfr_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_FR_Ctrl', prefix + wfr_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_ML_Ctrl', prefix + wml_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_ML_Ctrl', prefix + wml_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_MR_Ctrl', prefix + wmr_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_MR_Ctrl', prefix + wmr_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_BL_Ctrl', prefix + wbl_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_BL_Ctrl', prefix + wbl_name + suffix, maintainOffset=True)
-    cmds.pointConstraint('Wheel_BR_Ctrl', prefix + wbr_name + suffix, maintainOffset=True)
-    cmds.orientConstraint('Wheel_BR_Ctrl', prefix + wbr_name + suffix, maintainOffset=True)
-
-    cmds.parent('Wheel_FL_Ctrl', 'Wheel_FR_Ctrl', 'Wheel_ML_Ctrl', 'Wheel_MR_Ctrl', 'Wheel_BL_Ctrl', 'Wheel_BR_Ctrl', 'VehicleBody_Ctrl')
-
-    cmds.rename('VehicleBody_Ctrl', vb_name + '_Ctrl')
-    cmds.rename('Wheel_FL_Ctrl', wfl_name + '_Ctrl')
-    cmds.rename('Wheel_FR_Ctrl', wfr_name + '_Ctrl')
-    cmds.rename('Wheel_ML_Ctrl', wml_name + '_Ctrl')
-    cmds.rename('Wheel_MR_Ctrl', wmr_name + '_Ctrl')
-    cmds.rename('Wheel_BL_Ctrl', wbl_name + '_Ctrl')
-    cmds.rename('Wheel_BR_Ctrl', wbr_name + '_Ctrl')
-
-    cmds.select(clear=True)
+    return converted
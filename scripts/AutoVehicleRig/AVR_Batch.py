@@ -0,0 +1,298 @@
+# -*- coding: UTF-8 -*-
+# Headless batch rigging. Run it with mayapy, e.g.
+#
+#   mayapy AVR_Batch.py manifest.json --workers 8 --report report.json --timeout 1800
+#
+# The manifest is a JSON file:
+#
+#   {
+#     "prefix": "", "suffix": "_Jnt", "pivot": "world", "bind": "skin", "constraint": "matrix",
+#     "auto_spin": true, "combine": true,
+#     "parts": {"VehicleBody": ["body_geo"], "Wheel_F": ["wheel_f_geo"], "Wheel_B": ["wheel_b_geo"]},
+#     "jobs": [
+#       {"scene": "D:/cars/bike_A.mb", "output": "D:/cars/bike_A_rig.mb"},
+#       {"scene": "D:/cars/truck_B.mb", "parts": {"VehicleBody": [...], "Wheel_FL": [...], ...}}
+#     ]
+#   }
+#
+# "parts" maps each part name to the meshes that belong to it. The vehicle body always comes first,
+# followed by the wheels in the same order as the UI (F, B / FL, FR, BL, BR / FL, FR, ML, MR, BL, BR).
+# Any other layout lists the wheel parts per axle, front to back and left to right, under "axles", e.g.
+# "axles": [["Wheel_1L", "Wheel_1R"], ["Wheel_2L", "Wheel_2R"], ...]. Without it, two wheels are one per
+# axle and more wheels are paired up in order. A job without its own "parts" uses the top-level one.
+# "combine" merges the meshes of every part into one mesh per material while grouping.
+#
+# Every scene is rigged by a fresh mayapy process, and a scene without a result after --timeout seconds,
+# because its mayapy crashed or hung, fails instead of holding up the run.
+#
+# Instead of "parts" and the options, a job (or the manifest) can name a rig definition saved from the UI,
+# "preset": "D:/cars/truck_rig.json", which replays the recorded rig in one call (see AVR_Preset).
+#
+# A traffic scene with many vehicles lists them under "fleet", each with the namespace its meshes live in
+# and its rig definition:
+#
+#   {"scene": "D:/shots/street.mb", "fleet": [{"namespace": "Car01", "preset": "D:/cars/sedan_rig.json"},
+#                                             {"namespace": "Car02", "preset": "D:/cars/sedan_rig.json"}, ...]}
+#
+# "validate": true adds an evaluation check of every rig, with its playback speed, to the report.
+# "validate": "fix" also fixes what it can and times playback again afterwards (see AVR_Validate).
+#
+# Set AVR_PROFILE=1 to add per-step timings and Maya command counts to the report, or set it to a
+# directory to also write one Chrome trace per scene there (see AVR_Profile).
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds a scene may take before it counts as failed, and how often running scenes are checked
+JOB_TIMEOUT = 3600
+POLL_INTERVAL = 0.5
+
+# Manifest options and their defaults, set per job or once at the top level
+OPTIONS = {'prefix': '', 'suffix': '_Jnt', 'pivot': 'world', 'bind': 'skin', 'constraint': 'constraint',
+           'auto_spin': False, 'combine': False, 'validate': False}
+
+
+def _init_worker():
+    # Every worker is a separate mayapy process with its own standalone session
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+
+    # Controllers are built from the shape library, so no plug-in needs loading
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+
+
+def _axles(wheels, axles=None):
+    # Wheel part names per axle, checked against the wheel parts
+    if axles is None:
+        if len(wheels) % 2:
+            raise ValueError('{} wheels cannot be paired up, please list them per axle in "axles"'
+                             .format(len(wheels)))
+        axles = [wheels[:1], wheels[1:]] if len(wheels) == 2 else [wheels[index:index + 2]
+                                                                   for index in range(0, len(wheels), 2)]
+    if sorted(name for axle in axles for name in axle) != sorted(wheels) or len(axles) < 2:
+        raise ValueError('The axles {} do not match the wheel parts {}'.format(axles, wheels))
+    return [list(axle) for axle in axles]
+
+
+def _failed(job, error, total=0.0):
+    return {'scene': job['scene'], 'output': job.get('output') or job['scene'], 'ok': False, 'error': error,
+            'timings': {}, 'total': total}
+
+
+def rig_scene(job):
+    import maya.cmds as cmds
+    import AutoVehicleRig.AVR_Base as avr
+    import AutoVehicleRig.AVR_Preset as avr_preset
+    import AutoVehicleRig.AVR_Profile as avr_profile
+    import AutoVehicleRig.AVR_Validate as avr_validate
+
+    scene = job['scene']
+    output = job.get('output') or scene
+    parts = list(job.get('parts', {}).items())
+    options = dict(OPTIONS, **{key: job[key] for key in OPTIONS if key in job})
+    prefix = options['prefix']
+    suffix = options['suffix']
+
+    result = {'scene': scene, 'output': output, 'ok': False, 'error': None, 'timings': {}}
+    start = time.time()
+
+    def step(name, func, *args, **kwargs):
+        step_start = time.time()
+        with avr_profile.section(name):
+            func(*args, **kwargs)
+        result['timings'][name] = time.time() - step_start
+
+    avr_profile.reset()
+
+    try:
+        definition = avr_preset.load(job['preset']) if job.get('preset') else None
+        presets = dict((path, avr_preset.load(path)) for path in set(item['preset'] for item in job.get('fleet', [])))
+        names = [name for name, _ in parts]
+        if not definition and not presets:
+            axles = _axles(names[1:], job.get('axles'))
+        step('open', cmds.file, scene, open=True, force=True)
+
+        # Nothing is undone in a batch run, so the rig steps skip the undo queue altogether
+        with avr.fast_execution('AVR_Batch', undo=False):
+            if presets:
+                # Every vehicle of the scene in its own namespace
+                step('fleet', avr_preset.build_fleet,
+                     [(item['namespace'], presets[item['preset']]) for item in job['fleet']])
+            elif definition:
+                # The recorded rig, Step1 to Step3 in one call
+                step('preset', avr_preset.build_rig, definition)
+            else:
+                # Step1 : group and clean up every part, exactly like the rename buttons
+                step_start = time.time()
+                for index, (name, meshes) in enumerate(parts):
+                    if index == 0 and options['pivot'] == 'world':
+                        avr.rename_group_model_world(name, objects=meshes, combine=options['combine'])
+                    else:
+                        avr.rename_group_model_object(name, objects=meshes, combine=options['combine'])
+                    if not cmds.objExists(name):
+                        raise RuntimeError("Failed to group part '{}'".format(name))
+                result['timings']['group'] = time.time() - step_start
+
+                # Step2 : create joints and snap them onto their parts
+                step('joints', avr.create_joints, names[0], axles, prefix, suffix)
+                step_start = time.time()
+                for name in names:
+                    avr.snap_joint([prefix + name + suffix, name])
+                result['timings']['snap'] = time.time() - step_start
+
+                # Step3 : skinning and controllers
+                step('bind', avr.bind_skin, names[0], axles, prefix, suffix, options['bind'])
+                step('controllers', avr.create_controllers, names[0], axles, prefix, suffix, options['constraint'],
+                     options['auto_spin'])
+
+                # Keep the definition on the finished rig like the UI does, for update_rig() and replicate_rig()
+                avr_preset.store(avr_preset.record_rig(names[0], axles, prefix, suffix, options['pivot'],
+                                                       options['bind'], options['constraint'], options['auto_spin'],
+                                                       options['combine']))
+
+        if options['validate']:
+            # Evaluation QC of every rig in the scene, as (namespace, rig definition)
+            if presets:
+                rigs = [(item['namespace'], dict(avr_preset.DEFAULTS, **presets[item['preset']]))
+                        for item in job['fleet']]
+            elif definition:
+                rigs = [(None, dict(avr_preset.DEFAULTS, **definition))]
+            else:
+                rigs = [(None, {'vehicle': names[0], 'axles': axles, 'prefix': prefix, 'suffix': suffix})]
+
+            step_start = time.time()
+            result['validation'] = []
+            for namespace, rig in rigs:
+                with avr.vehicle_namespace(namespace):
+                    report = avr_validate.check_rig(rig['vehicle'], rig['axles'], rig['prefix'], rig['suffix'],
+                                                    fix=options['validate'] == 'fix', playback=True)
+                report['namespace'] = namespace
+                result['validation'].append(report)
+            result['timings']['validate'] = time.time() - step_start
+
+        step_start = time.time()
+        cmds.file(rename=output)
+        file_type = 'mayaAscii' if output.lower().endswith('.ma') else 'mayaBinary'
+        cmds.file(save=True, force=True, type=file_type)
+        result['timings']['save'] = time.time() - step_start
+
+        result['ok'] = True
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    result['total'] = time.time() - start
+
+    if avr_profile.enabled():
+        result['profile'] = avr_profile.report()
+        trace_dir = os.environ.get(avr_profile.PROFILE_ENV, '')
+        if os.path.isdir(trace_dir):
+            name = os.path.splitext(os.path.basename(scene))[0]
+            avr_profile.export(os.path.join(trace_dir, name + '.trace.json'))
+
+    return result
+
+
+def load_jobs(manifest_path):
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    jobs = []
+    for job in manifest['jobs']:
+        if not isinstance(job, dict):
+            job = {'scene': job}
+        # A job with its own part mapping or fleet does not use the top-level preset
+        if 'parts' not in job and 'preset' not in job and 'fleet' not in job and 'preset' in manifest:
+            job['preset'] = manifest['preset']
+        for key in ['parts', 'axles'] + list(OPTIONS):
+            if key not in job and key in manifest:
+                job[key] = manifest[key]
+        if 'parts' not in job and 'preset' not in job and 'fleet' not in job:
+            raise ValueError("No part mapping for '{}'".format(job['scene']))
+        jobs.append(job)
+
+    return jobs
+
+
+def run(jobs, workers=None, timeout=JOB_TIMEOUT):
+    # Maya is not fork-safe, so always spawn fresh mayapy processes, one per scene. A process that dies
+    # takes its job with it, so no more jobs are handed out than there are workers and a job without a
+    # result after timeout seconds (None waits forever) counts as failed.
+    context = multiprocessing.get_context('spawn')
+    workers = min(workers or multiprocessing.cpu_count(), len(jobs)) or 1
+
+    results = []
+    pending = list(jobs)
+    running = {}  # AsyncResult -> (job, start time)
+    stuck = False
+    pool = context.Pool(workers, initializer=_init_worker, maxtasksperchild=1)
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                job = pending.pop(0)
+                running[pool.apply_async(rig_scene, (job,))] = (job, time.time())
+            time.sleep(POLL_INTERVAL)
+
+            for async_result, (job, start) in list(running.items()):
+                if async_result.ready():
+                    try:
+                        result = async_result.get()
+                    except Exception:
+                        result = _failed(job, traceback.format_exc(), time.time() - start)
+                elif timeout and time.time() - start > timeout:
+                    # A hung process may keep its worker, so hand out one job less from now on
+                    result = _failed(job, 'No result after {}s, mayapy crashed or hung'.format(timeout),
+                                     time.time() - start)
+                    workers = max(1, workers - 1)
+                    stuck = True
+                else:
+                    continue
+
+                del running[async_result]
+                status = 'OK  ' if result['ok'] else 'FAIL'
+                print('{} {:8.2f}s  {}'.format(status, result['total'], result['scene']))
+                results.append(result)
+    finally:
+        if stuck:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rig many vehicle scenes with Auto Vehicle Rig.')
+    parser.add_argument('manifest', help='JSON file listing the scenes and their part mappings')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of mayapy processes')
+    parser.add_argument('-r', '--report', help='Write per-file results and timings to this JSON file')
+    parser.add_argument('-t', '--timeout', type=float, default=JOB_TIMEOUT,
+                        help='Seconds a scene may take before it fails, 0 waits forever')
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.manifest)
+    start = time.time()
+    results = run(jobs, args.workers, args.timeout or None)
+
+    failed = [result for result in results if not result['ok']]
+    for result in failed:
+        print('\n{}\n{}'.format(result['scene'], result['error']))
+    print('\n{} scenes, {} failed, {:.2f}s'.format(len(results), len(failed), time.time() - start))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+# Bake an animated AVR vehicle into a compact transform cache and play it back without the rig.
+# The cache is a float32 .npy file of shape (frames, joints, 16) holding world matrices, next to a small
+# '<cache>.json' header. Baking streams frame chunks to a memory map, playback memory maps the file.
+import AutoVehicleRig.AVR_Base as avr
+import maya.api.OpenMaya as om2
+import maya.cmds as cmds
+import json
+import os
+
+np = avr.numpy
+
+
+CACHE_PLUGIN = os.path.join(avr.AVR_DIR, 'AVR_CacheNode.py')
+CHUNK_FRAMES = 256
+
+
+def sample_matrices(plugs, frames):
+    # (plugs, frames, 4, 4) matrix values, evaluated in a time context without changing the current time
+    selection = om2.MSelectionList()
+    for plug in plugs:
+        selection.add(plug)
+
+    result = np.empty((len(plugs), len(frames), 4, 4))
+    unit = om2.MTime.uiUnit()
+    for column, frame in enumerate(frames):
+        context = om2.MDGContext(om2.MTime(frame, unit))
+        for row in range(len(plugs)):
+            data = om2.MFnMatrixData(selection.getPlug(row).asMObject(context)).matrix()
+            result[row, column] = np.array(data).reshape(4, 4)
+    return result
+
+
+def rig_joints(vb_name, axles, prefix='', suffix='_Jnt'):
+    return [prefix + name + suffix for name in [vb_name] + [name for axle in axles for name in axle]]
+
+
+@avr.fast_step
+def bake_cache(joints, start, end, path):
+    avr.require_numpy('Transform caching')
+
+    frames = list(range(int(start), int(end) + 1))
+    cache = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(len(frames), len(joints), 16))
+
+    # Walk the range once, a chunk of frames at a time, straight into the file
+    plugs = [jnt + '.worldMatrix[0]' for jnt in joints]
+    for first in range(0, len(frames), CHUNK_FRAMES):
+        chunk = frames[first:first + CHUNK_FRAMES]
+        matrices = sample_matrices(plugs, chunk).transpose(1, 0, 2, 3)
+        cache[first:first + len(chunk)] = matrices.reshape(len(chunk), len(joints), 16)
+    cache.flush()
+    del cache
+
+    # Frames are in the scene's time unit, so keep its rate for playback in a scene with another one
+    fps = om2.MTime(1.0, om2.MTime.kSeconds).asUnits(om2.MTime.uiUnit())
+    with open(path + '.json', 'w') as f:
+        json.dump({'joints': joints, 'start': frames[0], 'end': frames[-1], 'fps': fps}, f, indent=2)
+
+    return path
+
+
+def _load_plugin():
+    if not cmds.pluginInfo(CACHE_PLUGIN, q=True, loaded=True):
+        cmds.loadPlugin(CACHE_PLUGIN, quiet=True)
+
+
+@avr.fast_step
+def attach_cache(path, name='AVR_Cache'):
+    # Drive the cached joints from the file: every incoming connection to their transforms is
+    # recorded and removed, and their world matrix comes through offsetParentMatrix instead
+    _load_plugin()
+    with open(path + '.json') as f:
+        header = json.load(f)
+
+    node = cmds.createNode('avrTransformCache', n=name)
+    cmds.setAttr(node + '.cachePath', path, type='string')
+    cmds.connectAttr('time1.outTime', node + '.time')
+
+    restore = []
+    attrs = ['translate', 'rotate', 'jointOrient', 'offsetParentMatrix']
+    channels = set(attrs + [attr + axis for attr in attrs[:3] for axis in 'XYZ'])
+    for index, jnt in enumerate(header['joints']):
+        # Keys and constraints connect to the single channels, e.g. translateX, so list them all at once
+        connections = cmds.listConnections(jnt, s=1, d=0, p=1, c=1) or []
+        pairs = [(source, destination) for destination, source in zip(connections[::2], connections[1::2])
+                 if destination.split('.', 1)[1] in channels]
+        for source, destination in pairs:
+            cmds.disconnectAttr(source, destination)
+        restore.append({'joint': jnt,
+                        'connections': pairs,
+                        'values': {attr: list(cmds.getAttr(jnt + '.' + attr)[0]) for attr in attrs[:3]}})
+
+        for attr in attrs[:3]:
+            cmds.setAttr(jnt + '.' + attr, 0, 0, 0)
+
+        mult = cmds.createNode('multMatrix', n=jnt + '_Cache_MM')
+        cmds.connectAttr('{}.outMatrix[{}]'.format(node, index), mult + '.matrixIn[0]')
+        cmds.connectAttr(jnt + '.parentInverseMatrix[0]', mult + '.matrixIn[1]')
+        cmds.connectAttr(mult + '.matrixSum', jnt + '.offsetParentMatrix', f=True)
+
+    cmds.addAttr(node, ln='restoreData', dt='string')
+    cmds.setAttr(node + '.restoreData', json.dumps(restore), type='string')
+    return node
+
+
+@avr.fast_step
+def detach_cache(node):
+    # Give the joints back to the rig
+    restore = json.loads(cmds.getAttr(node + '.restoreData'))
+    for item in restore:
+        jnt = item['joint']
+        cmds.delete(jnt + '_Cache_MM')
+        cmds.setAttr(jnt + '.offsetParentMatrix', list(om2.MMatrix()), type='matrix')
+        for attr, value in item['values'].items():
+            cmds.setAttr(jnt + '.' + attr, *value)
+        for source, destination in item['connections']:
+            cmds.connectAttr(source, destination, f=True)
+
+    cmds.delete(node)
@@ -0,0 +1,94 @@
+# -*- coding: UTF-8 -*-
+# Scripted plug-in node that plays back an AVR transform cache.
+# The cache file is memory mapped, so each frame only reads the few matrices it needs from disk.
+import AutoVehicleRig.AVR_Base as avr
+import maya.OpenMaya as om
+import maya.OpenMayaMPx as ompx
+import json
+import os
+
+np = avr.numpy
+
+
+NODE_NAME = 'avrTransformCache'
+NODE_ID = om.MTypeId(0x0007F2A1)  # Local id range, not for distribution outside the studio
+
+# {(path, modification time): (memmap, first frame, frames per second)} shared by every node playing the
+# same file, a file baked again gets a new entry
+_OPEN_CACHES = {}
+
+
+def open_cache(path):
+    key = (path, os.path.getmtime(path))
+    if key not in _OPEN_CACHES:
+        with open(path + '.json') as f:
+            header = json.load(f)
+        _OPEN_CACHES[key] = (np.load(path, mmap_mode='r'), header['start'], header['fps'])
+    return _OPEN_CACHES[key]
+
+
+class AVRTransformCache(ompx.MPxNode):
+
+    cache_path = om.MObject()
+    time = om.MObject()
+    out_matrix = om.MObject()
+
+    def compute(self, plug, data):
+        if plug != AVRTransformCache.out_matrix:
+            return om.kUnknownParameter
+
+        path = data.inputValue(AVRTransformCache.cache_path).asString()
+        time = data.inputValue(AVRTransformCache.time).asTime()
+        if not path or np is None:
+            data.setClean(plug)
+            return
+
+        # Frames of the cache, in the time unit it was baked in
+        matrices, start, fps = open_cache(path)
+        frame = time.asUnits(om.MTime.kSeconds) * fps
+        index = min(max(int(round(frame - start)), 0), len(matrices) - 1)
+
+        handle = data.outputArrayValue(AVRTransformCache.out_matrix)
+        builder = handle.builder()
+        for joint, values in enumerate(matrices[index]):
+            matrix = om.MMatrix()
+            om.MScriptUtil.createMatrixFromList([float(value) for value in values], matrix)
+            builder.addElement(joint).setMMatrix(matrix)
+        handle.set(builder)
+        handle.setAllClean()
+        data.setClean(plug)
+
+
+def creator():
+    return ompx.asMPxPtr(AVRTransformCache())
+
+
+def initializer():
+    typed = om.MFnTypedAttribute()
+    AVRTransformCache.cache_path = typed.create('cachePath', 'cp', om.MFnData.kString)
+    ompx.MPxNode.addAttribute(AVRTransformCache.cache_path)
+
+    unit = om.MFnUnitAttribute()
+    AVRTransformCache.time = unit.create('time', 'tm', om.MFnUnitAttribute.kTime, 0.0)
+    ompx.MPxNode.addAttribute(AVRTransformCache.time)
+
+    matrix = om.MFnMatrixAttribute()
+    AVRTransformCache.out_matrix = matrix.create('outMatrix', 'om')
+    matrix.setArray(True)
+    matrix.setUsesArrayDataBuilder(True)
+    matrix.setWritable(False)
+    matrix.setStorable(False)
+    ompx.MPxNode.addAttribute(AVRTransformCache.out_matrix)
+
+    ompx.MPxNode.attributeAffects(AVRTransformCache.cache_path, AVRTransformCache.out_matrix)
+    ompx.MPxNode.attributeAffects(AVRTransformCache.time, AVRTransformCache.out_matrix)
+
+
+def initializePlugin(mobject):
+    plugin = ompx.MFnPlugin(mobject, 'YE-ZA', '1.0')
+    plugin.registerNode(NODE_NAME, NODE_ID, creator, initializer)
+
+
+def uninitializePlugin(mobject):
+    plugin = ompx.MFnPlugin(mobject)
+    plugin.deregisterNode(NODE_ID)
@@ -0,0 +1,258 @@
+# -*- coding: UTF-8 -*-
+# Automatic wheel/body classification from mesh geometry.
+# All vertices are read in bulk into one NumPy array and every per-mesh statistic (bounding box,
+# centroid, principal axes) is computed with segmented reductions, so there is no Python loop over
+# vertices and only a few small loops over meshes or wheels.
+import AutoVehicleRig.AVR_Base as avr
+import maya.cmds as cmds
+import maya.OpenMaya as om
+import ctypes
+
+np = avr.numpy
+
+
+# Wheel group names for the layouts the UI knows, front to back and left to right
+WHEEL_NAMES = {(1, 1): [['Wheel_F'], ['Wheel_B']],
+               (2, 2): [['Wheel_FL', 'Wheel_FR'], ['Wheel_BL', 'Wheel_BR']],
+               (2, 2, 2): [['Wheel_FL', 'Wheel_FR'], ['Wheel_ML', 'Wheel_MR'], ['Wheel_BL', 'Wheel_BR']]}
+
+# A wheel is roughly a disc: two similar large principal axes, a short one along Z, touching the ground
+ROUND_RATIO = 0.8
+AXIS_ALIGNMENT = 0.9
+GROUND_TOLERANCE = 0.25
+# Points this close to a wheel's radius are its tread, which alone sets the spin axis
+TREAD = 0.9
+
+
+def read_points(meshes):
+    # World space vertices of every mesh in one (N, 3) array, plus the index of each mesh's first vertex.
+    # Each mesh's float buffer is copied in one go and moved to world space with its matrix, so no point
+    # goes through Python on its own.
+    selection = om.MSelectionList()
+    for mesh in meshes:
+        selection.add(mesh)
+
+    chunks = []
+    path = om.MDagPath()
+    for index in range(selection.length()):
+        selection.getDagPath(index, path)
+        fn = om.MFnMesh(path)
+        count = fn.numVertices()
+        if not count:
+            chunks.append(np.empty((0, 3)))
+            continue
+        raw = (ctypes.c_float * (count * 3)).from_address(int(fn.getRawPoints()))
+        local = np.frombuffer(raw, dtype=np.float32).reshape(count, 3)
+        matrix = np.array(avr.to_list(path.inclusiveMatrix())).reshape(4, 4)
+        chunks.append(local.dot(matrix[:3, :3]) + matrix[3, :3])
+
+    counts = np.array([len(chunk) for chunk in chunks])
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return np.concatenate(chunks), offsets, counts
+
+
+def mesh_stats(points, offsets, counts):
+    # Bounding boxes, centroids and principal axes of every mesh at once
+    bb_min = np.minimum.reduceat(points, offsets)
+    bb_max = np.maximum.reduceat(points, offsets)
+    centroid = np.add.reduceat(points, offsets) / counts[:, None]
+
+    # Covariance from the six unique products, summed per mesh
+    centered = points - np.repeat(centroid, counts, axis=0)
+    rows, cols = np.triu_indices(3)
+    products = np.add.reduceat(centered[:, rows] * centered[:, cols], offsets) / counts[:, None]
+    covariance = np.empty((len(counts), 3, 3))
+    covariance[:, rows, cols] = products
+    covariance[:, cols, rows] = products
+
+    # Eigenvalues in ascending order: the last two span a wheel's disc, the first is its spin axis
+    values, vectors = np.linalg.eigh(covariance)
+    return {'min': bb_min, 'max': bb_max, 'center': (bb_min + bb_max) / 2.0, 'centroid': centroid,
+            'values': values, 'axis': vectors[:, :, 0]}
+
+
+def _find_hubs(stats):
+    radius = (stats['max'][:, 1] - stats['min'][:, 1]) / 2.0
+    extent = stats['max'] - stats['min']
+    ground = stats['min'][:, 1].min()
+
+    values = np.maximum(stats['values'], 1e-12)
+    is_wheel = ((values[:, 1] / values[:, 2] > ROUND_RATIO) &
+                (np.abs(stats['axis'][:, 2]) > AXIS_ALIGNMENT) &
+                (np.abs(extent[:, 0] - extent[:, 1]) < extent[:, 1] * (1 - ROUND_RATIO)) &
+                (extent[:, 2] < extent[:, 1]) &
+                (stats['min'][:, 1] - ground < radius * GROUND_TOLERANCE))
+
+    # Tire, rim and hubcap of one wheel all qualify: keep the biggest, drop the ones inside it
+    hubs = []
+    for index in np.flatnonzero(is_wheel)[np.argsort(-radius[is_wheel])]:
+        center = stats['center'][index]
+        if any(np.linalg.norm(center - hub['center']) < hub['radius'] * 0.5 for hub in hubs):
+            continue
+        hubs.append({'center': center, 'radius': radius[index], 'width': extent[index, 2]})
+
+    return hubs
+
+
+def _sort_axles(hubs):
+    # Front (+X) to back, wheels within half a radius of each other in X share an axle, left (-Z) to right
+    axles = []
+    for hub in sorted(hubs, key=lambda hub: -hub['center'][0]):
+        if axles and abs(axles[-1][-1]['center'][0] - hub['center'][0]) < hub['radius'] * 0.5:
+            axles[-1].append(hub)
+        else:
+            axles.append([hub])
+    return [sorted(axle, key=lambda hub: hub['center'][2]) for axle in axles]
+
+
+def _wheel_names(axles):
+    names = WHEEL_NAMES.get(tuple(len(axle) for axle in axles))
+    if names:
+        return names
+
+    # Any other layout: Wheel_1L, Wheel_1R, Wheel_2C, Wheel_3_1 ... counted from the front axle
+    sides = {1: ['C'], 2: ['L', 'R']}
+    return [['Wheel_{}{}'.format(index + 1, side)
+             for side in sides.get(len(axle), ['_{}'.format(i + 1) for i in range(len(axle))])]
+            for index, axle in enumerate(axles)]
+
+
+def detect(meshes=None, vb_name='VehicleBody'):
+    # Returns the body name, the wheel names per axle and {part name: [mesh transforms]}
+    avr.require_numpy('Auto detection')
+
+    shapes = cmds.ls(meshes or cmds.ls(sl=1), dag=1, type='mesh', ni=1, long=True)
+    if not shapes:
+        return None
+    transforms = [shape.rsplit('|', 1)[0] for shape in shapes]
+
+    points, offsets, counts = read_points(shapes)
+    keep = counts > 0
+    stats = mesh_stats(points, offsets[keep], counts[keep])
+    transforms = [transform for transform, valid in zip(transforms, keep) if valid]
+
+    axles = _sort_axles(_find_hubs(stats))
+    names = _wheel_names(axles)
+    hubs = [hub for axle in axles for hub in axle]
+    if not hubs:
+        return vb_name, [], {vb_name: transforms}
+
+    # Every mesh whose center sits inside a wheel's cylinder belongs to that wheel, the rest is body
+    hub_center = np.array([hub['center'] for hub in hubs])
+    hub_radius = np.array([hub['radius'] for hub in hubs])
+    hub_width = np.array([hub['width'] for hub in hubs])
+    offset = stats['center'][:, None, :] - hub_center[None, :, :]
+    radial = np.hypot(offset[:, :, 0], offset[:, :, 1])
+    inside = (radial < hub_radius * 1.05) & (np.abs(offset[:, :, 2]) < hub_width)
+    distance = np.where(inside, np.linalg.norm(offset, axis=2), np.inf)
+    owner = np.where(inside.any(axis=1), distance.argmin(axis=1), -1)
+
+    flat_names = [name for axle in names for name in axle]
+    parts = {name: [] for name in [vb_name] + flat_names}
+    for transform, index in zip(transforms, owner):
+        parts[flat_names[index] if index >= 0 else vb_name].append(transform)
+
+    return vb_name, names, parts
+
+
+@avr.fast_step
+def auto_group(meshes=None, vb_name='VehicleBody', pivot='world', combine=False):
+    # Classify the meshes, then group them with the regular Step1 functions
+    result = detect(meshes, vb_name)
+    if not result:
+        om.MGlobal.displayWarning('Please select the vehicle meshes!')
+        return
+    vb_name, axles, parts = result
+
+    # Grouping renames paths, so address every mesh by its UUID
+    uuids = {name: cmds.ls(members, uuid=True) for name, members in parts.items()}
+    for name, members in uuids.items():
+        if not members:
+            continue
+        if name == vb_name and pivot == 'world':
+            avr.rename_group_model_world(name, objects=cmds.ls(members, long=True), combine=combine)
+        else:
+            avr.rename_group_model_object(name, objects=cmds.ls(members, long=True), combine=combine)
+
+    avr.select_after([])
+    return vb_name, axles
+
+
+def fit_wheels(groups):
+    # Hub center, spin axis and radius of every wheel group in one batched pass
+    avr.require_numpy('Joint fitting')
+
+    shapes, group_counts = [], []
+    for grp in groups:
+        members = cmds.ls(grp, dag=1, type='mesh', ni=1, long=True)
+        if not members:
+            raise ValueError("No meshes found under '{}'".format(grp))
+        shapes.extend(members)
+        group_counts.append(len(members))
+
+    # The meshes of a group are contiguous, so each group is one segment of the point array
+    points, offsets, counts = read_points(shapes)
+    first = np.concatenate(([0], np.cumsum(group_counts)[:-1]))
+    offsets, counts = offsets[first], np.add.reduceat(counts, first)
+    stats = mesh_stats(points, offsets, counts)
+    center, radius, distance = _hub(points, offsets, counts, stats['centroid'], _to_right(stats['axis']))
+
+    # Calipers, valves and bolts tilt the principal axes of the whole group, so fit the spin axis again on
+    # the tread alone, then the hub around it
+    tread = distance >= np.repeat(radius, counts) * TREAD
+    tread_counts = np.bincount(np.repeat(np.arange(len(counts)), counts)[tread], minlength=len(counts))
+    tread_offsets = np.concatenate(([0], np.cumsum(tread_counts)[:-1]))
+    axis = _to_right(mesh_stats(points[tread], tread_offsets, tread_counts)['axis'])
+    center, radius, _ = _hub(points, offsets, counts, center, axis)
+
+    return center, axis, radius
+
+
+def _to_right(axis):
+    # Spin axis points to +Z (the vehicle's right side)
+    return axis * np.where(axis[:, 2] < 0, -1.0, 1.0)[:, None]
+
+
+def _hub(points, offsets, counts, origin, axis):
+    # Hub center and radius of every segment around its spin axis, plus each point's distance off the axis.
+    # The hub sits half way between the inner and outer faces. In the disc plane it is the middle of the
+    # bounding box, which the tire spans, so calipers, valves and bolts do not pull it off like they pull
+    # the centroid. The radius is the farthest point from the hub in that plane.
+    relative = points - np.repeat(origin, counts, axis=0)
+    point_axis = np.repeat(axis, counts, axis=0)
+    along = np.einsum('ij,ij->i', relative, point_axis)
+    middle = (np.minimum.reduceat(along, offsets) + np.maximum.reduceat(along, offsets)) / 2.0
+
+    planar = relative - along[:, None] * point_axis
+    in_plane = (np.minimum.reduceat(planar, offsets) + np.maximum.reduceat(planar, offsets)) / 2.0
+    distance = np.linalg.norm(planar - np.repeat(in_plane, counts, axis=0), axis=1)
+    return origin + axis * middle[:, None] + in_plane, np.maximum.reduceat(distance, offsets), distance
+
+
+def _joint_matrix(center, axis):
+    # Same convention as the default joints: Y runs along -axis, X points forward as much as possible
+    y = -np.asarray(axis, dtype=np.float64)
+    x = np.array([1.0, 0.0, 0.0]) - y * y[0]
+    x /= np.linalg.norm(x)
+    z = np.cross(x, y)
+    return avr.to_mmatrix(list(x) + [0] + list(y) + [0] + list(z) + [0] + list(center) + [1])
+
+
+@avr.fast_step
+def fit_joints(vb_name, axles, prefix='', suffix='_Jnt'):
+    # Place and orient every joint on its fitted wheel hub in one modifier, and keep each radius on its
+    # joint as 'wheelRadius' for the later steps
+    wheels = [name for axle in axles for name in axle]
+    center, axis, radius = fit_wheels(wheels)
+
+    placements = {name: _joint_matrix(c, a) for name, c, a in zip(wheels, center, axis)}
+    placements[vb_name] = _joint_matrix(center.mean(axis=0), (0, 0, 1))
+    joints = avr.place_joints(vb_name, axles, prefix, suffix, placements)
+
+    for name, value in zip(wheels, radius):
+        jnt = prefix + name + suffix
+        if not cmds.attributeQuery('wheelRadius', node=jnt, exists=True):
+            cmds.addAttr(jnt, ln='wheelRadius', at='double', min=0)
+        cmds.setAttr(jnt + '.wheelRadius', float(value))
+
+    return joints
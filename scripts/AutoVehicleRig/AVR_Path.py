@@ -0,0 +1,226 @@
+# -*- coding: UTF-8 -*-
+# Path drive: the body controller follows a curve at constant speed, heading along it, and the wheels spin
+# from the exact distance travelled.
+#
+# Curve parameters are not spread evenly along a curve, so the distance along the path is turned into a
+# parameter by an arc-length lookup table: the curve is sampled densely once in world space, the segment
+# lengths summed up, and the (length, parameter) pairs keyed on a linear animCurveUU through the API, without
+# a command per key. Maya evaluates that natively, so scrubbing costs one key lookup per vehicle and frame,
+# with no script running at all.
+#
+# Tables are cached by the curve's CVs, knots and placement, and every path keeps its lookup curve in the
+# scene as '<curve>_ArcLength_LUT'. Each vehicle following it plays a copy of that curve, so another vehicle
+# on the same path costs one duplicate. After editing a path, update_paths() rebuilds the tables of the
+# curves that changed and only those.
+#
+# The vehicle is moved by a '<body>_Ctrl_Path' group above the body controller, whose 'distance' attribute
+# is the distance along the path: linear keys give constant speed. The body controller still animates on
+# top of the path, and its travel relative to the path adds to the wheel spin.
+import AutoVehicleRig.AVR_Base as avr
+import AutoVehicleRig.AVR_Shapes as avr_shapes
+import maya.cmds as cmds
+import maya.OpenMaya as om
+import maya.OpenMayaAnim as oma
+import hashlib
+
+
+PATH_ATTR = 'distance'
+SIGNATURE_ATTR = 'pathSignature'
+SAMPLES_PER_SPAN = 16
+
+# {curve signature: [(length, parameter)]}, shared by every curve with the same shape and placement
+_TABLES = {}
+
+
+def _curve_shape(curve):
+    if not cmds.objExists(curve):
+        raise ValueError("'{}' does not exist".format(curve))
+    shapes = [curve] if cmds.nodeType(curve) == 'nurbsCurve' else cmds.listRelatives(curve, s=1, type='nurbsCurve',
+                                                                                       ni=1)
+    if not shapes:
+        raise ValueError("'{}' is not a NURBS curve".format(curve))
+    return shapes[0]
+
+
+def _signature(fn):
+    # Changes with the CVs, the knots or the placement of the curve
+    points, knots = om.MPointArray(), om.MDoubleArray()
+    fn.getCVs(points, om.MSpace.kWorld)
+    fn.getKnots(knots)
+    values = [round(value, 6) for index in range(points.length())
+              for value in (points[index].x, points[index].y, points[index].z)]
+    values += [round(knots[index], 6) for index in range(knots.length())]
+    return hashlib.md5(repr((fn.degree(), values)).encode('utf-8')).hexdigest()
+
+
+def _table(shape):
+    # (signature, [(length, parameter)]), sampled evenly in parameter and measured in world space
+    fn = avr_shapes.curve_fn(shape)
+    signature = _signature(fn)
+    if signature in _TABLES:
+        return signature, _TABLES[signature]
+
+    knots = om.MDoubleArray()
+    fn.getKnots(knots)
+    degree = fn.degree()
+    start, end = knots[degree - 1], knots[knots.length() - degree]
+    count = fn.numSpans() * SAMPLES_PER_SPAN
+
+    table, length, last = [], 0.0, None
+    point = om.MPoint()
+    for index in range(count + 1):
+        param = start + (end - start) * index / count
+        fn.getPointAtParam(param, point, om.MSpace.kWorld)
+        if last is not None:
+            length += ((point.x - last[0]) ** 2 + (point.y - last[1]) ** 2 + (point.z - last[2]) ** 2) ** 0.5
+        last = (point.x, point.y, point.z)
+        table.append((length, param))
+
+    _TABLES[signature] = table
+    return signature, table
+
+
+def arc_length_table(curve):
+    # [(length along the curve, parameter)] from the start of the curve to its end
+    return _table(_curve_shape(curve))[1]
+
+
+class _KeyChange(object):
+    # An MAnimCurveChange shaped like a modifier for avr.commit_modifier. The keys are in place when it is
+    # committed, so only redoing them again replays the change.
+
+    def __init__(self):
+        self.change = oma.MAnimCurveChange()
+        self._undone = False
+
+    def doIt(self):
+        if self._undone:
+            self.change.redoIt()
+        self._undone = False
+
+    def undoIt(self):
+        self.change.undoIt()
+        self._undone = True
+
+
+def _path_table(shape):
+    # The lookup curve of a path, connected to the curve's message and rekeyed only when the curve changed.
+    # Returns (lookup curve, whether it was keyed now).
+    signature, table = _table(shape)
+    tables = cmds.listConnections(shape + '.message', s=0, d=1, type='animCurveUU')
+    if tables:
+        lookup = tables[0]
+        if cmds.getAttr(lookup + '.' + SIGNATURE_ATTR) == signature:
+            return lookup, False
+        cmds.cutKey(lookup, clear=True)
+    else:
+        name = cmds.listRelatives(shape, p=1)[0].rsplit(':', 1)[-1]
+        lookup = cmds.createNode('animCurveUU', n=name + '_ArcLength_LUT')
+        cmds.addAttr(lookup, ln='pathCurve', at='message')
+        cmds.addAttr(lookup, ln=SIGNATURE_ATTR, dt='string')
+        cmds.connectAttr(shape + '.message', lookup + '.pathCurve')
+
+    # API1 only keys time curves in bulk (addKeys), so unitless keys are added one by one, still without
+    # running a command for each
+    selection = om.MSelectionList()
+    selection.add(lookup)
+    node = om.MObject()
+    selection.getDependNode(0, node)
+    curve = oma.MFnAnimCurve(node)
+    change = _KeyChange()
+    for length, param in table:
+        curve.addKey(length, param, oma.MFnAnimCurve.kTangentLinear, oma.MFnAnimCurve.kTangentLinear,
+                     change.change)
+    avr.commit_modifier(change)
+    cmds.setAttr(lookup + '.' + SIGNATURE_ATTR, signature, type='string')
+    return lookup, True
+
+
+def _follow(lookup, name, distance, info):
+    # A vehicle's own copy of the lookup curve, from its distance to the curve parameter
+    copy = cmds.duplicate(lookup, n=name)[0]
+    cmds.connectAttr(distance, copy + '.input')
+    cmds.connectAttr(copy + '.output', info + '.parameter', f=1)
+    return copy
+
+
+@avr.fast_step
+def create_path_drive(vb_name, axles, curve, prefix='', suffix='_Jnt'):
+    body_ctrl = vb_name + '_Ctrl'
+    group = vb_name + '_Ctrl_Path'
+    if not cmds.objExists(body_ctrl):
+        raise ValueError("'{}' does not exist, please create the controllers first".format(body_ctrl))
+    if cmds.objExists(group):
+        raise ValueError("'{}' already follows a path".format(vb_name))
+    shape = _curve_shape(curve)
+    lookup, _ = _path_table(shape)
+
+    # The wheels spin from the travel of the body controller, measured relative to the path from now on
+    if not cmds.objExists(vb_name + '_Travel_ADL'):
+        avr.create_wheel_spin(vb_name, axles, prefix, suffix)
+
+    # The ground point under the body controller is the one that follows the curve
+    pivot = cmds.xform(body_ctrl, q=1, ws=1, rp=1)
+    pivot[1] = min(cmds.getAttr(name + '.boundingBoxMinY') for name in avr.wheel_names(axles))
+    group = avr.insert_parent(body_ctrl, group)
+    cmds.xform(group, ws=1, piv=pivot)
+    cmds.addAttr(group, ln=PATH_ATTR, at='double', k=True)
+
+    info = cmds.createNode('pointOnCurveInfo', n=vb_name + '_Path_POCI')
+    cmds.connectAttr(shape + '.worldSpace[0]', info + '.inputCurve')
+    _follow(lookup, vb_name + '_Path_LUT', group + '.' + PATH_ATTR, info)
+
+    offset = cmds.createNode('plusMinusAverage', n=vb_name + '_Path_PMA')
+    cmds.setAttr(offset + '.operation', 2)  # Subtract
+    cmds.connectAttr(info + '.position', offset + '.input3D[0]')
+    cmds.setAttr(offset + '.input3D[1]', *pivot)
+    cmds.connectAttr(offset + '.output3D', group + '.translate')
+
+    # Heading: +X aligned with the tangent, flattened so the vehicle only turns around Y, and +Y kept up.
+    # Unlike the shortest rotation from +X, this does not flip when the path heads along -X.
+    heading = cmds.createNode('aimMatrix', n=vb_name + '_Heading_AM')
+    cmds.setAttr(heading + '.primaryMode', 2)  # Align
+    cmds.setAttr(heading + '.primaryTargetVectorY', 0)
+    cmds.connectAttr(info + '.tangentX', heading + '.primaryTargetVectorX')
+    cmds.connectAttr(info + '.tangentZ', heading + '.primaryTargetVectorZ')
+    cmds.setAttr(heading + '.secondaryMode', 2)  # Align
+    cmds.setAttr(heading + '.secondaryTargetVector', 0, 1, 0)
+    rotation = cmds.createNode('decomposeMatrix', n=vb_name + '_Heading_DM')
+    cmds.connectAttr(heading + '.outputMatrix', rotation + '.inputMatrix')
+    cmds.connectAttr(rotation + '.outputRotate', group + '.rotate')
+
+    # travel = the path distance + the body controller's own travel in the path group
+    travel = cmds.createNode('addDoubleLinear', n=vb_name + '_PathTravel_ADL')
+    cmds.connectAttr(vb_name + '_Travel_ADL.output', travel + '.input1')
+    cmds.connectAttr(group + '.' + PATH_ATTR, travel + '.input2')
+    cmds.connectAttr(travel + '.output', body_ctrl + '.travel', f=1)
+
+    avr.select_after(group)
+    return group
+
+
+@avr.fast_step
+def update_paths():
+    # Rekey the lookup curve of every path that changed and hand a fresh copy to the vehicles following it.
+    # Returns the lookup curves that were rebuilt.
+    updated = []
+    for lookup in cmds.ls(type='animCurveUU'):
+        if not cmds.attributeQuery('pathCurve', node=lookup, exists=True):
+            continue
+        shapes = cmds.listConnections(lookup + '.pathCurve', s=1, d=0)
+        if not shapes:
+            continue  # A vehicle's copy
+        lookup, keyed = _path_table(shapes[0])
+        if not keyed:
+            continue
+
+        for info in cmds.listConnections(shapes[0] + '.worldSpace[0]', s=0, d=1, type='pointOnCurveInfo') or []:
+            copies = cmds.listConnections(info + '.parameter', s=1, d=0, type='animCurveUU')
+            if not copies or not cmds.attributeQuery('pathCurve', node=copies[0], exists=True):
+                continue  # Not a vehicle following the path
+            copy = copies[0]
+            distance = cmds.listConnections(copy + '.input', s=1, d=0, p=1)[0]
+            cmds.delete(copy)
+            _follow(lookup, copy, distance, info)
+        updated.append(lookup)
+    return updated
@@ -0,0 +1,331 @@
+# -*- coding: UTF-8 -*-
+# Rig definitions: everything needed to rebuild a vehicle rig in one call, as plain JSON.
+#
+#   {
+#     "version": 1,
+#     "vehicle": "VehicleBody", "axles": [["Wheel_FL", "Wheel_FR"], ["Wheel_BL", "Wheel_BR"]],
+#     "parts": {"VehicleBody": ["body_geo", ...], "Wheel_FL": ["tire_fl_geo", "rim_fl_geo"], ...},
+#     "prefix": "", "suffix": "_Jnt", "pivot": "world",
+#     "bind": "skin", "constraint": "constraint", "auto_spin": false, "combine": false,
+#     "joints": {"VehicleBody": [16 floats], "Wheel_FL": [16 floats], ...},
+#     "radius": {"Wheel_FL": 35.0, ...},
+#     "bounds": {"VehicleBody": [xmin, ymin, zmin, xmax, ymax, zmax], ...}
+#   }
+#
+# "joints" holds world matrices, "radius" the measured wheel radii if the joints were fitted and "bounds"
+# the world bounding box of every part at rest. record_rig() reads a finished rig, build_rig() replays a
+# definition on ungrouped meshes and update_rig() brings a rig up to date after some of its meshes changed.
+# The definition of a rig is also kept on its body joint in the 'avrRig' attribute.
+# Only "vehicle", "axles" and "parts" are required, the options fall back to the UI defaults and joints
+# without a recorded matrix are snapped onto their parts. "parts" always lists the original meshes, with
+# "combine" they are merged per material again when the definition is replayed.
+import AutoVehicleRig.AVR_Base as avr
+import maya.cmds as cmds
+import maya.OpenMaya as om
+import json
+import math
+
+
+VERSION = 1
+RIG_ATTR = 'avrRig'
+
+# What a definition falls back to for anything it leaves out
+DEFAULTS = {'version': VERSION, 'prefix': '', 'suffix': '_Jnt', 'pivot': 'world', 'bind': 'skin',
+            'constraint': 'constraint', 'auto_spin': False, 'combine': False, 'joints': {}, 'radius': {},
+            'bounds': {}}
+
+# Wheels whose centre moved less than this are not re-placed
+PLACEMENT_TOLERANCE = 1e-3
+
+
+def _body_joint(definition):
+    return definition['prefix'] + definition['vehicle'] + definition['suffix']
+
+
+def _rest_bounds(name):
+    # World bounds of a part as modelled: skinned meshes are measured on their undeformed input shape
+    shapes = cmds.ls(name, dag=1, et='mesh', l=1)
+    if not shapes:
+        return None
+
+    inputs = set(cmds.ls(name, dag=1, et='mesh', io=1, l=1))
+    deformed = set(shape.rsplit('|', 1)[0] for shape in inputs)
+    return cmds.exactWorldBoundingBox([shape for shape in shapes
+                                       if shape in inputs or shape.rsplit('|', 1)[0] not in deformed])
+
+
+def _moved(bounds, recorded):
+    # Whether a part's rest bounds differ from the recorded ones, e.g. after it was remodelled in place
+    return bool(bounds and recorded) and max(abs(value - old) for value, old in zip(bounds, recorded)) > \
+        PLACEMENT_TOLERANCE
+
+
+def _at_rest(jnt, rest):
+    return max(abs(value - old) for value, old in zip(cmds.getAttr(jnt + '.worldMatrix[0]'), rest)) <= \
+        PLACEMENT_TOLERANCE
+
+
+def record_rig(vb_name, axles, prefix='', suffix='_Jnt', pivot='world', bind='skin', constraint='constraint',
+               auto_spin=False, combine=False):
+    names = [vb_name] + avr.wheel_names(axles)
+    definition = {'version': VERSION, 'vehicle': vb_name, 'axles': [list(axle) for axle in axles],
+                  'prefix': prefix, 'suffix': suffix, 'pivot': pivot,
+                  'bind': bind, 'constraint': constraint, 'auto_spin': bool(auto_spin), 'combine': bool(combine),
+                  'parts': {}, 'joints': {}, 'radius': {}, 'bounds': {}}
+
+    for name in names:
+        jnt = prefix + name + suffix
+        if not cmds.objExists(name) or not cmds.objExists(jnt):
+            raise ValueError("'{}' or '{}' does not exist, please finish the rig first".format(name, jnt))
+        definition['parts'][name] = avr.part_pieces(name)
+        definition['joints'][name] = cmds.xform(jnt, q=1, ws=1, m=1)
+        definition['bounds'][name] = _rest_bounds(name)
+        if cmds.attributeQuery('wheelRadius', node=jnt, exists=True):
+            definition['radius'][name] = cmds.getAttr(jnt + '.wheelRadius')
+
+    return definition
+
+
+def store(definition):
+    # Keep the definition on the rig itself
+    jnt = _body_joint(definition)
+    if not cmds.attributeQuery(RIG_ATTR, node=jnt, exists=True):
+        cmds.addAttr(jnt, ln=RIG_ATTR, dt='string')
+    cmds.setAttr(jnt + '.' + RIG_ATTR, json.dumps(definition), type='string')
+
+
+def stored(vb_name, prefix='', suffix='_Jnt'):
+    jnt = prefix + vb_name + suffix
+    if not cmds.objExists(jnt) or not cmds.attributeQuery(RIG_ATTR, node=jnt, exists=True):
+        return None
+    return json.loads(cmds.getAttr(jnt + '.' + RIG_ATTR))
+
+
+def save(definition, path):
+    with open(path, 'w') as f:
+        json.dump(definition, f, indent=2)
+    return path
+
+
+def load(path):
+    with open(path) as f:
+        definition = json.load(f)
+    if definition.get('version', 0) > VERSION:
+        raise ValueError("'{}' was written by a newer Auto Vehicle Rig".format(path))
+    return definition
+
+
+@avr.fast_step
+def build_rig(definition):
+    # The whole of Step1 to Step3 in one go, without any file import
+    definition = dict(DEFAULTS, **definition)
+    vb_name, axles = definition['vehicle'], definition['axles']
+    prefix, suffix = definition['prefix'], definition['suffix']
+
+    for name in [vb_name] + avr.wheel_names(axles):
+        if cmds.objExists(name):
+            continue  # Already grouped, e.g. when replaying on top of an earlier Step1
+
+        members = cmds.ls(definition['parts'][name])
+        missing = set(definition['parts'][name]) - set(members)
+        if missing:
+            om.MGlobal.displayWarning("Missing meshes for '{}': {}".format(name, ', '.join(sorted(missing))))
+        if not members:
+            raise ValueError("None of the meshes of '{}' exist in this scene".format(name))
+
+        if name == vb_name and definition['pivot'] == 'world':
+            avr.rename_group_model_world(name, objects=members, combine=definition['combine'])
+        else:
+            avr.rename_group_model_object(name, objects=members, combine=definition['combine'])
+
+    # Without recorded joints, every joint is snapped onto its part like Step2 does
+    placements = {name: avr.to_mmatrix(matrix) for name, matrix in definition['joints'].items()}
+    joints = avr.place_joints(vb_name, axles, prefix, suffix, placements or None)
+    if not placements:
+        definition['joints'] = {}
+        for name, jnt in zip([vb_name] + avr.wheel_names(axles), joints):
+            avr.snap_joint([jnt, name])
+            definition['joints'][name] = cmds.xform(jnt, q=1, ws=1, m=1)
+    for name, value in definition.get('radius', {}).items():
+        jnt = prefix + name + suffix
+        if not cmds.attributeQuery('wheelRadius', node=jnt, exists=True):
+            cmds.addAttr(jnt, ln='wheelRadius', at='double', min=0)
+        cmds.setAttr(jnt + '.wheelRadius', value)
+
+    # The rest bounds of these meshes, for update_rig() to compare against later
+    definition['bounds'] = dict((name, _rest_bounds(name)) for name in [vb_name] + avr.wheel_names(axles))
+
+    avr.bind_skin(vb_name, axles, prefix, suffix, definition['bind'])
+    avr.create_controllers(vb_name, axles, prefix, suffix, definition['constraint'], definition['auto_spin'])
+    store(definition)
+
+    return joints
+
+
+@avr.fast_step
+def build_fleet(vehicles):
+    # Rig many vehicles in one scene, each in its own namespace: vehicles is a list of (namespace, definition).
+    # Part meshes are looked up inside the namespace, e.g. 'body_geo' of a car referenced as 'Car01' is
+    # 'Car01:body_geo'. Controllers are built from the shape library without any import, so the cost grows
+    # linearly with the number of vehicles.
+    rigged = {}
+    for namespace, definition in vehicles:
+        with avr.vehicle_namespace(namespace):
+            rigged[namespace] = build_rig(definition)
+    return rigged
+
+
+def skinned_meshes(jnt):
+    # {mesh shape: skinCluster} of every mesh skinned to the joint, in two queries
+    clusters = cmds.listConnections(jnt + '.worldMatrix[0]', s=0, d=1, type='skinCluster')
+    if not clusters:
+        return {}
+
+    pairs = cmds.listConnections([cluster + '.outputGeometry' for cluster in clusters], s=0, d=1, sh=1, c=1) or []
+    return dict((pairs[index + 1], pairs[index].split('.', 1)[0]) for index in range(0, len(pairs), 2))
+
+
+def _detach_rigid(group):
+    # Undo attach_rigid, putting the group back at rest. Parented groups (before Maya 2020) stay put.
+    if not cmds.attributeQuery('offsetParentMatrix', node=group, exists=True):
+        return False
+
+    mult = cmds.listConnections(group + '.offsetParentMatrix', s=1, d=0, type='multMatrix')
+    if mult:
+        cmds.delete(mult)
+    cmds.setAttr(group + '.offsetParentMatrix', avr.to_list(om.MMatrix()), type='matrix')
+    return True
+
+
+def _add_meshes(name, meshes):
+    # Step1 for meshes joining an existing part group: history deleted and transforms frozen
+    candidates = avr.ancestor_paths(meshes)
+    items = cmds.parent(meshes, name)
+    cmds.delete(items, ch=1)
+    cmds.makeIdentity(items, a=1, n=0, pn=1)
+    avr.delete_empty_groups(candidates)
+
+
+def _shift_controller(ctrl, delta):
+    # Move the controller through its offsetParentMatrix, so its own channels and keys stay untouched
+    if not cmds.attributeQuery('offsetParentMatrix', node=ctrl, exists=True):
+        cmds.move(delta[0], delta[1], delta[2], ctrl, r=1)
+        return
+
+    shift = om.MTransformationMatrix()
+    shift.setTranslation(om.MVector(*delta), om.MSpace.kTransform)
+    offset = avr.to_mmatrix(cmds.getAttr(ctrl + '.offsetParentMatrix')) * shift.asMatrix()
+    cmds.setAttr(ctrl + '.offsetParentMatrix', avr.to_list(offset), type='matrix')
+
+    # The auto spin group turns around the wheel centre
+    spin = ctrl + '_Spin'
+    if cmds.objExists(spin):
+        pivot = [value + move for value, move in zip(cmds.getAttr(spin + '.rotatePivot')[0], delta)]
+        cmds.setAttr(spin + '.rotatePivot', *pivot)
+        cmds.setAttr(spin + '.scalePivot', *pivot)
+
+
+def _is_driven(jnt, constraint):
+    if constraint == 'matrix' and cmds.attributeQuery('offsetParentMatrix', node=jnt, exists=True):
+        return bool(cmds.listConnections(jnt + '.offsetParentMatrix', s=1, d=0))
+    return bool(cmds.listRelatives(jnt, type=['pointConstraint', 'orientConstraint']))
+
+
+@avr.fast_step
+def update_rig(vb_name, prefix='', suffix='_Jnt', parts=None):
+    # Compare the parts of a rig with its recorded definition and only touch what changed:
+    # new meshes are bound, wheels whose meshes moved are re-placed together with their controllers,
+    # and joints that lost their constraints are constrained again. Controllers and their animation
+    # are kept, so no controller is imported again.
+    # parts: optional {part name: [meshes]} to add to the part groups first, e.g. a re-imported wheel.
+    definition = stored(vb_name, prefix, suffix)
+    if definition is None:
+        raise ValueError("'{}' has no recorded rig, please create its controllers with Auto Vehicle Rig first"
+                         .format(prefix + vb_name + suffix))
+
+    names = [vb_name] + avr.wheel_names(definition['axles'])
+    parts = dict((name, cmds.ls(meshes) if meshes else []) for name, meshes in (parts or {}).items())
+    unknown = set(parts) - set(names)
+    if unknown:
+        raise ValueError('Not a part of this rig: {}'.format(', '.join(sorted(unknown))))
+
+    rigid = definition['bind'] == 'rigid'
+    detached = set()
+    for name in names:
+        if rigid and parts.get(name) and _detach_rigid(name):
+            detached.add(name)  # Back at rest before new meshes are parented under it
+        if parts.get(name):
+            _add_meshes(name, parts[name])
+
+    # A part changed when its meshes differ from the recorded ones, some are not skinned yet, or its rest
+    # bounds moved because it was remodelled or moved in place. Rigid parts only sit at rest while their
+    # joint does, otherwise they are detached to be measured.
+    changed = {}
+    for name in names:
+        jnt = prefix + name + suffix
+        if rigid and name not in detached and not _at_rest(jnt, definition['joints'][name]) and \
+                _detach_rigid(name):
+            detached.add(name)
+        members = avr.part_pieces(name)
+        skinned = {} if rigid else skinned_meshes(jnt)
+        unbound = [] if rigid else [mesh for mesh in cmds.ls(name, dag=1, et='mesh', ni=1) if mesh not in skinned]
+        if unbound or set(members) != set(definition['parts'][name]) or \
+                _moved(_rest_bounds(name), definition.get('bounds', {}).get(name)):
+            changed[name] = (skinned, unbound)
+            definition['parts'][name] = members
+        elif name in detached:
+            avr.attach_rigid(name, jnt, avr.to_mmatrix(definition['joints'][name]))
+            detached.discard(name)
+
+    report = {'rebound': [], 'replaced': [], 'reconstrained': []}
+    for name in names:
+        if name not in changed:
+            continue
+
+        jnt = prefix + name + suffix
+        if rigid and name not in detached and _detach_rigid(name):
+            detached.add(name)
+
+        # Wheels follow their meshes, the body joint carries the whole rig and stays where it is
+        bounds = _rest_bounds(name)
+        recorded = definition.get('bounds', {}).get(name)
+        rest = definition['joints'][name]
+        if name != vb_name and bounds and recorded and (not rigid or name in detached):
+            delta = [(bounds[axis] + bounds[axis + 3] - recorded[axis] - recorded[axis + 3]) / 2.0
+                     for axis in range(3)]
+            if max(abs(value) for value in delta) > PLACEMENT_TOLERANCE:
+                _shift_controller(name + '_Ctrl', delta)
+                rest = rest[:12] + [value + offset for value, offset in zip(rest[12:15], delta)] + rest[15:]
+                definition['joints'][name] = rest
+                report['replaced'].append(jnt)
+
+            if name in definition.get('radius', {}):
+                definition['radius'][name] = (bounds[4] - bounds[1]) / 2.0
+                cmds.setAttr(jnt + '.wheelRadius', definition['radius'][name])
+            if cmds.objExists(name + '_Spin_MDL'):
+                cmds.setAttr(name + '_Spin_MDL.input2', -180.0 / (math.pi * avr.wheel_radius(name, prefix, suffix)))
+        definition.setdefault('bounds', {})[name] = bounds
+
+        # Bind against the rest pose of the joint, whatever frame the scene is on
+        rest_inverse = avr.to_list(avr.to_mmatrix(rest).inverse())
+        if rigid:
+            if name in detached:
+                avr.attach_rigid(name, jnt, avr.to_mmatrix(rest))
+        else:
+            skinned, unbound = changed[name]
+            if jnt in report['replaced']:
+                for cluster in set(skinned.values()):
+                    cmds.setAttr(cluster + '.bindPreMatrix[0]', rest_inverse, type='matrix')
+            for mesh in unbound:
+                cluster = cmds.skinCluster(jnt, mesh, tsb=1)[0]
+                cmds.setAttr(cluster + '.bindPreMatrix[0]', rest_inverse, type='matrix')
+        report['rebound'].append(jnt)
+
+    for name in names:
+        jnt = prefix + name + suffix
+        if not _is_driven(jnt, definition['constraint']) and cmds.objExists(name + '_Ctrl'):
+            avr.constrain(name + '_Ctrl', jnt, definition['constraint'])
+            report['reconstrained'].append(jnt)
+
+    store(definition)
+    return report
@@ -0,0 +1,160 @@
+# -*- coding: UTF-8 -*-
+# Per-step profiling of the rig build: wall time and Maya command counts for every rig step and the
+# sub-steps inside it, exported as JSON or as a Chrome trace (open it in chrome://tracing or Perfetto).
+#
+# Turn it on from the UI, with enable(), or for batch runs by setting the AVR_PROFILE environment variable
+# to 1 (profiles go into the batch report) or to a directory (one '<scene>.trace.json' per scene as well).
+# When profiling is off a section costs one dictionary lookup.
+#
+# Command counts cover maya.cmds only. OpenMaya work (MDGModifier edits, mesh reads, the terrain and cache
+# bakes) is in a section's time but not in its counts, so a slow section with few commands is spending its
+# time in the API or in numpy.
+import maya.cmds as cmds
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+
+
+PROFILE_ENV = 'AVR_PROFILE'
+
+# Open sections innermost last, finished sections in the order they ended
+_STATE = {'enabled': False, 'stack': [], 'events': []}
+
+
+class _CountingCmds(object):
+    # Stands in for maya.cmds inside the AVR modules and counts every command run by an open section
+
+    def __init__(self, module):
+        self._module = module
+        self._wrapped = {}
+
+    def __getattr__(self, name):
+        func = getattr(self._module, name)
+        if not callable(func):
+            return func
+
+        if name not in self._wrapped:
+            @functools.wraps(func)
+            def wrapped(*args, **kwargs):
+                for event in _STATE['stack']:
+                    event['commands'][name] = event['commands'].get(name, 0) + 1
+                return func(*args, **kwargs)
+            self._wrapped[name] = wrapped
+        return self._wrapped[name]
+
+
+def _avr_modules():
+    # Every AVR module using maya.cmds except this one
+    return [module for name, module in list(sys.modules.items())
+            if module is not None and name.startswith('AutoVehicleRig.') and name != __name__
+            and hasattr(module, 'cmds')]
+
+
+def _patch():
+    # Modules imported after enable() are picked up by the next top level section
+    for module in _avr_modules():
+        if module.cmds is cmds:
+            module.cmds = _CountingCmds(cmds)
+
+
+def enabled():
+    return _STATE['enabled']
+
+
+def enable():
+    _STATE['enabled'] = True
+    _patch()
+
+
+def disable():
+    _STATE['enabled'] = False
+    for module in _avr_modules():
+        if isinstance(module.cmds, _CountingCmds):
+            module.cmds = cmds
+
+
+def reset():
+    del _STATE['events'][:]
+
+
+@contextlib.contextmanager
+def section(name):
+    if not _STATE['enabled']:
+        yield
+        return
+
+    stack = _STATE['stack']
+    if not stack:
+        _patch()
+
+    event = {'name': name, 'start': time.time(), 'duration': 0.0, 'depth': len(stack), 'commands': {}}
+    stack.append(event)
+    try:
+        yield
+    finally:
+        event['duration'] = time.time() - event['start']
+        stack.remove(event)
+        _STATE['events'].append(event)
+
+
+def events():
+    return sorted(_STATE['events'], key=lambda event: (event['start'], event['depth']))
+
+
+def report():
+    # Every section in start order, plus totals per section name. Command counts include sub-sections.
+    recorded = events()
+    origin = recorded[0]['start'] if recorded else 0.0
+
+    steps = {}
+    for event in recorded:
+        step = steps.setdefault(event['name'], {'calls': 0, 'time': 0.0, 'commands': {}})
+        step['calls'] += 1
+        step['time'] += event['duration']
+        for command, count in event['commands'].items():
+            step['commands'][command] = step['commands'].get(command, 0) + count
+
+    return {'events': [dict(event, start=event['start'] - origin) for event in recorded],
+            'steps': steps,
+            'total': sum(event['duration'] for event in recorded if event['depth'] == 0)}
+
+
+def chrome_trace():
+    recorded = events()
+    origin = recorded[0]['start'] if recorded else 0.0
+    pid = os.getpid()
+
+    trace = []
+    for event in recorded:
+        args = dict(event['commands'])
+        args['totalCommands'] = sum(event['commands'].values())
+        trace.append({'name': event['name'], 'cat': 'AVR', 'ph': 'X', 'pid': pid, 'tid': 0,
+                      'ts': (event['start'] - origin) * 1e6, 'dur': event['duration'] * 1e6, 'args': args})
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+def export(path, trace=None):
+    # trace defaults to True for '*.trace.json' files
+    if trace is None:
+        trace = path.lower().endswith('.trace.json')
+
+    with open(path, 'w') as f:
+        json.dump(chrome_trace() if trace else report(), f, indent=None if trace else 2)
+    return path
+
+
+def summary():
+    # One line per section name, slowest first, for the script editor. Commands are maya.cmds calls only.
+    steps = report()['steps']
+    lines = []
+    for name, step in sorted(steps.items(), key=lambda item: -item[1]['time']):
+        lines.append('{:<28} {:>4}x {:>9.3f}s {:>7} commands'.format(
+            name, step['calls'], step['time'], sum(step['commands'].values())))
+    return '\n'.join(lines)
+
+
+if os.environ.get(PROFILE_ENV, '') not in ('', '0'):
+    enable()
@@ -0,0 +1,132 @@
+# -*- coding: UTF-8 -*-
+# Proxy geometry: one light stand-in mesh per part group, for animating heavy vehicles interactively.
+# 'box' proxies are a box around every mesh of the part, leaving out meshes smaller than MIN_SIZE of the
+# part; 'reduce' proxies are the part's meshes combined and decimated. Both are built from the rest shape
+# of every mesh, so the current pose of the rig does not matter.
+#
+# A proxy is bound like its part: skinned to the part's joint, or placed in the part group that follows
+# the joint for rigid parts. The 'proxy' attribute on the body controller shows either the proxies or
+# the full meshes. With the proxies shown, the skinClusters of the full meshes are blocked (nodeState 2),
+# so the hidden meshes are not deformed at all until the full meshes are shown again.
+import AutoVehicleRig.AVR_Base as avr
+import AutoVehicleRig.AVR_Preset as avr_preset
+import maya.cmds as cmds
+
+
+PROXY_ATTR = 'proxy'
+PROXY_MODES = ('box', 'reduce')
+
+# Meshes whose bounding box diagonal is below this fraction of the part's get no box of their own
+MIN_SIZE = 0.02
+
+
+def _rest_shapes(name):
+    # [(mesh transform, shape holding its rest geometry)], the skinCluster input shape for skinned meshes
+    inputs = dict((shape.rsplit('|', 1)[0], shape) for shape in cmds.ls(name, dag=1, et='mesh', io=1, l=1))
+    return [(shape.rsplit('|', 1)[0], inputs.get(shape.rsplit('|', 1)[0], shape))
+            for shape in cmds.ls(name, dag=1, et='mesh', ni=1, l=1)]
+
+
+def _diagonal(box):
+    return sum((high - low) ** 2 for low, high in box) ** 0.5
+
+
+def _box_pieces(name, shapes):
+    # One box per mesh, in rest space, skipping the small ones
+    boxes = [cmds.polyEvaluate(shape, b=1) for _, shape in shapes]
+    part = [(min(box[axis][0] for box in boxes), max(box[axis][1] for box in boxes)) for axis in range(3)]
+    smallest = _diagonal(part) * MIN_SIZE
+    kept = [box for box in boxes if _diagonal(box) >= smallest] or [max(boxes, key=_diagonal)]
+
+    pieces = []
+    for index, box in enumerate(kept):
+        size = [high - low for low, high in box]
+        piece = cmds.polyCube(w=size[0], h=size[1], d=size[2], n='{}_Proxy{}'.format(name, index), ch=0)[0]
+        cmds.move((box[0][0] + box[0][1]) / 2, (box[1][0] + box[1][1]) / 2, (box[2][0] + box[2][1]) / 2, piece)
+        pieces.append(piece)
+    return pieces
+
+
+def _mesh_pieces(name, shapes):
+    # A copy of every mesh, fed by its rest shape until the history is deleted
+    pieces = []
+    for index, (_, shape) in enumerate(shapes):
+        piece = cmds.createNode('transform', n='{}_Proxy{}'.format(name, index))
+        mesh = cmds.createNode('mesh', n='{}_Proxy{}Shape'.format(name, index), p=piece)
+        cmds.connectAttr(shape + '.outMesh', mesh + '.inMesh')
+        pieces.append(piece)
+    return pieces
+
+
+def _switch_nodes(vb_name, body_ctrl):
+    # The proxy attribute and the nodes it drives: a reverse for the full meshes' visibility and
+    # 0 or 2 for the nodeState of their skinClusters
+    if cmds.attributeQuery(PROXY_ATTR, node=body_ctrl, exists=True):
+        return vb_name + '_Proxy_Rev', vb_name + '_Proxy_State'
+
+    cmds.addAttr(body_ctrl, ln=PROXY_ATTR, at='bool', dv=1, k=1)
+    reverse = cmds.createNode('reverse', n=vb_name + '_Proxy_Rev')
+    cmds.connectAttr(body_ctrl + '.' + PROXY_ATTR, reverse + '.inputX')
+    state = cmds.createNode('multDoubleLinear', n=vb_name + '_Proxy_State')
+    cmds.connectAttr(body_ctrl + '.' + PROXY_ATTR, state + '.input1')
+    cmds.setAttr(state + '.input2', 2)
+    return reverse, state
+
+
+@avr.fast_step
+def create_proxies(vb_name, axles, prefix='', suffix='_Jnt', mode='box', reduction=90):
+    # Build or rebuild the proxy of every part group and the proxy switch on the body controller.
+    # reduction: percentage of faces polyReduce removes in 'reduce' mode
+    if mode not in PROXY_MODES:
+        raise ValueError("Unknown proxy mode '{}'".format(mode))
+    body_ctrl = vb_name + '_Ctrl'
+    if not cmds.objExists(body_ctrl):
+        raise ValueError("'{}' does not exist, please create the controllers first".format(body_ctrl))
+
+    reverse, state = _switch_nodes(vb_name, body_ctrl)
+    definition = avr_preset.stored(vb_name, prefix, suffix)
+    proxies = {}
+    for name in [vb_name] + avr.wheel_names(axles):
+        proxy = name + '_Proxy'
+        if cmds.objExists(proxy):
+            cmds.delete(proxy)
+
+        shapes = _rest_shapes(name)
+        if not shapes:
+            continue
+        pieces = (_box_pieces if mode == 'box' else _mesh_pieces)(name, shapes)
+
+        if len(pieces) > 1:
+            proxy = cmds.polyUnite(pieces, n=proxy, ch=0)[0]
+            leftovers = cmds.ls(pieces)
+            if leftovers:
+                cmds.delete(leftovers)
+        else:
+            proxy = cmds.rename(pieces[0], proxy)
+        if mode == 'reduce':
+            cmds.polyReduce(proxy, p=reduction, ch=1)
+        cmds.delete(proxy, ch=1)
+
+        # Bound like the part: skinned to its joint, or carried by the rigid part group
+        jnt = prefix + name + suffix
+        proxy = cmds.parent(proxy, name, r=1)[0]
+        clusters = set(avr_preset.skinned_meshes(jnt).values())
+        if clusters:
+            # Bound at the rest pose like the full meshes, whatever frame the scene is on
+            rest = definition['joints'].get(name) if definition else None
+            rest_inverse = avr.to_list(avr.to_mmatrix(rest).inverse()) if rest else \
+                cmds.getAttr(sorted(clusters)[0] + '.bindPreMatrix[0]')
+            cluster = cmds.skinCluster(jnt, proxy, tsb=1)[0]
+            cmds.setAttr(cluster + '.bindPreMatrix[0]', rest_inverse, type='matrix')
+        cmds.setAttr(proxy + '.overrideEnabled', 1)
+        cmds.setAttr(proxy + '.overrideDisplayType', 2)  # Reference, so clicks go to the controllers
+
+        cmds.connectAttr(body_ctrl + '.' + PROXY_ATTR, proxy + '.visibility', f=1)
+        for transform, _ in shapes:
+            cmds.connectAttr(reverse + '.outputX', transform + '.visibility', f=1)
+        for cluster in clusters:
+            cmds.connectAttr(state + '.output', cluster + '.nodeState', f=1)
+        proxies[name] = proxy
+
+    avr.select_after(body_ctrl)
+    return proxies
@@ -0,0 +1,178 @@
+# -*- coding: UTF-8 -*-
+# Replicate a finished rig for crowd traffic: every copy gets its own joints and controllers in its own
+# namespace, while the mesh shapes are shared with the source through instancing.
+#
+# An instanced shape cannot carry a skinCluster per copy, so copies are always bound rigidly: each part group
+# follows its joint through offsetParentMatrix, which is exact for a vehicle's rigid parts. A rigidly bound
+# source shares its own shapes. A skinned source gets one undeformed mesh per skinned mesh, fed by the
+# skinCluster's input shape and kept in the hidden '<body>_Instances' group, which every copy shares. Either
+# way 200 copies cost about one car of geometry, not 200.
+import AutoVehicleRig.AVR_Base as avr
+import AutoVehicleRig.AVR_Preset as avr_preset
+import maya.cmds as cmds
+import maya.OpenMaya as om
+
+
+# Copies are spaced this many body widths apart along Z by default
+SPACING = 1.5
+
+
+def _short(name):
+    # Node name without its DAG path and namespace
+    return name.rsplit('|', 1)[-1].rsplit(':', 1)[-1]
+
+
+def _instance_sources(vb_name, names):
+    # Part name -> [(shape to instance, source shape)], plus the shading group of every source shape
+    library = vb_name + '_Instances'
+    sources = {}
+    for name in names:
+        inputs = dict((shape.rsplit('|', 1)[0], shape) for shape in cmds.ls(name, dag=1, et='mesh', io=1, l=1))
+
+        sources[name] = []
+        for shape in cmds.ls(name, dag=1, et='mesh', ni=1, l=1):
+            transform = shape.rsplit('|', 1)[0]
+            if transform not in inputs:
+                sources[name].append((shape, shape))  # Rigid: the mesh itself
+                continue
+
+            # Skinned: an undeformed mesh fed by the skinCluster's input shape, built once per source
+            mesh = '{0}|{1}_Inst|{1}_InstShape'.format(library, _short(transform))
+            if not cmds.objExists(mesh):
+                if not cmds.objExists(library):
+                    cmds.createNode('transform', n=library)
+                    cmds.setAttr(library + '.visibility', 0)
+                grp = cmds.createNode('transform', n=_short(transform) + '_Inst', p=library)
+                mesh = cmds.createNode('mesh', n=_short(transform) + '_InstShape', p=grp)
+                cmds.connectAttr(inputs[transform] + '.outMesh', mesh + '.inMesh')
+            sources[name].append((mesh, shape))
+
+    # [(shading group, faces or None for the whole mesh)] of the source instance of every shape, looked up
+    # once and reused by every copy. Per-face assignments go through instObjGroups[0].objectGroups[n].
+    shading = {}
+    for shape in [shape for items in sources.values() for _, shape in items]:
+        connections = cmds.listConnections(shape + '.instObjGroups', s=0, d=1, type='shadingEngine', c=1) or []
+        for plug, engine in zip(connections[::2], connections[1::2]):
+            attr = plug.split('.', 1)[1]
+            if not attr.startswith('instObjGroups[0]'):
+                continue  # Another instance, e.g. an earlier copy of a rigidly bound source
+            faces = cmds.getAttr(shape + '.' + attr + '.objectGrpCompList') if '.objectGroups[' in attr else None
+            shading.setdefault(shape, []).append((engine, faces))
+    return sources, shading
+
+
+def _variant_engine(namespace, variant):
+    # A shading group for a copy's body: an existing shading group or material, or an (r, g, b) colour
+    if not isinstance(variant, (list, tuple)):
+        if cmds.nodeType(variant) == 'shadingEngine':
+            return variant
+        engines = cmds.listConnections(variant + '.outColor', s=0, d=1, type='shadingEngine')
+        if engines:
+            return engines[0]
+        material = variant
+    else:
+        material = cmds.shadingNode('lambert', asShader=True, n='{}:Paint_Mtl'.format(namespace))
+        cmds.setAttr(material + '.color', *variant, type='double3')
+
+    engine = cmds.sets(renderable=True, noSurfaceShader=True, empty=True, n='{}:Paint_SG'.format(namespace))
+    cmds.connectAttr(material + '.outColor', engine + '.surfaceShader')
+    return engine
+
+
+def _offset_matrix(matrix, offset):
+    return matrix[:12] + [value + move for value, move in zip(matrix[12:15], offset)] + matrix[15:]
+
+
+def _replicate(definition, prefix, suffix, parts, shading, namespace, offset, variant):
+    # One copy: parts is a list of (part name, [(shape to instance, source shape)])
+    body, axles = definition['vehicle'], definition['axles']
+    cmds.namespace(add=namespace, parent=':')
+
+    # Part groups holding instances of the source shapes, at the offset of this copy. Step1 froze every
+    # transform below a part group, so the instances sit directly under it with identity transforms.
+    engines, painted = {}, []
+    for name, shapes in parts:
+        grp = cmds.createNode('transform', n='{}:{}'.format(namespace, name))
+        cmds.setAttr(grp + '.translate', *offset)
+        for shape, original in shapes:
+            transform = cmds.createNode('transform', p=grp,
+                                        n='{}:{}'.format(namespace, _short(original.rsplit('|', 1)[0])))
+            cmds.parent(shape, transform, add=True, shape=True)
+            if variant is not None and name == body:
+                painted.append(transform)
+            else:
+                for engine, faces in shading.get(original, []):
+                    members = [transform + '.' + face for face in faces] if faces else [transform]
+                    engines.setdefault(engine, []).extend(members)
+
+    if painted:
+        engines.setdefault(_variant_engine(namespace, variant), []).extend(painted)
+    for engine, members in engines.items():
+        cmds.sets(members, e=True, forceElement=engine)
+
+    # The rig of the copy, at rest on the offset placement
+    with avr.vehicle_namespace(namespace):
+        placements = dict((name, avr.to_mmatrix(_offset_matrix(definition['joints'][name], offset)))
+                          for name, _ in parts)
+        joints = avr.create_joints(body, axles, prefix, suffix, placements)
+        for name, value in definition.get('radius', {}).items():
+            cmds.addAttr(prefix + name + suffix, ln='wheelRadius', at='double', min=0)
+            cmds.setAttr(prefix + name + suffix + '.wheelRadius', value)
+        for name, _ in parts:
+            avr.attach_rigid(name, prefix + name + suffix, placements[name])
+        avr.create_controllers(body, axles, prefix, suffix, definition['constraint'], definition['auto_spin'])
+    return joints
+
+
+@avr.fast_step
+def replicate_rig(vb_name, count, prefix='', suffix='_Jnt', namespaces=None, offsets=None, variants=None):
+    # Make count copies of a rig built by Auto Vehicle Rig, each with its own joints and controllers.
+    # namespaces: one new namespace per copy, by default the next free '<body>_Copy01', '<body>_Copy02'...
+    # offsets   : world offset of each copy, side by side along Z by default
+    # variants  : shading groups, materials or (r, g, b) colours for the body meshes, cycled over the copies.
+    #             None keeps the source shading for that copy.
+    definition = avr_preset.stored(vb_name, prefix, suffix)
+    if definition is None:
+        raise ValueError("'{}' has no recorded rig, please create its controllers with Auto Vehicle Rig first"
+                         .format(prefix + vb_name + suffix))
+    definition = dict(avr_preset.DEFAULTS, **definition)
+
+    # Source parts keep the namespace of the given body, copies use the plain part names
+    source_namespace = vb_name.rpartition(':')[0]
+    body = definition['vehicle']
+    names = [body] + avr.wheel_names(definition['axles'])
+    source_names = [source_namespace + ':' + name if source_namespace else name for name in names]
+
+    # A copy into an existing namespace would clash with the nodes already there
+    if namespaces:
+        namespaces = namespaces[:count]
+        numbers = range(1, len(namespaces) + 1)
+        if len(namespaces) < count:
+            om.MGlobal.displayWarning('Only {} namespaces given for {} copies'.format(len(namespaces), count))
+        if len(set(namespaces)) < len(namespaces):
+            raise ValueError('Every copy needs its own namespace')
+        used = [namespace for namespace in namespaces if cmds.namespace(exists=':' + namespace)]
+        if used:
+            raise ValueError("Namespace '{}' is already in use, please pick a new one".format(used[0]))
+    else:
+        # Further copies are numbered, and placed, after the ones already made
+        namespaces, numbers, number = [], [], 0
+        while len(namespaces) < count:
+            number += 1
+            namespace = '{}_Copy{:02d}'.format(body, number)
+            if not cmds.namespace(exists=':' + namespace):
+                namespaces.append(namespace)
+                numbers.append(number)
+    if not offsets:
+        bounds = definition['bounds'].get(body) or cmds.exactWorldBoundingBox(source_names[0])
+        width = (bounds[5] - bounds[2]) * SPACING
+        offsets = [(0.0, 0.0, width * number) for number in numbers]
+
+    sources, shading = _instance_sources(source_names[0], source_names)
+    parts = [(name, sources[source_name]) for name, source_name in zip(names, source_names)]
+
+    copies = {}
+    for index, namespace in enumerate(namespaces):
+        variant = variants[index % len(variants)] if variants else None
+        copies[namespace] = _replicate(definition, prefix, suffix, parts, shading, namespace, offsets[index], variant)
+    return copies
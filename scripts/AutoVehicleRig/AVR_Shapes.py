@@ -0,0 +1,143 @@
+# -*- coding: UTF-8 -*-
+# Controller shape library. Controllers are NURBS curves stored as plain data and built with one curve
+# command each, so creating them takes no file import and no FBX plug-in, in the UI or in batch.
+#
+# A shape is a JSON file named after it, '<shape>.json', holding its curves in Maya's own terms:
+#
+#   {"curves": [
+#     {"degree": 3, "periodic": true, "cvs": [[x, y, z], ...], "knots": [-2.0, -1.0, 0.0, ...]}
+#   ]}
+#
+# Periodic curves repeat their first 'degree' CVs at the end, exactly like the curve command expects.
+# Shapes are drawn at unit size and scaled per controller: wheel shapes have a radius of 1 around the hub
+# in the XY plane the wheel spins in, body shapes fit the square from -1 to 1 in X and Z and are stretched
+# to the body's footprint. The size is that of the drawn curve, not of its CVs, which lie outside a
+# curved shape: the shipped wheel has its CVs at 1.108 for a radius of 1.
+#
+# The shapes shipped with the tool are in the 'shapes' folder next to this module. Folders listed in the
+# AVR_SHAPES environment variable are searched first, so a studio can add its own shapes or replace the
+# shipped 'body' and 'wheel' ones. save_shape() writes a curve drawn in the scene to such a folder.
+# Shapes are read once per session, reload_shapes() picks up edited files.
+import maya.cmds as cmds
+import maya.OpenMaya as om
+import json
+import os
+
+
+SHAPES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shapes')
+SHAPES_ENV = 'AVR_SHAPES'
+# Points per span measured along a curve to find its drawn size
+SAMPLES_PER_SPAN = 8
+
+# {shape name: [curve]}, filled as shapes are first used
+_SHAPES = {}
+
+
+def _directories():
+    # User folders first, then the shipped shapes
+    user = [path for path in os.environ.get(SHAPES_ENV, '').split(os.pathsep) if path]
+    return user + [SHAPES_DIR]
+
+
+def shape_names():
+    # Every shape that can be built, user shapes included
+    names = set(_SHAPES)
+    for directory in _directories():
+        if os.path.isdir(directory):
+            names.update(os.path.splitext(name)[0] for name in os.listdir(directory) if name.endswith('.json'))
+    return sorted(names)
+
+
+def load_shape(name):
+    # The curves of a shape, read from the first folder that has it and cached for the session
+    if name not in _SHAPES:
+        for directory in _directories():
+            path = os.path.join(directory, name + '.json')
+            if os.path.isfile(path):
+                with open(path) as f:
+                    _SHAPES[name] = json.load(f)['curves']
+                break
+        else:
+            raise ValueError("No controller shape called '{}'".format(name))
+    return _SHAPES[name]
+
+
+def reload_shapes():
+    _SHAPES.clear()
+
+
+def create_shape(name, node_name, scale=(1.0, 1.0, 1.0)):
+    # A transform with the curves of a shape, scaled per axis in the CVs so the controller has no scale
+    transform = None
+    for index, curve in enumerate(load_shape(name)):
+        points = [[value * factor for value, factor in zip(cv, scale)] for cv in curve['cvs']]
+        built = cmds.curve(d=curve['degree'], p=points, k=curve['knots'], per=curve['periodic'], n=node_name)
+        if transform is None:
+            transform = built
+            continue
+
+        # Further curves become more shapes of the first transform
+        shape = cmds.parent(cmds.listRelatives(built, s=1, f=1)[0], transform, r=1, s=1)[0]
+        cmds.rename(shape, '{}Shape{}'.format(transform.rsplit('|', 1)[-1], index))
+        cmds.delete(built)
+    return transform
+
+
+def curve_fn(shape):
+    selection = om.MSelectionList()
+    selection.add(shape)
+    path = om.MDagPath()
+    selection.getDagPath(0, path)
+    return om.MFnNurbsCurve(path)
+
+
+def _drawn_size(fn):
+    # The largest coordinate of the curve itself, sampled along it in object space
+    knots = om.MDoubleArray()
+    fn.getKnots(knots)
+    degree = fn.degree()
+    start, end = knots[degree - 1], knots[knots.length() - degree]
+    count = fn.numSpans() * SAMPLES_PER_SPAN
+
+    size, point = 0.0, om.MPoint()
+    for index in range(count + 1):
+        fn.getPointAtParam(start + (end - start) * index / count, point, om.MSpace.kObject)
+        size = max(size, abs(point.x), abs(point.y), abs(point.z))
+    return size
+
+
+def save_shape(curve, name, directory=None):
+    # Write the curves of a transform in the scene as a shape, in object space and scaled to unit size.
+    # directory defaults to the first AVR_SHAPES folder. Returns the file written.
+    user = [path for path in _directories() if path != SHAPES_DIR]
+    directory = directory or (user[0] if user else None)
+    if not directory:
+        raise ValueError('Please set {} to the folder for your controller shapes'.format(SHAPES_ENV))
+    shapes = cmds.listRelatives(curve, s=1, type='nurbsCurve', ni=1, f=1)
+    if not shapes:
+        raise ValueError("'{}' has no NURBS curves".format(curve))
+
+    curves, size = [], 0.0
+    for shape in shapes:
+        fn = curve_fn(shape)
+        size = max(size, _drawn_size(fn))
+        points, knots = om.MPointArray(), om.MDoubleArray()
+        fn.getCVs(points, om.MSpace.kObject)
+        fn.getKnots(knots)
+        curves.append({'degree': fn.degree(), 'periodic': fn.form() == om.MFnNurbsCurve.kPeriodic,
+                       'cvs': [[points[index].x, points[index].y, points[index].z]
+                               for index in range(points.length())],
+                       'knots': [knots[index] for index in range(knots.length())]})
+
+    size = size or 1.0
+    for item in curves:
+        item['cvs'] = [[round(value / size, 6) for value in cv] for cv in item['cvs']]
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, name + '.json')
+    with open(path, 'w') as f:
+        # One curve per line keeps the files small and still readable in a diff
+        f.write('{"curves": [\n' + ',\n'.join(json.dumps(item) for item in curves) + '\n]}\n')
+    _SHAPES[name] = curves
+    return path
@@ -0,0 +1,153 @@
+# -*- coding: UTF-8 -*-
+# Suspension layer: per wheel travel limits, spring stiffness and rest height, with the body following the
+# average compression in height, pitch and roll. Built from utility nodes only, so it evaluates in parallel
+# and caches like the rest of the rig, and a 6-wheeler adds about 40 light nodes.
+#
+# Every wheel controller stack gets a '<wheel>_Ctrl_Susp' group on top. Its translateY is the road under
+# the wheel (key it, or drive it from anything), and its extra attributes set up the spring:
+#
+#   travel    : how far the wheel can move up into the body, beyond that the road lifts the body directly
+#   droop     : how far the wheel can hang down
+#   stiffness : the share of the spring compression that reaches the body, 0 is soft and 1 is solid
+#   restHeight: how much higher the body sits over this wheel at rest
+#
+# The body joint follows a '<body>_Susp' group under the body controller, which moves and tilts with the
+# plane through the wheel corners. The 'suspension' attribute on the body controller blends it on and off.
+# The inputs are read from groups above the wheel controllers, never from below them, so the graph has no
+# cycles for the evaluation manager to break up.
+import AutoVehicleRig.AVR_Base as avr
+import maya.cmds as cmds
+import maya.OpenMaya as om
+import math
+
+
+SUSPENSION_ATTR = 'suspension'
+
+
+def _average(name, plugs):
+    node = cmds.createNode('plusMinusAverage', n=name)
+    cmds.setAttr(node + '.operation', 3)  # Average
+    for index, plug in enumerate(plugs):
+        cmds.connectAttr(plug, '{}.input1D[{}]'.format(node, index))
+    return node + '.output1D'
+
+
+def _slope(name, high, low, distance, scale):
+    # (high - low) / distance, times scale, as an angle in degrees for small slopes
+    difference = cmds.createNode('plusMinusAverage', n=name + '_PMA')
+    cmds.setAttr(difference + '.operation', 2)  # Subtract
+    cmds.connectAttr(high, difference + '.input1D[0]')
+    cmds.connectAttr(low, difference + '.input1D[1]')
+    angle = cmds.createNode('multDoubleLinear', n=name + '_MDL')
+    cmds.connectAttr(difference + '.output1D', angle + '.input1')
+    cmds.setAttr(angle + '.input2', scale * math.degrees(1.0) / distance)
+    return angle + '.output'
+
+
+def _weighted(name, plug, weight, target):
+    node = cmds.createNode('multDoubleLinear', n=name)
+    cmds.connectAttr(plug, node + '.input1')
+    cmds.connectAttr(weight, node + '.input2')
+    cmds.connectAttr(node + '.output', target)
+
+
+def _wheel_corner(name, group, travel, droop, stiffness, rest_height):
+    # How far the body corner over this wheel rises: the road, minus the part of the compression the spring
+    # keeps from the body, plus the rest height. Beyond the travel limits the road lifts the body directly.
+    for attr, value, limits in (('travel', travel, {'min': 0}), ('droop', droop, {'min': 0}),
+                                ('stiffness', stiffness, {'min': 0, 'max': 1}), ('restHeight', rest_height, {})):
+        cmds.addAttr(group, ln=attr, at='double', dv=value, k=True, **limits)
+
+    droop_neg = cmds.createNode('multDoubleLinear', n=name + '_Droop_MDL')
+    cmds.connectAttr(group + '.droop', droop_neg + '.input1')
+    cmds.setAttr(droop_neg + '.input2', -1)
+
+    compression = cmds.createNode('clamp', n=name + '_Travel_CLP')
+    cmds.connectAttr(group + '.translateY', compression + '.inputR')
+    cmds.connectAttr(droop_neg + '.output', compression + '.minR')
+    cmds.connectAttr(group + '.travel', compression + '.maxR')
+
+    # compression * (stiffness - 1)
+    softness = cmds.createNode('addDoubleLinear', n=name + '_Softness_ADL')
+    cmds.connectAttr(group + '.stiffness', softness + '.input1')
+    cmds.setAttr(softness + '.input2', -1)
+    spring = cmds.createNode('multDoubleLinear', n=name + '_Spring_MDL')
+    cmds.connectAttr(compression + '.outputR', spring + '.input1')
+    cmds.connectAttr(softness + '.output', spring + '.input2')
+
+    corner = cmds.createNode('plusMinusAverage', n=name + '_Corner_PMA')
+    cmds.connectAttr(group + '.translateY', corner + '.input1D[0]')
+    cmds.connectAttr(spring + '.output', corner + '.input1D[1]')
+    cmds.connectAttr(group + '.restHeight', corner + '.input1D[2]')
+    return corner + '.output1D'
+
+
+def _redrive(jnt, driver):
+    # Move the joint's constraints or matrix connection from the body controller over to the driver
+    constraints = cmds.listRelatives(jnt, type=['pointConstraint', 'orientConstraint'])
+    if constraints:
+        cmds.delete(constraints)
+        avr.constrain(driver, jnt, 'constraint')
+        return
+
+    mult = cmds.listConnections(jnt + '.offsetParentMatrix', s=1, d=0, type='multMatrix')
+    if mult:
+        cmds.delete(mult)
+    avr.constrain(driver, jnt, 'matrix')
+
+
+@avr.fast_step
+def create_suspension(vb_name, axles, prefix='', suffix='_Jnt', travel=None, droop=None, stiffness=0.5,
+                      rest_height=0.0):
+    # travel and droop default to half and a quarter of each wheel's radius
+    body_ctrl = vb_name + '_Ctrl'
+    body_jnt = prefix + vb_name + suffix
+    if not cmds.objExists(body_ctrl):
+        raise ValueError("'{}' does not exist, please create the controllers first".format(body_ctrl))
+    if cmds.objExists(vb_name + '_Susp'):
+        raise ValueError("'{}' already has a suspension".format(vb_name))
+
+    cmds.addAttr(body_ctrl, ln=SUSPENSION_ATTR, at='double', min=0, max=1, dv=1, k=True)
+    weight = body_ctrl + '.' + SUSPENSION_ATTR
+
+    # Wheel corners, with the hub positions for the pitch and roll lever arms
+    corners, hubs = {}, {}
+    for name in avr.wheel_names(axles):
+        top = avr.top_under(name + '_Ctrl', body_ctrl)
+        group = avr.insert_parent(top, name + '_Ctrl_Susp')
+
+        radius = avr.wheel_radius(name, prefix, suffix)
+        corners[name] = _wheel_corner(name, group, radius * 0.5 if travel is None else travel,
+                                      radius * 0.25 if droop is None else droop, stiffness, rest_height)
+        hubs[name] = cmds.xform(prefix + name + suffix, q=1, ws=1, t=1)
+
+    # The body plane: height from the average corner, pitch from the front and rear axles, roll from the
+    # left and right wheels. The vehicle faces +X with its axles along Z.
+    body = cmds.createNode('transform', n=vb_name + '_Susp', p=body_ctrl)
+    pivot = om.MTransformationMatrix(avr.to_mmatrix(cmds.getAttr(body_jnt + '.worldMatrix[0]')) * avr.to_mmatrix(
+        cmds.getAttr(body_ctrl + '.worldInverseMatrix[0]'))).getTranslation(om.MSpace.kTransform)
+    cmds.setAttr(body + '.rotatePivot', pivot.x, pivot.y, pivot.z)
+    cmds.setAttr(body + '.scalePivot', pivot.x, pivot.y, pivot.z)
+
+    _weighted(vb_name + '_Heave_MDL', _average(vb_name + '_Heave_PMA', list(corners.values())), weight,
+              body + '.translateY')
+
+    # No tilt around an axis the wheels have no lever arm for, like the roll of a bike
+    front, rear = axles[0], axles[-1]
+    distance = hubs[front[0]][0] - hubs[rear[0]][0]
+    if distance:
+        pitch = _slope(vb_name + '_Pitch', _average(vb_name + '_Front_PMA', [corners[name] for name in front]),
+                       _average(vb_name + '_Rear_PMA', [corners[name] for name in rear]), distance, 1.0)
+        _weighted(vb_name + '_PitchWeight_MDL', pitch, weight, body + '.rotateZ')
+
+    # Rotating around X lifts +Z by -angle, so the slope from right (+Z) to left (-Z) turns the other way
+    left, right = [axle[0] for axle in axles], [axle[-1] for axle in axles]
+    distance = hubs[left[0]][2] - hubs[right[0]][2]
+    if distance:
+        roll = _slope(vb_name + '_Roll', _average(vb_name + '_Left_PMA', [corners[name] for name in left]),
+                      _average(vb_name + '_Right_PMA', [corners[name] for name in right]), distance, -1.0)
+        _weighted(vb_name + '_RollWeight_MDL', roll, weight, body + '.rotateX')
+
+    _redrive(body_jnt, body)
+    avr.select_after(body_ctrl)
+    return body
@@ -0,0 +1,180 @@
+# -*- coding: UTF-8 -*-
+# Terrain following: cast one ray per wheel and frame against a terrain mesh, then bake the body's
+# height, pitch and roll and every wheel's height offset onto dedicated '_Terrain' groups.
+# Rays use the mesh's uniform grid acceleration structure and every hit is cached, so baking again
+# (or baking another vehicle over the same ground) only casts the rays it has never cast before.
+# Scrubbing afterwards just reads the baked keys.
+import AutoVehicleRig.AVR_Base as avr
+import AutoVehicleRig.AVR_Cache as avr_cache
+import maya.api.OpenMaya as om2
+import maya.api.OpenMayaAnim as oma2
+import maya.cmds as cmds
+
+np = avr.numpy
+
+
+# {(terrain, geometry signature): {(x, z): ground height}}
+_CONTACT_CACHE = {}
+CACHE_PRECISION = 3
+
+
+class TerrainCaster(object):
+
+    def __init__(self, terrain):
+        selection = om2.MSelectionList()
+        selection.add(terrain)
+        path = selection.getDagPath(0)
+        path.extendToShape()
+
+        self.mesh = om2.MFnMesh(path)
+        self.accel = self.mesh.autoUniformGridParams()
+        bbox = cmds.exactWorldBoundingBox(terrain)
+        self.top = bbox[4] + 1.0
+        self.depth = bbox[4] - bbox[1] + 2.0
+
+        # Any change to the terrain's topology or placement gives it a new cache
+        signature = (cmds.polyEvaluate(terrain, v=True), cmds.polyEvaluate(terrain, f=True), tuple(bbox))
+        self.cache = _CONTACT_CACHE.setdefault((terrain, signature), {})
+
+    def heights(self, x, z):
+        # Ground height under every (x, z), NaN where the terrain has no ground
+        result = np.empty(len(x))
+        down = om2.MFloatVector(0, -1, 0)
+        for index, key in enumerate(zip(np.round(x, CACHE_PRECISION), np.round(z, CACHE_PRECISION))):
+            height = self.cache.get(key)
+            if height is None:
+                hit = self.mesh.closestIntersection(om2.MFloatPoint(key[0], self.top, key[1]), down,
+                                                    om2.MSpace.kWorld, self.depth, False, accelParams=self.accel)
+                height = hit[0].y if hit and hit[2] >= 0 else float('nan')
+                self.cache[key] = height
+            result[index] = height
+        return result
+
+
+def clear_cache():
+    _CONTACT_CACHE.clear()
+
+
+def _set_keys(node, attr, frames, values, modifier):
+    # Replace the animation of one attribute with a whole curve at once. The curve is created and connected
+    # through the modifier, so it goes on the undo queue once the modifier is committed.
+    cmds.cutKey(node, at=attr, clear=True)
+    selection = om2.MSelectionList()
+    selection.add('{}.{}'.format(node, attr))
+
+    unit = om2.MTime.uiUnit()
+    curve = oma2.MFnAnimCurve()
+    curve.create(selection.getPlug(0), modifier=modifier)
+    curve.addKeys(om2.MTimeArray([om2.MTime(frame, unit) for frame in frames]),
+                  om2.MDoubleArray([float(value) for value in values]),
+                  oma2.MFnAnimCurve.kTangentLinear, oma2.MFnAnimCurve.kTangentLinear)
+
+
+def _euler_xyz(matrix):
+    # Rotation matrices (row vectors, rotate order xyz) to radians
+    x = np.arctan2(matrix[..., 1, 2], matrix[..., 2, 2])
+    y = np.arcsin(np.clip(-matrix[..., 0, 2], -1.0, 1.0))
+    z = np.arctan2(matrix[..., 0, 1], matrix[..., 0, 0])
+    return x, y, z
+
+
+def _terrain_group(node, ctrl):
+    # One '<controller>_Terrain' group per controller, reused when baking again
+    grp = ctrl + '_Terrain'
+    if not cmds.objExists(grp):
+        grp = avr.insert_parent(node, grp)
+    return grp
+
+
+def remove_ground_contact(vb_name, axles):
+    # Drop the baked terrain animation, the vehicle goes back to its own animation
+    for node in [vb_name + '_Ctrl'] + [name + '_Ctrl' for axle in axles for name in axle]:
+        grp = node + '_Terrain'
+        if cmds.objExists(grp):
+            cmds.cutKey(grp, clear=True)
+            cmds.setAttr(grp + '.translate', 0, 0, 0)
+            cmds.setAttr(grp + '.rotate', 0, 0, 0)
+
+
+@avr.fast_step
+def bake_ground_contact(vb_name, axles, terrain, start, end, prefix='', suffix='_Jnt'):
+    avr.require_numpy('Terrain following')
+
+    wheels = [name for axle in axles for name in axle]
+    body_ctrl = vb_name + '_Ctrl'
+    frames = list(range(int(start), int(end) + 1))
+
+    # The wheel groups go above the top of each wheel controller's own stack (e.g. the auto spin group)
+    remove_ground_contact(vb_name, axles)
+    body_grp = _terrain_group(body_ctrl, body_ctrl)
+    wheel_grps = []
+    for name in wheels:
+        top = avr.top_under(name + '_Ctrl', body_ctrl)
+        wheel_grps.append(_terrain_group(top, name + '_Ctrl'))
+
+    # Hub positions and radii in the body controller's space, measured once
+    body_inverse = np.linalg.inv(np.array(cmds.getAttr(body_ctrl + '.worldMatrix[0]')).reshape(4, 4))
+    hubs = np.array([cmds.xform(prefix + name + suffix, q=1, ws=1, t=1) + [1.0] for name in wheels])
+    hubs = np.dot(hubs, body_inverse)
+    radius = np.array([avr.wheel_radius(name, prefix, suffix) for name in wheels])
+
+    # World matrix of the body controller without the terrain group: matrix * terrainGroup.parentMatrix
+    local, parent = avr_cache.sample_matrices([body_ctrl + '.matrix', body_grp + '.parentMatrix[0]'], frames)
+    world = np.einsum('fij,fjk->fik', local, parent)
+    pivot = world[:, 3, :3]
+    hub_world = np.einsum('wi,fij->fwj', hubs, world)[:, :, :3]
+
+    # Rays, then the ground under every hub. Where the terrain has no ground the wheel keeps its height.
+    caster = TerrainCaster(terrain)
+    ground = caster.heights(hub_world[..., 0].ravel(), hub_world[..., 2].ravel()).reshape(hub_world.shape[:2])
+    ground = np.where(np.isnan(ground), hub_world[..., 1] - radius, ground)
+
+    # Least squares plane through the ground around the body pivot: ground = a * dx + b * dz + g
+    design = np.stack([hub_world[..., 0] - pivot[:, None, 0],
+                       hub_world[..., 2] - pivot[:, None, 2],
+                       np.ones(ground.shape)], axis=-1)
+    a, b, g = np.einsum('fij,fj->fi', np.linalg.pinv(design), ground).T
+
+    # Minimal rotation taking +Y onto the plane normal, around the body pivot (Rodrigues, row vectors)
+    normal = np.stack([-a, np.ones_like(a), -b], axis=-1)
+    slope = np.linalg.norm(normal, axis=-1)
+    normal /= slope[:, None]
+    k = np.stack([normal[:, 2], np.zeros_like(a), -normal[:, 0]], axis=-1)
+    skew = np.zeros((len(frames), 3, 3))
+    skew[:, 0, 1], skew[:, 0, 2] = -k[:, 2], k[:, 1]
+    skew[:, 1, 0], skew[:, 1, 2] = k[:, 2], -k[:, 0]
+    skew[:, 2, 0], skew[:, 2, 1] = -k[:, 1], k[:, 0]
+    rotation = np.eye(3) + skew + np.einsum('fij,fjk->fik', skew, skew) / (1.0 + normal[:, 1])[:, None, None]
+    rotation = rotation.transpose(0, 2, 1)
+
+    # Tilted with the body, a wheel touches the plane when its hub is radius away along the normal, which
+    # is radius * slope straight up. The body rises by the mean lift, each wheel by the rest of its own plus
+    # the bumps the plane leaves out.
+    tilted = np.einsum('fwi,fij->fwj', hub_world - pivot[:, None, :], rotation)
+    plane = g[:, None] + a[:, None] * tilted[..., 0] + b[:, None] * tilted[..., 2]
+    lift = plane + radius * slope[:, None] - pivot[:, None, 1] - tilted[..., 1]
+    c = lift.mean(axis=1)
+    residual = lift - c[:, None] + ground - np.einsum('fwi,fi->fw', design, np.stack([a, b, g], axis=-1))
+
+    # World transform of the terrain group, then into its parent space: local = parent * world * parent^-1
+    offset = np.tile(np.eye(4), (len(frames), 1, 1))
+    offset[:, :3, :3] = rotation
+    offset[:, 3, :3] = pivot - np.einsum('fi,fij->fj', pivot, rotation)
+    offset[:, 3, 1] += c
+    offset = np.einsum('fij,fjk,fkl->fil', parent, offset, np.linalg.inv(parent))
+
+    # Maya applies the rotation around the group's pivot: translate = t + pivot * R - pivot
+    group_pivot = np.array(cmds.getAttr(body_grp + '.rotatePivot')[0])
+    translate = offset[:, 3, :3] + np.einsum('i,fij->fj', group_pivot, offset[:, :3, :3]) - group_pivot
+    modifier = om2.MDGModifier()
+    for axis, values in zip('XYZ', translate.T):
+        _set_keys(body_grp, 'translate' + axis, frames, values, modifier)
+    for axis, values in zip('XYZ', _euler_xyz(offset[:, :3, :3])):
+        _set_keys(body_grp, 'rotate' + axis, frames, values, modifier)
+
+    # Whatever the body cannot absorb goes to the wheels
+    for grp, values in zip(wheel_grps, residual.T):
+        _set_keys(grp, 'translateY', frames, values, modifier)
+    avr.commit_modifier(modifier)
+
+    return body_grp, wheel_grps
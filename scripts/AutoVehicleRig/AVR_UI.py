@@ -1,9 +1,21 @@
 # -*- coding: UTF-8 -*-
 import AutoVehicleRig.AVR_Base as avr
+import AutoVehicleRig.AVR_Cache as avr_cache
+import AutoVehicleRig.AVR_Detect as detect
+import AutoVehicleRig.AVR_Path as avr_path
+import AutoVehicleRig.AVR_Preset as avr_preset
+import AutoVehicleRig.AVR_Profile as avr_profile
+import AutoVehicleRig.AVR_Proxy as avr_proxy
+import AutoVehicleRig.AVR_Replicate as avr_replicate
+import AutoVehicleRig.AVR_Suspension as avr_suspension
+import AutoVehicleRig.AVR_Terrain as terrain
+import AutoVehicleRig.AVR_Validate as avr_validate
 import maya.cmds as cmds
 import maya.OpenMaya as om
 from maya.app.general.mayaMixin import MayaQWidgetDockableMixin
 from PySide2 import QtWidgets, QtCore, QtGui
+import functools
+import json
 import re
 
 
@@ -22,18 +34,43 @@ NOTE_QSS = '''QLabel{
                 margin-bottom: 6px
               }'''
 
+WORKSPACE_CONTROL = 'AVRWorkspaceControl'
+
+# Step1 tabs: title and wheel part names per axle, front to back and left to right.
+# The N-Axle tab after them numbers its wheels from an axle count instead.
+LAYOUTS = [('2-Wheeled', [['Wheel_F'], ['Wheel_B']]),
+           ('4-Wheeled', [['Wheel_FL', 'Wheel_FR'], ['Wheel_BL', 'Wheel_BR']]),
+           ('6-Wheeled', [['Wheel_FL', 'Wheel_FR'], ['Wheel_ML', 'Wheel_MR'], ['Wheel_BL', 'Wheel_BR']])]
+DEFAULT_TAB = 1  # 4-Wheeled
+MAX_AXLES = 12
+
+_INSTANCE = None
+
+
+def numbered_axles(count, pairs=True):
+    # Wheel part names of the N-Axle tab, e.g. Wheel_1L, Wheel_1R, Wheel_2L, ...
+    return [['Wheel_{}L'.format(n), 'Wheel_{}R'.format(n)] if pairs else ['Wheel_{}'.format(n)]
+            for n in range(1, count + 1)]
+
+
+def show():
+    # Open the tool, or bring back the one already built so its fields keep what was typed
+    global _INSTANCE
+    if _INSTANCE is None:
+        # A control left behind by a reloaded module belongs to a dead instance
+        if cmds.workspaceControl(WORKSPACE_CONTROL, exists=True):
+            cmds.deleteUI(WORKSPACE_CONTROL)
+        _INSTANCE = AVR()
+    else:
+        _INSTANCE.show(dockable=True)
+    return _INSTANCE
+
 
 class AVR(MayaQWidgetDockableMixin, QtWidgets.QWidget):
 
     def __init__(self):
         super(AVR, self).__init__()
 
-        # Delete existing UI
-        try:
-            cmds.deleteUI('AVRWorkspaceControl')
-        except RuntimeError:
-            pass
-
         self.setWindowTitle('Auto Vehicle Rig')
         self.resize(429, 702)
         self.build_ui()
@@ -71,58 +108,31 @@ class AVR(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         self.pivot_cb.addItem('World')
         self.pivot_cb.addItem('Object')
         pivot_layout.addRow(pivot_text, self.pivot_cb)
+        self.combine_cb = QtWidgets.QCheckBox('Combine meshes per material', self)
+        self.combine_cb.setToolTip('Merge the meshes of each part into one mesh per material while grouping, '
+                                   'the original pieces can be restored before binding')
+        pivot_layout.addRow(self.combine_cb)
 
-        item_2w = ['VehicleBody', 'Wheel_F', 'Wheel_B']
-        item_4w = ['VehicleBody', 'Wheel_FL', 'Wheel_FR', 'Wheel_BL', 'Wheel_BR']
-        item_6w = ['VehicleBody', 'Wheel_FL', 'Wheel_FR', 'Wheel_ML', 'Wheel_MR', 'Wheel_BL', 'Wheel_BR']
-
-        # 2W setup
-        step1_widget_2w = QtWidgets.QWidget(self)
-        step1_layout_2w = QtWidgets.QFormLayout(step1_widget_2w)
-        layout.addWidget(step1_widget_2w)
-
-        for item in item_2w:
-            exec('self.{}_text_2 = QtWidgets.QLineEdit(item, self)'.format(item))
-            exec('{}_rename_btn_2 = QtWidgets.QPushButton("Rename {}", self)'.format(item, item))
-            step1_layout_2w.addRow(locals()['{}_rename_btn_2'.format(item)], eval('self.{}_text_2'.format(item)))
-            eval('self.{}_text_2'.format(item)).setFixedHeight(23)
-            locals()['{}_rename_btn_2'.format(item)].setFixedWidth(130)
-            exec('{}_rename_btn_2.clicked.connect(self.rename_group_{}_2)'.format(item, item))
-
-        # 4W setup
-        step1_widget_4w = QtWidgets.QWidget(self)
-        step1_layout_4w = QtWidgets.QFormLayout(step1_widget_4w)
-        layout.addWidget(step1_widget_4w)
-
-        # Use exec(), eval(), and locals() to dynamically generate variables
-        for item in item_4w:
-            exec('self.{}_text_4 = QtWidgets.QLineEdit(item, self)'.format(item))
-            exec('{}_rename_btn_4 = QtWidgets.QPushButton("Rename {}", self)'.format(item, item))
-            step1_layout_4w.addRow(locals()['{}_rename_btn_4'.format(item)], eval('self.{}_text_4'.format(item)))
-            eval('self.{}_text_4'.format(item)).setFixedHeight(23)
-            locals()['{}_rename_btn_4'.format(item)].setFixedWidth(130)
-            exec('{}_rename_btn_4.clicked.connect(self.rename_group_{}_4)'.format(item, item))
-
-        # 6W setup
-        step1_widget_6w = QtWidgets.QWidget(self)
-        step1_layout_6w = QtWidgets.QFormLayout(step1_widget_6w)
-        layout.addWidget(step1_widget_6w)
-
-        for item in item_6w:
-            exec('self.{}_text_6 = QtWidgets.QLineEdit(item, self)'.format(item))
-            exec('{}_rename_btn_6 = QtWidgets.QPushButton("Rename {}", self)'.format(item, item))
-            step1_layout_6w.addRow(locals()['{}_rename_btn_6'.format(item)], eval('self.{}_text_6'.format(item)))
-            eval('self.{}_text_6'.format(item)).setFixedHeight(23)
-            locals()['{}_rename_btn_6'.format(item)].setFixedWidth(130)
-            exec('{}_rename_btn_6.clicked.connect(self.rename_group_{}_6)'.format(item, item))
-
-        # Put 2W, 4W, 6W in different tabs
+        # One tab per axle layout. Tabs are empty pages until first shown, then keep their fields.
+        self.part_fields = {}  # tab index -> (body field, wheel fields per axle)
         self.tab_widget = QtWidgets.QTabWidget()
         layout.addWidget(self.tab_widget)
-        self.tab_widget.addTab(step1_widget_2w, '2-Wheeled')
-        self.tab_widget.addTab(step1_widget_4w, '4-Wheeled')
-        self.tab_widget.addTab(step1_widget_6w, '6-Wheeled')
-        self.tab_widget.setCurrentIndex(1)  # Set '4-Wheeled' tab as default tab
+        for title, _ in LAYOUTS + [('N-Axle', None)]:
+            self.tab_widget.addTab(QtWidgets.QWidget(self), title)
+        self.tab_widget.currentChanged.connect(self.build_tab)
+        self.tab_widget.setCurrentIndex(DEFAULT_TAB)
+        self.build_tab(DEFAULT_TAB)
+
+        # Classify and group the selected meshes automatically
+        detect_btn = QtWidgets.QPushButton('Auto Detect Parts', self)
+        detect_btn.setToolTip('Find the wheels of the selected vehicle meshes and group every part automatically')
+        detect_btn.clicked.connect(self.auto_detect)
+        layout.addWidget(detect_btn)
+
+        restore_btn = QtWidgets.QPushButton('Restore Combined Meshes', self)
+        restore_btn.setToolTip('Split the combined meshes of every part back into their original pieces')
+        restore_btn.clicked.connect(self.restore_meshes)
+        layout.addWidget(restore_btn)
 
         # Skeleton setup module
         step2 = QtWidgets.QLabel(self)
@@ -158,9 +168,14 @@ class AVR(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         create_btn = QtWidgets.QPushButton('Create Joint', self)
         create_btn.clicked.connect(self.create_joints)
         snap_btn = QtWidgets.QPushButton('Snap Joint', self)
-        snap_btn.clicked.connect(avr.snap_joint)
+        # clicked passes 'checked', which snap_joint would take for its objects
+        snap_btn.clicked.connect(lambda *_: avr.snap_joint())
+        fit_btn = QtWidgets.QPushButton('Fit Joints', self)
+        fit_btn.setToolTip('Place and orient every joint on the hub of its wheel, measured from the meshes')
+        fit_btn.clicked.connect(self.fit_joints)
         step2_layout.addWidget(create_btn)
         step2_layout.addWidget(snap_btn)
+        step2_layout.addWidget(fit_btn)
 
         # Bind Skin
         step3 = QtWidgets.QLabel(self)
@@ -171,6 +186,33 @@ class AVR(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         step3.setStyleSheet(MAIN_QSS)
         step3.setToolTip('One click to bind all skins and create controllers')
 
+        # Set binding mode
+        bind_widget = QtWidgets.QWidget(self)
+        bind_layout = QtWidgets.QFormLayout(bind_widget)
+        layout.addWidget(bind_widget)
+
+        bind_text = QtWidgets.QLabel('Bind mode : ', self)
+        self.bind_cb = QtWidgets.QComboBox(self)
+        self.bind_cb.addItem('Skin Cluster')
+        self.bind_cb.addItem('Rigid (No Deformers)')
+        self.bind_cb.setToolTip('Rigid mode attaches each part group to its joint with a matrix connection '
+                                'instead of creating one skinCluster per mesh')
+        bind_layout.addRow(bind_text, self.bind_cb)
+
+        # Set constraint mode
+        constraint_text = QtWidgets.QLabel('Constraint mode : ', self)
+        self.constraint_cb = QtWidgets.QComboBox(self)
+        self.constraint_cb.addItem('Point + Orient Constraints')
+        self.constraint_cb.addItem('Matrix (Offset Parent Matrix)')
+        self.constraint_cb.setToolTip('Matrix mode drives each joint with one multMatrix node instead of two constraints')
+        bind_layout.addRow(constraint_text, self.constraint_cb)
+
+        self.spin_cb = QtWidgets.QCheckBox('Auto wheel spin', self)
+        self.spin_cb.setToolTip('Rotate the wheels from the distance the body controller moves forward and each '
+                                "wheel's radius, built from utility nodes only. Only straight-line moves spin "
+                                'the wheels, turning does not; for curves, drive the vehicle along a path')
+        bind_layout.addRow(self.spin_cb)
+
         step3_widget = QtWidgets.QWidget(self)
         step3_layout = QtWidgets.QVBoxLayout(step3_widget)
         layout.addWidget(step3_widget)
@@ -182,6 +224,126 @@ class AVR(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         controller_btn.clicked.connect(self.create_controllers)
         step3_layout.addWidget(controller_btn)
 
+        convert_btn = QtWidgets.QPushButton('Convert Constraints To Matrix', self)
+        convert_btn.clicked.connect(self.convert_constraints)
+        step3_layout.addWidget(convert_btn)
+
+        suspension_btn = QtWidgets.QPushButton('Add Suspension', self)
+        suspension_btn.setToolTip("Add a spring group above every wheel controller, with travel, droop, stiffness "
+                                  "and rest height, and a 'suspension' switch on the body controller")
+        suspension_btn.clicked.connect(self.create_suspension)
+        step3_layout.addWidget(suspension_btn)
+
+        proxy_widget = QtWidgets.QWidget(self)
+        proxy_layout = QtWidgets.QHBoxLayout(proxy_widget)
+        proxy_layout.setContentsMargins(0, 0, 0, 0)
+        step3_layout.addWidget(proxy_widget)
+        self.proxy_cb = QtWidgets.QComboBox(self)
+        self.proxy_cb.addItem('Bounding Boxes')
+        self.proxy_cb.addItem('Reduced Meshes')
+        proxy_btn = QtWidgets.QPushButton('Create Proxies', self)
+        proxy_btn.setToolTip("Add a light proxy to every part and a 'proxy' switch on the body controller that "
+                             "hides the full meshes and stops their skinClusters")
+        proxy_btn.clicked.connect(self.create_proxies)
+        proxy_layout.addWidget(self.proxy_cb)
+        proxy_layout.addWidget(proxy_btn)
+
+        validate_widget = QtWidgets.QWidget(self)
+        validate_layout = QtWidgets.QHBoxLayout(validate_widget)
+        validate_layout.setContentsMargins(0, 0, 0, 0)
+        step3_layout.addWidget(validate_widget)
+        validate_btn = QtWidgets.QPushButton('Validate Rig', self)
+        validate_btn.setToolTip('Look for anything that keeps this rig from parallel evaluation or cached playback, '
+                                'and time playback. The JSON report goes to the script editor')
+        validate_btn.clicked.connect(functools.partial(self.validate_rig, False))
+        fix_btn = QtWidgets.QPushButton('Validate And Fix', self)
+        fix_btn.setToolTip('Validate, fix what can be fixed automatically and time playback again')
+        fix_btn.clicked.connect(functools.partial(self.validate_rig, True))
+        validate_layout.addWidget(validate_btn)
+        validate_layout.addWidget(fix_btn)
+
+        path_widget = QtWidgets.QWidget(self)
+        path_layout = QtWidgets.QHBoxLayout(path_widget)
+        path_layout.setContentsMargins(0, 0, 0, 0)
+        step3_layout.addWidget(path_widget)
+        path_btn = QtWidgets.QPushButton('Drive Along Path', self)
+        path_btn.setToolTip("Select a curve, then drive the body controller along it at constant speed with the "
+                            "'distance' attribute of its path group")
+        path_btn.clicked.connect(self.create_path_drive)
+        update_paths_btn = QtWidgets.QPushButton('Update Paths', self)
+        update_paths_btn.setToolTip('Rebuild the arc-length tables of the paths edited since they were built')
+        update_paths_btn.clicked.connect(self.update_paths)
+        path_layout.addWidget(path_btn)
+        path_layout.addWidget(update_paths_btn)
+
+        terrain_btn = QtWidgets.QPushButton('Bake Ground Contact', self)
+        terrain_btn.setToolTip('Select the terrain mesh, then bake wheel heights and body pitch/roll over the '
+                               'playback range')
+        terrain_btn.clicked.connect(self.bake_ground_contact)
+        step3_layout.addWidget(terrain_btn)
+
+        cache_widget = QtWidgets.QWidget(self)
+        cache_layout = QtWidgets.QHBoxLayout(cache_widget)
+        cache_layout.setContentsMargins(0, 0, 0, 0)
+        step3_layout.addWidget(cache_widget)
+        bake_cache_btn = QtWidgets.QPushButton('Bake Transform Cache', self)
+        bake_cache_btn.setToolTip('Write the joint world matrices over the playback range to a cache file')
+        bake_cache_btn.clicked.connect(self.bake_cache)
+        attach_cache_btn = QtWidgets.QPushButton('Play From Cache', self)
+        attach_cache_btn.setToolTip('Drive the joints straight from a cache file instead of the rig')
+        attach_cache_btn.clicked.connect(self.attach_cache)
+        cache_layout.addWidget(bake_cache_btn)
+        cache_layout.addWidget(attach_cache_btn)
+
+        preset_widget = QtWidgets.QWidget(self)
+        preset_layout = QtWidgets.QHBoxLayout(preset_widget)
+        preset_layout.setContentsMargins(0, 0, 0, 0)
+        step3_layout.addWidget(preset_widget)
+        save_preset_btn = QtWidgets.QPushButton('Save Rig Preset', self)
+        save_preset_btn.setToolTip('Save part meshes, joint placement, naming and controller options of this rig')
+        save_preset_btn.clicked.connect(self.save_preset)
+        build_preset_btn = QtWidgets.QPushButton('Build From Preset', self)
+        build_preset_btn.setToolTip('Rebuild a saved rig on the ungrouped meshes of this scene in one step')
+        build_preset_btn.clicked.connect(self.build_preset)
+        preset_layout.addWidget(save_preset_btn)
+        preset_layout.addWidget(build_preset_btn)
+
+        update_btn = QtWidgets.QPushButton('Update Rig', self)
+        update_btn.setToolTip('After changing meshes in the part groups, rebind and re-place only the changed parts, '
+                              'keeping the controllers and their animation')
+        update_btn.clicked.connect(self.update_rig)
+        step3_layout.addWidget(update_btn)
+
+        replicate_widget = QtWidgets.QWidget(self)
+        replicate_layout = QtWidgets.QHBoxLayout(replicate_widget)
+        replicate_layout.setContentsMargins(0, 0, 0, 0)
+        step3_layout.addWidget(replicate_widget)
+        self.copies_sb = QtWidgets.QSpinBox(self)
+        self.copies_sb.setRange(1, 1000)
+        self.copies_sb.setValue(10)
+        replicate_btn = QtWidgets.QPushButton('Replicate Rig', self)
+        replicate_btn.setToolTip('Make animatable copies of this rig, each in its own namespace, sharing the '
+                                 'meshes of this vehicle as instances')
+        replicate_btn.clicked.connect(self.replicate_rig)
+        replicate_layout.addWidget(QtWidgets.QLabel('Copies', self))
+        replicate_layout.addWidget(self.copies_sb)
+        replicate_layout.addWidget(replicate_btn)
+
+        # Profiling of the rig steps
+        profile_widget = QtWidgets.QWidget(self)
+        profile_layout = QtWidgets.QHBoxLayout(profile_widget)
+        layout.addWidget(profile_widget)
+        self.profile_cb = QtWidgets.QCheckBox('Profile rig steps', self)
+        self.profile_cb.setToolTip('Record the time and Maya command count of every rig step. Only maya.cmds '
+                                   'calls are counted, OpenMaya work shows in the time alone')
+        self.profile_cb.setChecked(avr_profile.enabled())
+        self.profile_cb.toggled.connect(self.toggle_profile)
+        export_profile_btn = QtWidgets.QPushButton('Export Profile', self)
+        export_profile_btn.setToolTip('Save the recorded steps as JSON, or as a Chrome trace for *.trace.json files')
+        export_profile_btn.clicked.connect(self.export_profile)
+        profile_layout.addWidget(self.profile_cb)
+        profile_layout.addWidget(export_profile_btn)
+
         # Add spacer to implement adaptive scaling at the bottom
         spacer = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         layout.addItem(spacer)
@@ -190,235 +352,372 @@ class AVR(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         layout.addWidget(author)
         author.setAlignment(QtCore.Qt.AlignCenter)
 
-    def rename_group_VehicleBody_2(self):
-        cmds.undoInfo(openChunk=True)
-
-        vb_name = self.VehicleBody_text_2.text()
-        if self.pivot_cb.currentIndex() == 0:
-            avr.rename_group_model_world(vb_name)
-        elif self.pivot_cb.currentIndex() == 1:
-            avr.rename_group_model_object(vb_name)
-
-        cmds.undoInfo(closeChunk=True)
-
-    def rename_group_VehicleBody_4(self):
-        cmds.undoInfo(openChunk=True)
-
-        vb_name = self.VehicleBody_text_4.text()
-        if self.pivot_cb.currentIndex() == 0:
-            avr.rename_group_model_world(vb_name)
-        elif self.pivot_cb.currentIndex() == 1:
-            avr.rename_group_model_object(vb_name)
-
-        cmds.undoInfo(closeChunk=True)
-
-    def rename_group_VehicleBody_6(self):
-        cmds.undoInfo(openChunk=True)
-
-        vb_name = self.VehicleBody_text_6.text()
-        if self.pivot_cb.currentIndex() == 0:
-            avr.rename_group_model_world(vb_name)
-        elif self.pivot_cb.currentIndex() == 1:
-            avr.rename_group_model_object(vb_name)
-
-        cmds.undoInfo(closeChunk=True)
-
-    def rename_group_Wheel_F_2(self):
-        cmds.undoInfo(openChunk=True)
-
-        wf_name = self.Wheel_F_text_2.text()
-        avr.rename_group_model_object(wf_name)
-
-        cmds.undoInfo(closeChunk=True)
-
-    def rename_group_Wheel_B_2(self):
-        cmds.undoInfo(openChunk=True)
-
-        wb_name = self.Wheel_B_text_2.text()
-        avr.rename_group_model_object(wb_name)
-
-        cmds.undoInfo(closeChunk=True)
-
-    def rename_group_Wheel_FL_4(self):
-        cmds.undoInfo(openChunk=True)
-
-        wfl_name = self.Wheel_FL_text_4.text()
-        avr.rename_group_model_object(wfl_name)
-
-        cmds.undoInfo(closeChunk=True)
-
-    def rename_group_Wheel_FL_6(self):
-        cmds.undoInfo(openChunk=True)
-
-        wfl_name = self.Wheel_FL_text_6.text()
-        avr.rename_group_model_object(wfl_name)
-
-        cmds.undoInfo(closeChunk=True)
+    def build_tab(self, index):
+        if index in self.part_fields:
+            return
 
-    def rename_group_Wheel_FR_4(self):
-        cmds.undoInfo(openChunk=True)
+        page_layout = QtWidgets.QVBoxLayout(self.tab_widget.widget(index))
+        if index < len(LAYOUTS):
+            rows, self.part_fields[index] = self.part_rows(LAYOUTS[index][1])
+            page_layout.addWidget(rows)
+            return
 
-        wfr_name = self.Wheel_FR_text_4.text()
-        avr.rename_group_model_object(wfr_name)
+        # N-Axle: the rows follow the axle count
+        count_widget = QtWidgets.QWidget(self)
+        count_layout = QtWidgets.QFormLayout(count_widget)
+        page_layout.addWidget(count_widget)
+        self.axle_sb = QtWidgets.QSpinBox(self)
+        self.axle_sb.setRange(2, MAX_AXLES)
+        self.axle_sb.setValue(4)
+        self.pair_cb = QtWidgets.QCheckBox('Left and right wheel on every axle', self)
+        self.pair_cb.setChecked(True)
+        count_layout.addRow(QtWidgets.QLabel('Axles : ', self), self.axle_sb)
+        count_layout.addRow(self.pair_cb)
+        self.axle_sb.valueChanged.connect(self.build_axle_rows)
+        self.pair_cb.toggled.connect(self.build_axle_rows)
+
+        self.axle_rows = None
+        self.axle_page = page_layout
+        self.build_axle_rows()
+
+    def build_axle_rows(self, *_):
+        # Rebuild the N-Axle rows, keeping the names already typed for rows that stay
+        index = len(LAYOUTS)
+        typed = {}
+        if self.axle_rows is not None:
+            body, wheels = self.part_fields[index]
+            typed = dict((field.property('part'), field.text()) for field in [body] + sum(wheels, []))
+            self.axle_rows.deleteLater()
+
+        self.axle_rows, self.part_fields[index] = self.part_rows(
+            numbered_axles(self.axle_sb.value(), self.pair_cb.isChecked()), typed)
+        self.axle_page.addWidget(self.axle_rows)
+
+    def part_rows(self, axles, typed=None):
+        # One rename row per part, the body first. Returns the rows and (body field, wheel fields per axle).
+        widget = QtWidgets.QWidget(self)
+        form = QtWidgets.QFormLayout(widget)
+        body = self.part_row(form, 'VehicleBody', True, typed)
+        wheels = [[self.part_row(form, name, False, typed) for name in axle] for axle in axles]
+        return widget, (body, wheels)
+
+    def part_row(self, form, part, body, typed=None):
+        field = QtWidgets.QLineEdit((typed or {}).get(part, part), self)
+        field.setProperty('part', part)
+        field.setFixedHeight(23)
+        rename_btn = QtWidgets.QPushButton('Rename {}'.format(part), self)
+        rename_btn.setFixedWidth(130)
+        rename_btn.clicked.connect(functools.partial(self.rename_group, field, body))
+        form.addRow(rename_btn, field)
+        return field
+
+    def rename_group(self, field, body, *_):
+        # Only the vehicle body follows the pivot policy, wheels always pivot on themselves
+        if body and self.pivot_cb.currentIndex() == 0:
+            avr.rename_group_model_world(field.text(), combine=self.combine_cb.isChecked())
+        else:
+            avr.rename_group_model_object(field.text(), combine=self.combine_cb.isChecked())
+
+    def restore_meshes(self):
+        vb_name, axles = self.current_parts()
+        restored = []
+        for name in cmds.ls([vb_name] + avr.wheel_names(axles)):
+            try:
+                restored += avr.restore_meshes(name)
+            except ValueError as e:
+                om.MGlobal.displayWarning(str(e))
+        om.MGlobal.displayInfo('Restored {} pieces'.format(len(restored)))
+
+    def auto_detect(self):
+        try:
+            pivot = 'world' if self.pivot_cb.currentIndex() == 0 else 'object'
+            result = detect.auto_group(vb_name=self.current_parts()[0], pivot=pivot,
+                                       combine=self.combine_cb.isChecked())
+        except ImportError as e:
+            om.MGlobal.displayWarning(str(e))
+            result = None
+
+        if not result:
+            return
 
-        cmds.undoInfo(closeChunk=True)
+        # Show the detected names in the matching tab, or in the N-Axle tab for any other layout
+        vb_name, axles = result
+        shape = [len(axle) for axle in axles]
+        tabs = [index for index, (_, names) in enumerate(LAYOUTS) if [len(axle) for axle in names] == shape]
+        if tabs:
+            tab = tabs[0]
+        elif len(set(shape)) == 1 and shape[0] in (1, 2) and 2 <= len(axles) <= MAX_AXLES:
+            tab = len(LAYOUTS)
+            self.build_tab(tab)
+            self.pair_cb.setChecked(shape[0] == 2)
+            self.axle_sb.setValue(len(axles))
+        else:
+            om.MGlobal.displayWarning('Detected axles with {} wheels, please rig this layout from script'.format(shape))
+            return
 
-    def rename_group_Wheel_FR_6(self):
-        cmds.undoInfo(openChunk=True)
+        self.tab_widget.setCurrentIndex(tab)
+        self.build_tab(tab)
+        body, wheels = self.part_fields[tab]
+        body.setText(vb_name)
+        for fields, names in zip(wheels, axles):
+            for field, name in zip(fields, names):
+                field.setText(name)
 
-        wfr_name = self.Wheel_FR_text_6.text()
-        avr.rename_group_model_object(wfr_name)
+    def create_joints(self):
+        prefix = self.pre_text.text()
+        suffix = self.suf_text.text()
+        if not prefix and not suffix:
+            om.MGlobal.displayWarning('Please enter a prefix or a suffix!')
+            return
 
-        cmds.undoInfo(closeChunk=True)
+        rule = re.compile(r'^[a-zA-Z_].*$')
 
-    def rename_group_Wheel_ML_6(self):
-        cmds.undoInfo(openChunk=True)
+        if prefix and not rule.match(prefix):
+            om.MGlobal.displayWarning("Prefix name should start with 'a-z', 'A-Z', or'_'")
+            return
 
-        wml_name = self.Wheel_ML_text_6.text()
-        avr.rename_group_model_object(wml_name)
+        vb_name, axles = self.current_parts()
+        avr.create_joints(vb_name, axles, prefix, suffix)
 
-        cmds.undoInfo(closeChunk=True)
+    def fit_joints(self):
+        prefix = self.pre_text.text()
+        suffix = self.suf_text.text()
+        if not prefix and not suffix:
+            om.MGlobal.displayWarning('Please enter a prefix or a suffix!')
+            return
 
-    def rename_group_Wheel_MR_6(self):
-        cmds.undoInfo(openChunk=True)
+        try:
+            vb_name, axles = self.current_parts()
+            detect.fit_joints(vb_name, axles, prefix, suffix)
+        except (ImportError, ValueError) as e:
+            om.MGlobal.displayWarning(str(e))
+
+    def run_chunked(self, name, chunks, finished=None):
+        # Run a chunked step from the event loop, one chunk per timer tick, with a progress dialog.
+        # Cancel undoes everything the step did so far. The modal dialog shows right away, so no other edit
+        # can slip into the undo chunk the step keeps open.
+        run = avr.ChunkedRun(name, chunks)
+        dialog = QtWidgets.QProgressDialog(name, 'Cancel', 0, 0, self)
+        dialog.setWindowTitle('AVR')
+        dialog.setWindowModality(QtCore.Qt.ApplicationModal)
+        dialog.setMinimumDuration(0)
+        dialog.show()
+
+        def next_chunk():
+            if dialog.wasCanceled():
+                run.cancel()
+                om.MGlobal.displayWarning("Cancelled '{}', the scene was rolled back".format(name))
+                return
+            try:
+                running = run.step()
+            except Exception as e:
+                dialog.reset()
+                om.MGlobal.displayError("'{}' failed and was rolled back: {}".format(name, e))
+                return
+            if not running:
+                dialog.reset()
+                if finished:
+                    finished()
+                return
+
+            done, total = run.progress
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+            dialog.setLabelText('{}: {} of {}, about {:.0f}s left'.format(name, done, total, run.eta()))
+            QtCore.QTimer.singleShot(0, next_chunk)
+
+        QtCore.QTimer.singleShot(0, next_chunk)
 
-        wmr_name = self.Wheel_MR_text_6.text()
-        avr.rename_group_model_object(wmr_name)
+    def bind_skin(self):
+        try:
+            prefix = self.pre_text.text()
+            suffix = self.suf_text.text()
+            mode = avr.BIND_MODES[self.bind_cb.currentIndex()]
+            vb_name, axles = self.current_parts()
+            chunks = avr.bind_skin_chunks(vb_name, axles, prefix, suffix, mode)
+        except ValueError:
+            om.MGlobal.displayWarning('Please make sure that each part of the model and joints are named correctly!')
+            return
+        self.run_chunked('bind_skin', chunks)
 
-        cmds.undoInfo(closeChunk=True)
+    def current_parts(self):
+        # Vehicle body name and wheel names per axle of the current tab
+        index = self.tab_widget.currentIndex()
+        self.build_tab(index)
+        body, wheels = self.part_fields[index]
+        return body.text(), [[field.text() for field in axle] for axle in wheels]
 
-    def rename_group_Wheel_BL_4(self):
-        cmds.undoInfo(openChunk=True)
+    def create_controllers(self):
+        prefix = self.pre_text.text()
+        suffix = self.suf_text.text()
+        constraint = avr.CONSTRAINT_MODES[self.constraint_cb.currentIndex()]
+        auto_spin = self.spin_cb.isChecked()
+        vb_name, axles = self.current_parts()
+
+        # Keep the definition on the finished rig, so it can be saved or updated later
+        def store():
+            try:
+                avr_preset.store(self.record_rig())
+            except ValueError:
+                pass
+
+        self.run_chunked('create_controllers',
+                         avr.create_controllers_chunks(vb_name, axles, prefix, suffix, constraint, auto_spin), store)
+
+    def convert_constraints(self):
+        vb_name, axles = self.current_parts()
+        converted = avr.convert_constraints(vb_name, axles, self.pre_text.text(), self.suf_text.text())
+        if not converted:
+            om.MGlobal.displayWarning('No point/orient constrained joints found for this vehicle!')
+        else:
+            om.MGlobal.displayInfo('Converted {} joints to matrix constraints'.format(len(converted)))
+
+    def create_suspension(self):
+        vb_name, axles = self.current_parts()
+        try:
+            avr_suspension.create_suspension(vb_name, axles, self.pre_text.text(), self.suf_text.text())
+        except ValueError as e:
+            om.MGlobal.displayWarning(str(e))
 
-        wbl_name = self.Wheel_BL_text_4.text()
-        avr.rename_group_model_object(wbl_name)
+    def create_proxies(self):
+        vb_name, axles = self.current_parts()
+        try:
+            avr_proxy.create_proxies(vb_name, axles, self.pre_text.text(), self.suf_text.text(),
+                                     avr_proxy.PROXY_MODES[self.proxy_cb.currentIndex()])
+        except ValueError as e:
+            om.MGlobal.displayWarning(str(e))
+
+    def validate_rig(self, fix, *_):
+        vb_name, axles = self.current_parts()
+        report = avr_validate.check_rig(vb_name, axles, self.pre_text.text(), self.suf_text.text(), fix, True)
+        print(json.dumps(report, indent=2))
+
+        remaining = [issue for issue in report['issues'] if issue['check'] not in report['fixed']]
+        for issue in remaining:
+            om.MGlobal.displayWarning('{}: {}'.format(issue['check'], issue['message']))
+        if not remaining:
+            om.MGlobal.displayInfo('The rig evaluates cleanly' + (', fixed: ' + ', '.join(report['fixed'])
+                                                                  if report['fixed'] else ''))
+
+    def create_path_drive(self):
+        sel = cmds.ls(sl=1)
+        if len(sel) != 1:
+            om.MGlobal.displayWarning('Please select the path curve!')
+            return
 
-        cmds.undoInfo(closeChunk=True)
+        vb_name, axles = self.current_parts()
+        try:
+            avr_path.create_path_drive(vb_name, axles, sel[0], self.pre_text.text(), self.suf_text.text())
+        except ValueError as e:
+            om.MGlobal.displayWarning(str(e))
+
+    def update_paths(self):
+        updated = avr_path.update_paths()
+        om.MGlobal.displayInfo('Rebuilt {} path tables'.format(len(updated)))
+
+    def bake_ground_contact(self):
+        sel = cmds.ls(sl=1)
+        if len(sel) != 1:
+            om.MGlobal.displayWarning('Please select the terrain mesh!')
+            return
 
-    def rename_group_Wheel_BL_6(self):
-        cmds.undoInfo(openChunk=True)
+        start = cmds.playbackOptions(q=True, min=True)
+        end = cmds.playbackOptions(q=True, max=True)
+        vb_name, axles = self.current_parts()
+        try:
+            terrain.bake_ground_contact(vb_name, axles, sel[0], start, end, self.pre_text.text(), self.suf_text.text())
+        except (ImportError, RuntimeError) as e:
+            om.MGlobal.displayWarning(str(e))
 
-        wbl_name = self.Wheel_BL_text_6.text()
-        avr.rename_group_model_object(wbl_name)
+    def bake_cache(self):
+        path = QtWidgets.QFileDialog.getSaveFileName(self, 'Bake Transform Cache', '', 'AVR Cache (*.npy)')[0]
+        if not path:
+            return
 
-        cmds.undoInfo(closeChunk=True)
+        vb_name, axles = self.current_parts()
+        joints = avr_cache.rig_joints(vb_name, axles, self.pre_text.text(), self.suf_text.text())
+        start = cmds.playbackOptions(q=True, min=True)
+        end = cmds.playbackOptions(q=True, max=True)
+        try:
+            avr_cache.bake_cache(joints, start, end, path)
+        except (ImportError, ValueError) as e:
+            om.MGlobal.displayWarning(str(e))
 
-    def rename_group_Wheel_BR_4(self):
-        cmds.undoInfo(openChunk=True)
+    def attach_cache(self):
+        path = QtWidgets.QFileDialog.getOpenFileName(self, 'Play From Cache', '', 'AVR Cache (*.npy)')[0]
+        if not path:
+            return
 
-        wbr_name = self.Wheel_BR_text_4.text()
-        avr.rename_group_model_object(wbr_name)
+        avr_cache.attach_cache(path)
 
-        cmds.undoInfo(closeChunk=True)
+    def toggle_profile(self, checked):
+        if checked:
+            avr_profile.reset()
+            avr_profile.enable()
+        else:
+            avr_profile.disable()
 
-    def rename_group_Wheel_BR_6(self):
-        cmds.undoInfo(openChunk=True)
+    def export_profile(self):
+        if not avr_profile.events():
+            om.MGlobal.displayWarning('Nothing recorded yet, please turn on profiling and run some steps!')
+            return
 
-        wbr_name = self.Wheel_BR_text_6.text()
-        avr.rename_group_model_object(wbr_name)
+        path = QtWidgets.QFileDialog.getSaveFileName(self, 'Export Profile', '',
+                                                     'JSON (*.json);;Chrome Trace (*.trace.json)')[0]
+        if not path:
+            return
 
-        cmds.undoInfo(closeChunk=True)
+        avr_profile.export(path)
+        print(avr_profile.summary())
+        om.MGlobal.displayInfo('Profile saved to {}'.format(path))
 
-    def create_joints(self):
-        cmds.undoInfo(openChunk=True)
+    def record_rig(self):
+        vb_name, axles = self.current_parts()
+        pivot = 'world' if self.pivot_cb.currentIndex() == 0 else 'object'
+        return avr_preset.record_rig(vb_name, axles, self.pre_text.text(), self.suf_text.text(), pivot,
+                                     avr.BIND_MODES[self.bind_cb.currentIndex()],
+                                     avr.CONSTRAINT_MODES[self.constraint_cb.currentIndex()],
+                                     self.spin_cb.isChecked(), self.combine_cb.isChecked())
 
-        prefix = self.pre_text.text()
-        suffix = self.suf_text.text()
-        if not prefix and not suffix:
-            om.MGlobal.displayWarning('Please enter a prefix or a suffix!')
+    def save_preset(self):
+        try:
+            definition = self.record_rig()
+        except ValueError as e:
+            om.MGlobal.displayWarning(str(e))
             return
 
-        rule = re.compile(r'^[a-zA-Z_].*$')
+        path = QtWidgets.QFileDialog.getSaveFileName(self, 'Save Rig Preset', '', 'AVR Rig (*.json)')[0]
+        if path:
+            avr_preset.save(definition, path)
 
-        if prefix and not rule.match(prefix):
-            om.MGlobal.displayWarning("Prefix name should start with 'a-z', 'A-Z', or'_'")
+    def build_preset(self):
+        path = QtWidgets.QFileDialog.getOpenFileName(self, 'Build From Preset', '', 'AVR Rig (*.json)')[0]
+        if not path:
             return
 
-        if self.tab_widget.currentIndex() == 0:
-            vb_name = self.VehicleBody_text_2.text()
-            wf_name = self.Wheel_F_text_2.text()
-            wb_name = self.Wheel_B_text_2.text()
-            avr.create_joints_2w(vb_name, wf_name, wb_name, prefix, suffix)
-        elif self.tab_widget.currentIndex() == 1:
-            vb_name = self.VehicleBody_text_4.text()
-            wfl_name = self.Wheel_FL_text_4.text()
-            wfr_name = self.Wheel_FR_text_4.text()
-            wbl_name = self.Wheel_BL_text_4.text()
-            wbr_name = self.Wheel_BR_text_4.text()
-            avr.create_joints_4w(vb_name, wfl_name, wfr_name, wbl_name, wbr_name, prefix, suffix)
-        elif self.tab_widget.currentIndex() == 2:
-            vb_name = self.VehicleBody_text_6.text()
-            wfl_name = self.Wheel_FL_text_6.text()
-            wfr_name = self.Wheel_FR_text_6.text()
-            wml_name = self.Wheel_ML_text_6.text()
-            wmr_name = self.Wheel_MR_text_6.text()
-            wbl_name = self.Wheel_BL_text_6.text()
-            wbr_name = self.Wheel_BR_text_6.text()
-            avr.create_joints_6w(vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name, prefix, suffix)
-
-        cmds.undoInfo(closeChunk=True)
-
-    def bind_skin(self):
-        cmds.undoInfo(openChunk=True)
+        try:
+            avr_preset.build_rig(avr_preset.load(path))
+        except (ValueError, RuntimeError) as e:
+            om.MGlobal.displayWarning(str(e))
 
+    def update_rig(self):
+        vb_name, _ = self.current_parts()
         try:
-            prefix = self.pre_text.text()
-            suffix = self.suf_text.text()
-            if self.tab_widget.currentIndex() == 0:
-                vb_name = self.VehicleBody_text_2.text()
-                wf_name = self.Wheel_F_text_2.text()
-                wb_name = self.Wheel_B_text_2.text()
-                avr.bind_skin_2w(vb_name, wf_name, wb_name, prefix, suffix)
-            elif self.tab_widget.currentIndex() == 1:
-                vb_name = self.VehicleBody_text_4.text()
-                wfl_name = self.Wheel_FL_text_4.text()
-                wfr_name = self.Wheel_FR_text_4.text()
-                wbl_name = self.Wheel_BL_text_4.text()
-                wbr_name = self.Wheel_BR_text_4.text()
-                avr.bind_skin_4w(vb_name, wfl_name, wfr_name, wbl_name, wbr_name, prefix, suffix)
-            elif self.tab_widget.currentIndex() == 2:
-                vb_name = self.VehicleBody_text_6.text()
-                wfl_name = self.Wheel_FL_text_6.text()
-                wfr_name = self.Wheel_FR_text_6.text()
-                wml_name = self.Wheel_ML_text_6.text()
-                wmr_name = self.Wheel_MR_text_6.text()
-                wbl_name = self.Wheel_BL_text_6.text()
-                wbr_name = self.Wheel_BR_text_6.text()
-                avr.bind_skin_6w(vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name, prefix, suffix)
-        except ValueError:
-            om.MGlobal.displayWarning('Please make sure that each part of the model and joints are named correctly!')
-            return
-        except RuntimeError:
-            om.MGlobal.displayWarning('Unknown RuntimeError: Please check the scene or bind the skin manually!')
+            report = avr_preset.update_rig(vb_name, self.pre_text.text(), self.suf_text.text())
+        except ValueError as e:
+            om.MGlobal.displayWarning(str(e))
             return
 
-        cmds.undoInfo(closeChunk=True)
+        changed = sorted(set(report['rebound'] + report['replaced'] + report['reconstrained']))
+        om.MGlobal.displayInfo('Updated: {}'.format(', '.join(changed)) if changed else 'The rig is up to date')
 
-    def create_controllers(self):
-        cmds.undoInfo(openChunk=True)
+    def replicate_rig(self):
+        vb_name, _ = self.current_parts()
+        try:
+            copies = avr_replicate.replicate_rig(vb_name, self.copies_sb.value(), self.pre_text.text(),
+                                                 self.suf_text.text())
+        except ValueError as e:
+            om.MGlobal.displayWarning(str(e))
+            return
 
-        prefix = self.pre_text.text()
-        suffix = self.suf_text.text()
-        if self.tab_widget.currentIndex() == 0:
-            vb_name = self.VehicleBody_text_2.text()
-            wf_name = self.Wheel_F_text_2.text()
-            wb_name = self.Wheel_B_text_2.text()
-            avr.create_controllers_2w(vb_name, wf_name, wb_name, prefix, suffix)
-        elif self.tab_widget.currentIndex() == 1:
-            vb_name = self.VehicleBody_text_4.text()
-            wfl_name = self.Wheel_FL_text_4.text()
-            wfr_name = self.Wheel_FR_text_4.text()
-            wbl_name = self.Wheel_BL_text_4.text()
-            wbr_name = self.Wheel_BR_text_4.text()
-            avr.create_controllers_4w(vb_name, wfl_name, wfr_name, wbl_name, wbr_name, prefix, suffix)
-        elif self.tab_widget.currentIndex() == 2:
-            vb_name = self.VehicleBody_text_6.text()
-            wfl_name = self.Wheel_FL_text_6.text()
-            wfr_name = self.Wheel_FR_text_6.text()
-            wml_name = self.Wheel_ML_text_6.text()
-            wmr_name = self.Wheel_MR_text_6.text()
-            wbl_name = self.Wheel_BL_text_6.text()
-            wbr_name = self.Wheel_BR_text_6.text()
-            avr.create_controllers_6w(vb_name, wfl_name, wfr_name, wml_name, wmr_name, wbl_name, wbr_name, prefix, suffix)
-
-        cmds.undoInfo(closeChunk=True)
+        om.MGlobal.displayInfo('Replicated into {}'.format(', '.join(sorted(copies))))
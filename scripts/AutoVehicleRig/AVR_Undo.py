@@ -0,0 +1,47 @@
+# -*- coding: UTF-8 -*-
+# Scripted plug-in that puts OpenMaya modifiers on Maya's undo queue.
+# AVR_Base runs a modifier, appends it to PENDING and calls 'avrUndo', which takes it over so that
+# Ctrl+Z / Ctrl+Y undo and redo the whole modifier in one step.
+import maya.OpenMayaMPx as ompx
+
+
+COMMAND_NAME = 'avrUndo'
+PENDING = []
+
+
+class AVRUndo(ompx.MPxCommand):
+
+    def __init__(self):
+        super(AVRUndo, self).__init__()
+        self.modifier = None
+
+    def doIt(self, args):
+        # Maya may load this file under another module name, always use the package's queue
+        from AutoVehicleRig import AVR_Undo
+        if AVR_Undo.PENDING:
+            self.modifier = AVR_Undo.PENDING.pop(0)
+
+    def redoIt(self):
+        if self.modifier:
+            self.modifier.doIt()
+
+    def undoIt(self):
+        if self.modifier:
+            self.modifier.undoIt()
+
+    def isUndoable(self):
+        return True
+
+
+def creator():
+    return ompx.asMPxPtr(AVRUndo())
+
+
+def initializePlugin(mobject):
+    plugin = ompx.MFnPlugin(mobject, 'YE-ZA', '1.0')
+    plugin.registerCommand(COMMAND_NAME, creator)
+
+
+def uninitializePlugin(mobject):
+    plugin = ompx.MFnPlugin(mobject)
+    plugin.deregisterCommand(COMMAND_NAME)
@@ -0,0 +1,189 @@
+# -*- coding: UTF-8 -*-
+# Evaluation checks for finished rigs: find what keeps a rig from evaluating in parallel, from cached
+# playback, or adds nodes it does not need, and fix what can be fixed automatically.
+#
+# check_rig() returns a plain dictionary, ready for json.dump() in batch QC:
+#
+#   {
+#     "rig": "VehicleBody_Jnt",
+#     "issues": [{"check": "constraints", "nodes": ["Wheel_FL_Jnt", ...], "fixable": true,
+#                 "message": "..."}, ...],
+#     "fixed": ["constraints", ...],
+#     "fps": {"before": 212.4, "after": 380.9}
+#   }
+#
+# Checks, in the order they are reported:
+#   evaluation_mode : the scene evaluates in DG or serial mode instead of parallel
+#   history         : rig meshes with construction history in front of them, or in front of their skinCluster's
+#                     input shape
+#   expressions     : expressions driving rig nodes, which force serial evaluation and block cached playback
+#   frozen          : joints or controllers that are frozen or have a nodeState, so they stop updating
+#   single_skins    : parts whose meshes are skinned to their joint alone, a rigid attachment needs no deformers
+#   constraints     : point/orient constraint pairs, one multMatrix per joint does the same work
+#   unused_nodes    : rig utility nodes that no longer drive anything
+# Expressions are only reported, the rest is fixed by fix_rig().
+import AutoVehicleRig.AVR_Base as avr
+import AutoVehicleRig.AVR_Preset as avr_preset
+import maya.cmds as cmds
+import time
+
+
+CHECKS = ('evaluation_mode', 'history', 'expressions', 'frozen', 'single_skins', 'constraints', 'unused_nodes')
+
+# Utility nodes the rig steps create, by the name they are given: per part, per joint and per body
+_PART_NODES = ('{part}_Rigid_MM', '{part}_Spin_MDL', '{part}_AutoSpin_MDL', '{joint}_MM')
+_BODY_NODES = ('{part}_Travel_ADL', '{part}_Proxy_Rev', '{part}_Proxy_State')
+
+
+def _issue(check, nodes, message, fixable=True):
+    return {'check': check, 'nodes': list(nodes), 'message': message, 'fixable': fixable}
+
+
+def _rig_nodes(vb_name, axles, prefix, suffix):
+    # Part names, joints, controllers and the utility nodes of a rig that exist in the scene
+    names = [vb_name] + avr.wheel_names(axles)
+    joints = [prefix + name + suffix for name in names]
+    ctrls = cmds.ls([name + '_Ctrl' for name in names] + [name + '_Ctrl_Spin' for name in names[1:]])
+    candidates = [pattern.format(part=name, joint=jnt) for name, jnt in zip(names, joints) for pattern in _PART_NODES]
+    candidates += [pattern.format(part=vb_name) for pattern in _BODY_NODES]
+    return names, joints, ctrls, cmds.ls(candidates)
+
+
+def validate_rig(vb_name, axles, prefix='', suffix='_Jnt'):
+    # [issue] for everything that slows the rig down, see the checks above
+    names, joints, ctrls, utilities = _rig_nodes(vb_name, axles, prefix, suffix)
+    issues = []
+
+    mode = cmds.evaluationManager(q=True, mode=True)[0]
+    if mode != 'parallel':
+        issues.append(_issue('evaluation_mode', [], "The scene evaluates in '{}' mode, not in parallel".format(mode)))
+
+    # Anything but a skinCluster feeding a mesh is construction history, and so is anything feeding the
+    # undeformed input shape of a skinCluster, reported by its mesh transform
+    shapes = cmds.ls(names, dag=1, et='mesh', ni=1)
+    if shapes:
+        sources = cmds.listConnections([shape + '.inMesh' for shape in shapes], s=1, d=0, c=1) or []
+        skins = set(cmds.ls(sources[1::2], type='skinCluster'))
+        history = [plug.split('.', 1)[0] for plug, source in zip(sources[::2], sources[1::2]) if source not in skins]
+        inputs = cmds.ls(names, dag=1, et='mesh', io=1)
+        fed = cmds.listConnections([shape + '.inMesh' for shape in inputs], s=1, d=0, c=1) if inputs else None
+        if fed:
+            history += cmds.listRelatives([plug.split('.', 1)[0] for plug in fed[::2]], p=1)
+        if history:
+            issues.append(_issue('history', history, '{} meshes still have construction history'.format(len(history))))
+
+    expressions = cmds.listConnections(joints + ctrls + utilities, s=1, d=0, type='expression') or []
+    if expressions:
+        issues.append(_issue('expressions', sorted(set(expressions)),
+                             'Expressions drive the rig, it cannot evaluate in parallel or be cached', False))
+
+    frozen = [node for node in joints + ctrls
+              if cmds.getAttr(node + '.frozen') or cmds.getAttr(node + '.nodeState')]
+    if frozen:
+        issues.append(_issue('frozen', frozen, '{} rig nodes are frozen or disabled'.format(len(frozen))))
+
+    # A part whose meshes all have a skinCluster of their own with the part's joint as the only influence
+    single = []
+    for name, jnt in zip(names, joints):
+        clusters = set(avr_preset.skinned_meshes(jnt).values())
+        if clusters and all(cmds.skinCluster(cluster, q=True, influence=True) == [jnt] for cluster in clusters):
+            single.append(name)
+    if single:
+        issues.append(_issue('single_skins', single,
+                             '{} parts are skinned to one joint each, a rigid attachment needs no deformers'
+                             .format(len(single))))
+
+    constrained = [jnt for jnt in joints if cmds.listRelatives(jnt, type=['pointConstraint', 'orientConstraint'])]
+    if constrained:
+        issues.append(_issue('constraints', constrained,
+                             '{} joints use constraint pairs instead of one matrix connection'.format(len(constrained))))
+
+    if utilities:
+        connected = cmds.listConnections(utilities, s=0, d=1, c=1) or []
+        used = set(plug.split('.', 1)[0] for plug in connected[::2])
+        unused = [node for node in utilities if node not in used]
+        if unused:
+            issues.append(_issue('unused_nodes', unused, '{} rig utility nodes drive nothing'.format(len(unused))))
+
+    return issues
+
+
+def _fix_single_skins(vb_name, axles, prefix, suffix, parts):
+    # Unbind the part and let its group follow the joint as it was at rest, recorded or current
+    definition = avr_preset.stored(vb_name, prefix, suffix) or {'joints': {}}
+    for name in parts:
+        jnt = prefix + name + suffix
+        for cluster in set(avr_preset.skinned_meshes(jnt).values()):
+            cmds.skinCluster(cluster, e=True, unbind=True)
+        rest = definition['joints'].get(name)
+        avr.attach_rigid(name, jnt, avr.to_mmatrix(rest) if rest else None)
+
+    if definition.get('vehicle') and len(parts) == len(definition['joints']):
+        definition['bind'] = 'rigid'
+        avr_preset.store(definition)
+
+
+@avr.fast_step
+def fix_rig(vb_name, axles, prefix='', suffix='_Jnt', issues=None):
+    # Fix the fixable issues, found by validate_rig() unless given, and return the checks that were fixed
+    issues = validate_rig(vb_name, axles, prefix, suffix) if issues is None else issues
+    fixed = []
+    for issue in issues:
+        if not issue['fixable']:
+            continue
+
+        check, nodes = issue['check'], issue['nodes']
+        if check == 'evaluation_mode':
+            cmds.evaluationManager(mode='parallel')
+        elif check == 'history':
+            cmds.bakePartialHistory(nodes, prePostDeformers=True)  # Keeps the skinClusters
+        elif check == 'frozen':
+            for node in nodes:
+                cmds.setAttr(node + '.frozen', 0)
+                cmds.setAttr(node + '.nodeState', 0)
+        elif check == 'single_skins':
+            _fix_single_skins(vb_name, axles, prefix, suffix, nodes)
+        elif check == 'constraints':
+            avr.convert_constraints(vb_name, axles, prefix, suffix)
+        elif check == 'unused_nodes':
+            cmds.delete(nodes)
+        fixed.append(check)
+    return fixed
+
+
+def measure_playback(start=None, end=None, plugs=None):
+    # Frames per second for playing the playback range frame by frame, without drawing. Every frame is set
+    # with an update, so the evaluation manager evaluates the whole scene like playback does, while the
+    # viewport stays suspended. The plugs (by default the world matrix of every joint) are read on top, so a
+    # rig the scene evaluation leaves dirty is still computed.
+    start = cmds.playbackOptions(q=True, min=True) if start is None else start
+    end = cmds.playbackOptions(q=True, max=True) if end is None else end
+    current = cmds.currentTime(q=True)
+
+    if plugs is None:
+        plugs = [joint + '.worldMatrix[0]' for joint in cmds.ls(type='joint')]
+
+    frames = range(int(start), int(end) + 1)
+    with avr.fast_execution('measure_playback', undo=False):
+        begin = time.time()
+        for frame in frames:
+            cmds.currentTime(frame, e=True, update=True)
+            for plug in plugs:
+                cmds.getAttr(plug)
+        elapsed = time.time() - begin
+        cmds.currentTime(current, e=True, update=True)
+    return len(frames) / elapsed if elapsed > 0 else None
+
+
+def check_rig(vb_name, axles, prefix='', suffix='_Jnt', fix=False, playback=False):
+    # Validate, optionally fix, and optionally time playback before and after, as one JSON-ready report
+    report = {'rig': prefix + vb_name + suffix, 'issues': validate_rig(vb_name, axles, prefix, suffix),
+              'fixed': [], 'fps': {}}
+    plugs = [joint + '.worldMatrix[0]' for joint in _rig_nodes(vb_name, axles, prefix, suffix)[1]]
+    if playback:
+        report['fps']['before'] = measure_playback(plugs=plugs)
+    if fix and report['issues']:
+        report['fixed'] = fix_rig(vb_name, axles, prefix, suffix, report['issues'])
+        if playback:
+            report['fps']['after'] = measure_playback(plugs=plugs)
+    return report